@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the grid mapping routines in ecco_cloud_utils.mapping
+
+usage: python benchmark_mapping.py [factors] [operations] [backends]
+
+    factors    : build time of the mapping factors versus target grid size
+    operations : time of each mapping operation, the median, nanmedian
+                 and nearest operations versus the per cell loop
+    backends   : checks that the numpy and numba backends of every mapping
+                 operation give identical results on fields with nans
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pyresample as pr
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+import ecco_cloud_utils as ea  # pylint: disable=import-error
+
+
+# %%
+def make_latlon_target_grid(target_res):
+
+    # lat-lon target grid with target_res degree spacing and the
+    # effective radius of each target grid cell
+    lons_1D = np.arange(-180 + target_res/2, 180, target_res)
+    lats_1D = np.arange(-90 + target_res/2, 90, target_res)
+    lons, lats = np.meshgrid(lons_1D, lats_1D)
+
+    target_grid = pr.geometry.SwathDefinition(lons=lons.ravel(),
+                                              lats=lats.ravel())
+
+    area = ea.area_of_latlon_grid(-180, 180, -90, 90,
+                                  target_res, target_res,
+                                  less_output=True)['area']
+
+    target_grid_radius = np.sqrt(area / np.pi).ravel()
+
+    return target_grid, target_grid_radius
+
+
+# %%
+def make_latlon_source_grid(data_res=0.25):
+
+    proj_info = {'area_id': 'longlat',
+                 'area_name': 'Plate Carree',
+                 'proj_id': 'EPSG:4326',
+                 'proj4_args': '+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs'}
+
+    dims = [int(360/data_res), int(180/data_res)]
+
+    source_grid_min_L, source_grid_max_L, source_grid, _, _ = \
+        ea.generalized_grid_product('', data_res, 90 - data_res/2,
+                                    [-180, 90, 180, -90], dims, proj_info)
+
+    return source_grid, source_grid_min_L, source_grid_max_L
+
+
+# %%
+def benchmark_factors(target_resolutions=(4, 2, 1, 0.5), data_res=0.25):
+
+    # build time of the mapping factors from a data_res degree lat-lon
+    # source grid to lat-lon target grids of increasing size.
+    #   legacy   : find_mappings_from_source_to_target (dictionaries)
+    #   operator : find_mapping_operator_from_source_to_target (CSR arrays)
+
+    source_grid, source_grid_min_L, source_grid_max_L = \
+        make_latlon_source_grid(data_res)
+
+    print(f'source grid: {data_res} deg, {source_grid.size} cells')
+    print(f'{"target res":>10} {"cells":>10} {"legacy (s)":>12} '
+          f'{"operator (s)":>13} {"nnz":>12}')
+
+    for target_res in target_resolutions:
+        target_grid, target_grid_radius = make_latlon_target_grid(target_res)
+
+        t0 = time.perf_counter()
+        ea.find_mappings_from_source_to_target(source_grid, target_grid,
+                                               target_grid_radius,
+                                               source_grid_min_L,
+                                               source_grid_max_L)
+        t_legacy = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        mapping_operator = \
+            ea.find_mapping_operator_from_source_to_target(source_grid,
+                                                           target_grid,
+                                                           target_grid_radius,
+                                                           source_grid_min_L,
+                                                           source_grid_max_L)
+        t_operator = time.perf_counter() - t0
+
+        print(f'{target_res:>10} {target_grid.size:>10} {t_legacy:>12.2f} '
+              f'{t_operator:>13.2f} {len(mapping_operator["indices"]):>12}')
+
+
+# %%
+def loop_operation(mapping_operator, source_field, operation):
+
+    # reference per target cell loop, as done before the operations
+    # were vectorized
+    source_field_r = source_field.ravel()
+    source_on_target_grid = np.full(len(mapping_operator['nearest']), np.nan)
+
+    offsets = mapping_operator['offsets']
+    indices = mapping_operator['indices']
+
+    for i, row in enumerate(mapping_operator['rows']):
+        source_values = source_field_r[indices[offsets[i]:offsets[i+1]]]
+
+        if operation == 'median':
+            source_on_target_grid[row] = np.median(source_values)
+        elif operation == 'nanmedian':
+            source_on_target_grid[row] = np.nanmedian(source_values)
+        elif operation == 'nearest':
+            source_on_target_grid[row] = source_values[0]
+
+    return source_on_target_grid
+
+
+# %%
+def benchmark_operations(target_res=0.5, data_res=0.25, nan_fraction=0.1,
+                         operations=('mean', 'nanmean', 'median',
+                                     'nanmedian', 'nearest', 'count')):
+
+    # time of apply_mapping_operator for every operation on a data_res
+    # degree source field with nan_fraction nans.  median, nanmedian and
+    # nearest are compared with the per target cell loop.
+
+    source_grid, source_grid_min_L, source_grid_max_L = \
+        make_latlon_source_grid(data_res)
+    target_grid, target_grid_radius = make_latlon_target_grid(target_res)
+
+    mapping_operator = \
+        ea.find_mapping_operator_from_source_to_target(source_grid,
+                                                       target_grid,
+                                                       target_grid_radius,
+                                                       source_grid_min_L,
+                                                       source_grid_max_L)
+
+    rng = np.random.default_rng(0)
+    source_field = rng.normal(size=source_grid.shape)
+    source_field[rng.random(source_grid.shape) < nan_fraction] = np.nan
+
+    print(f'source grid: {data_res} deg, target grid: {target_res} deg, '
+          f'nnz: {len(mapping_operator["indices"])}, '
+          f'numba installed: {ea.mapping.numba is not None}')
+    print(f'{"operation":>10} {"vectorized (s)":>15} {"loop (s)":>10} '
+          f'{"speedup":>8}')
+
+    for operation in operations:
+        t0 = time.perf_counter()
+        ea.apply_mapping_operator(mapping_operator, source_field,
+                                  operation=operation,
+                                  allow_nearest_neighbor=False)
+        t_vectorized = time.perf_counter() - t0
+
+        if operation in ['median', 'nanmedian', 'nearest']:
+            t0 = time.perf_counter()
+            loop_operation(mapping_operator, source_field, operation)
+            t_loop = time.perf_counter() - t0
+
+            print(f'{operation:>10} {t_vectorized:>15.3f} {t_loop:>10.3f} '
+                  f'{t_loop / t_vectorized:>8.1f}')
+        else:
+            print(f'{operation:>10} {t_vectorized:>15.3f} {"":>10} {"":>8}')
+
+
+# %%
+def check_backends(target_res=2, data_res=0.5, nan_fraction=0.1,
+                   num_records=3):
+
+    # checks that every operation gives the same result with the numpy and
+    # numba backends, for a stack of fields with nan_fraction nans and with
+    # and without nearest neighbors.  median, nanmedian and nearest are also
+    # checked against the per target cell loop.  without numba installed the
+    # kernels run as plain python, so the default grids are small.
+
+    source_grid, source_grid_min_L, source_grid_max_L = \
+        make_latlon_source_grid(data_res)
+    target_grid, target_grid_radius = make_latlon_target_grid(target_res)
+
+    mapping_operator = \
+        ea.find_mapping_operator_from_source_to_target(source_grid,
+                                                       target_grid,
+                                                       target_grid_radius,
+                                                       source_grid_min_L,
+                                                       source_grid_max_L)
+
+    rng = np.random.default_rng(0)
+    source_stack = rng.normal(size=(num_records, source_grid.size))
+    source_stack[rng.random(source_stack.shape) < nan_fraction] = np.nan
+
+    print(f'source grid: {data_res} deg, target grid: {target_res} deg, '
+          f'{num_records} records, '
+          f'numba installed: {ea.mapping.numba is not None}')
+
+    all_equal = True
+
+    for operation in ea.mapping.MAPPING_OPERATIONS:
+        for allow_nearest_neighbor in [True, False]:
+            results = {backend: ea.transform_stack_to_target_grid(
+                           mapping_operator, source_stack,
+                           operation=operation,
+                           allow_nearest_neighbor=allow_nearest_neighbor,
+                           backend=backend)
+                       for backend in ['numpy', 'numba']}
+
+            equal = np.array_equal(results['numpy'], results['numba'],
+                                   equal_nan=True)
+
+            if operation in ['median', 'nanmedian', 'nearest'] and \
+                    not allow_nearest_neighbor:
+                loop_results = np.stack([
+                    loop_operation(mapping_operator, source_field, operation)
+                    for source_field in source_stack])
+                equal = equal and np.array_equal(results['numpy'],
+                                                 loop_results, equal_nan=True)
+
+            all_equal = all_equal and equal
+
+            print(f'{operation:>10} nearest neighbor: '
+                  f'{str(allow_nearest_neighbor):>5} '
+                  f'{"identical" if equal else "DIFFERENT"}')
+
+    if not all_equal:
+        raise AssertionError('numpy and numba backends differ')
+
+
+# %%
+if __name__ == '__main__':
+    benchmarks = sys.argv[1:] if len(sys.argv) > 1 else ['factors']
+
+    if 'factors' in benchmarks:
+        benchmark_factors()
+
+    if 'operations' in benchmarks:
+        benchmark_operations()
+
+    if 'backends' in benchmarks:
+        check_backends()
@@ -5,12 +5,25 @@ from .date_time import months2days
 from .llc_array_conversion import llc_tiles_to_compact
 from .llc_array_conversion import llc_tiles_to_faces
 from .llc_array_conversion import llc_faces_to_compact
+from .llc_array_conversion import llc_tiles_to_compact_records
 
 from .records import make_empty_record
 from .records import save_to_disk
+from .records import binary_records
 
 from .mapping import find_mappings_from_source_to_target
+from .mapping import find_mapping_operator_from_source_to_target
 from .mapping import transform_to_target_grid
+from .mapping import compile_mapping_operator
+from .mapping import compile_mapping_factors
+from .mapping import apply_mapping_operator
+from .mapping import transform_stack_to_target_grid
+from .mapping import remap_mapping_operator_source
+from .mapping import compress_mapping_operator
+from .mapping import save_mapping_operator
+from .mapping import load_mapping_operator
+from .mapping import is_mapping_operator_dir
+from .mapping import convert_mapping_factors_pickle
 
 from .geometry import area_of_latlon_grid_cell
 from .geometry import area_of_latlon_grid
@@ -18,8 +31,10 @@ from .geometry import area_of_latlon_grid
 from .generalized_functions import generalized_grid_product
 from .generalized_functions import generalized_process_loop
 from .generalized_functions import generalized_aggregate_and_save
+from .generalized_functions import monthly_means
 from .generalized_functions import generalized_get_data_filepaths_for_year
 from .generalized_functions import generalized_transform_to_model_grid_solr
+from .generalized_functions import generalized_transform_fields_to_model_grid_solr
 
 from .specific_functions import *
 
@@ -175,64 +175,107 @@ def generalized_transform_to_model_grid_solr(data_field_info, record_date, model
                                              extra_information, ds, factors,
                                              time_zone_included_with_time,
                                              model_grid_name):
-    # initialize notes for this record
-    record_notes = ''
 
-    source_indices_within_target_radius_i, \
-        num_source_indices_within_target_radius_i, \
-        nearest_source_index_to_target_index_i = factors
+    # factors are either the tuple from find_mappings_from_source_to_target
+    # or already compiled into a mapping operator
+    if not isinstance(factors, dict):
+        factors = ea.compile_mapping_factors(factors)
+
+    return generalized_transform_fields_to_model_grid_solr([data_field_info], record_date, model_grid,
+                                                           model_grid_type, array_precision,
+                                                           record_file_name, data_time_scale,
+                                                           extra_information, ds, factors,
+                                                           time_zone_included_with_time,
+                                                           model_grid_name)[0]
+# %%
 
-    # set data info values
-    data_field = data_field_info['name_s']
-    standard_name = data_field_info['standard_name_s']
-    long_name = data_field_info['long_name_s']
-    units = data_field_info['units_s']
+# %%
+# return list of data_DA, one for each field in data_fields_info
+
+
+def generalized_transform_fields_to_model_grid_solr(data_fields_info, record_date, model_grid,
+                                                    model_grid_type, array_precision,
+                                                    record_file_name, data_time_scale,
+                                                    extra_information, ds, factors,
+                                                    time_zone_included_with_time,
+                                                    model_grid_name):
+
+    # all fields of a granule share the source grid and the time axis, so
+    # fields with the same shape and type are stacked and mapped to the model
+    # grid in one pass, and time values are determined once
+
+    # factors must already be compiled into a mapping operator, so it is
+    # done once rather than for every granule (see
+    # generalized_transform_to_model_grid_solr for legacy factors)
+    if not isinstance(factors, dict):
+        raise TypeError('factors must be a mapping operator, compile legacy '
+                        'factors once with compile_mapping_factors')
+    mapping_operator = factors
+
+    data_DAs = []
+    orig_datas = []
+
+    for data_field_info in data_fields_info:
+        # set data info values
+        data_field = data_field_info['name_s']
+        standard_name = data_field_info['standard_name_s']
+        long_name = data_field_info['long_name_s']
+        units = data_field_info['units_s']
 
-    # create empty data array
-    data_DA = ea.make_empty_record(standard_name, long_name, units,
-                                   record_date,
-                                   model_grid, model_grid_type,
-                                   array_precision)
+        # create empty data array
+        data_DA = ea.make_empty_record(standard_name, long_name, units,
+                                       record_date,
+                                       model_grid, model_grid_type,
+                                       array_precision)
 
-    # print(data_DA)
+        # add some metadata to the newly formed data array object
+        data_DA.attrs['original_filename'] = record_file_name
+        data_DA.attrs['original_field_name'] = data_field
+        data_DA.attrs['interpolation_parameters'] = 'bin averaging'
+        data_DA.attrs['interpolation_code'] = 'pyresample'
+        data_DA.attrs['interpolation_date'] = \
+            str(np.datetime64(datetime.now(), 'D'))
 
-    # add some metadata to the newly formed data array object
-    data_DA.attrs['original_filename'] = record_file_name
-    data_DA.attrs['original_field_name'] = data_field
-    data_DA.attrs['interpolation_parameters'] = 'bin averaging'
-    data_DA.attrs['interpolation_code'] = 'pyresample'
-    data_DA.attrs['interpolation_date'] = \
-        str(np.datetime64(datetime.now(), 'D'))
+        data_DA.time.attrs['long_name'] = 'center time of averaging period'
 
-    data_DA.time.attrs['long_name'] = 'center time of averaging period'
+        data_DA.name = f'{data_field}_interpolated_to_{model_grid_name}'
+
+        if 'transpose' in extra_information:
+            orig_data = ds[data_field].values[0, :].T
+        else:
+            orig_data = ds[data_field].values
 
-    data_DA.name = f'{data_field}_interpolated_to_{model_grid_name}'
+        data_DAs.append(data_DA)
+        orig_datas.append(orig_data)
 
-    if 'transpose' in extra_information:
-        orig_data = ds[data_field].values[0, :].T
-    else:
-        orig_data = ds[data_field].values
+    # group the fields that have any valid data by shape and type
+    stacks = {}
+    for i, orig_data in enumerate(orig_datas):
+        # see if we have any valid data
+        if np.sum(~np.isnan(orig_data)) > 0:
+            stacks.setdefault((orig_data.shape, orig_data.dtype), []).append(i)
+        else:
+            print(
+                f' - CPU id {os.getpid()} empty granule for {record_file_name} (no data to transform to grid {model_grid_name})')
+            data_DAs[i].attrs['notes'] = ' -- empty record -- '
 
-    # see if we have any valid data
-    if np.sum(~np.isnan(orig_data)) > 0:
+    for field_indices in stacks.values():
+        source_stack = np.stack([orig_datas[i].ravel() for i in field_indices])
 
-        data_model_projection = ea.transform_to_target_grid(source_indices_within_target_radius_i,
-                                                            num_source_indices_within_target_radius_i,
-                                                            nearest_source_index_to_target_index_i,
-                                                            orig_data, model_grid.XC.shape)
+        data_model_projections = ea.transform_stack_to_target_grid(mapping_operator,
+                                                                   source_stack,
+                                                                   model_grid.XC.shape)
 
-        # put the new data values into the data_DA array.
-        # --where the mapped data are not nan, replace the original values
-        # --where they are nan, just leave the original values alone
-        data_DA.values = np.where(~np.isnan(data_model_projection),
-                                  data_model_projection, data_DA.values)
+        for i, data_model_projection in zip(field_indices, data_model_projections):
+            # put the new data values into the data_DA array.
+            # --where the mapped data are not nan, replace the original values
+            # --where they are nan, just leave the original values alone
+            data_DAs[i].values = np.where(~np.isnan(data_model_projection),
+                                          data_model_projection, data_DAs[i].values)
 
-    else:
-        print(
-            f' - CPU id {os.getpid()} empty granule for {record_file_name} (no data to transform to grid {model_grid_name})')
-        record_notes = record_notes + ' -- empty record -- '
+    # update time values, using the first record for all fields
+    data_DA = data_DAs[0]
 
-    # update time values
     if 'time_bounds_var' in extra_information:
         if 'Time_bounds' in ds.variables:
             data_DA.time_start.values[0] = ds.Time_bounds[0][0].values
@@ -288,13 +331,18 @@ def generalized_transform_to_model_grid_solr(data_field_info, record_date, model
     else:
         data_DA.time.values[0] = record_date
 
-    data_DA.attrs['notes'] = record_notes
+    for data_DA in data_DAs:
+        data_DA.time_start.values[0] = data_DAs[0].time_start.values[0]
+        data_DA.time_end.values[0] = data_DAs[0].time_end.values[0]
+        data_DA.time.values[0] = data_DAs[0].time.values[0]
 
-    data_DA.attrs['original_time'] = str(data_DA.time.values[0])
-    data_DA.attrs['original_time_start'] = str(data_DA.time_start.values[0])
-    data_DA.attrs['original_time_end'] = str(data_DA.time_end.values[0])
+        data_DA.attrs['notes'] = data_DA.attrs.get('notes', '')
 
-    return data_DA
+        data_DA.attrs['original_time'] = str(data_DA.time.values[0])
+        data_DA.attrs['original_time_start'] = str(data_DA.time_start.values[0])
+        data_DA.attrs['original_time_end'] = str(data_DA.time_end.values[0])
+
+    return data_DAs
 # %%
 
 # %%
@@ -505,6 +553,65 @@ def open_and_merge(data_field_info, iso_dates_for_year, assimilated_paths,
     return assimilated_data_DA_year_merged
 # %%
 
+# %%
+# returns the mean of the records of each month, by month
+
+
+def monthly_means(records, record_months, skipna_in_mean, remove_nan_days_from_data):
+    """
+    Averages the records (time first) of each month in a single pass, keeping
+    running sums, valid value counts and empty and non-empty record counts per
+    month. Records may come in any order. Records without any valid value add
+    nothing to the sums, so no copy of a month is made to drop them. The means
+    match mean(axis=0, skipna=skipna_in_mean) over the records of each month,
+    after dropping its empty records when remove_nan_days_from_data.
+    """
+    totals = {}
+    counts = {}
+    nonempty_days = {}
+    empty_days = {}
+
+    for record, month in zip(records, record_months):
+        valid = ~np.isnan(record)
+
+        if not valid.any():
+            empty_days[month] = empty_days.get(month, 0) + 1
+            continue
+
+        nonempty_days[month] = nonempty_days.get(month, 0) + 1
+
+        if skipna_in_mean:
+            record = np.where(valid, record, 0)
+            if month in counts:
+                counts[month] += valid
+            else:
+                counts[month] = valid.astype(np.intp)
+
+        if month in totals:
+            totals[month] += record
+        else:
+            totals[month] = record.copy()
+
+    means = {}
+    for month in set(empty_days) | set(nonempty_days):
+        # a month without any valid value, or averaging an empty day
+        # without skipping nans, gives nans everywhere
+        if month not in totals or \
+                (month in empty_days and not skipna_in_mean and not remove_nan_days_from_data):
+            means[month] = np.full(np.shape(records[0]), np.nan, dtype=records[0].dtype)
+            continue
+
+        with np.errstate(invalid='ignore'):
+            if skipna_in_mean:
+                means[month] = np.true_divide(totals[month], counts[month],
+                                              out=totals[month], casting='unsafe')
+            else:
+                means[month] = np.true_divide(totals[month], np.intp(nonempty_days[month]),
+                                              out=totals[month], casting='unsafe')
+
+    return means
+# %%
+
 # %%
 # returns nothing
 
@@ -524,7 +631,13 @@ def generalized_aggregate_and_save(DS_year_merged,
                                    save_netcdf=True,
                                    remove_nan_days_from_data=False,
                                    data_time_scale='DAILY',
-                                   uuids=[]):
+                                   uuids=[],
+                                   checksums=None):
+
+    # when a checksums dictionary is given, it is filled with the md5
+    # checksums of the files saved, by filename key ('shortest' and
+    # 'monthly') and file type ('binary' and 'netcdf')
+    checksum_algorithm = 'md5' if checksums is not None else None
 
     # if everything comes back nans it means there were no files
     # to load for the entire year.  don't bother saving the
@@ -557,6 +670,12 @@ def generalized_aggregate_and_save(DS_year_merged,
                 DS_year_merged.time_bnds.values[-1][-1])[0:19]
 
         if do_monthly_aggregation:
+            # means of each month, in one pass over the records of the year
+            year_DA = DS_year_merged[data_var]
+            mon_means = monthly_means(year_DA.values,
+                                      year_DA.time.values.astype('datetime64[M]'),
+                                      skipna_in_mean, remove_nan_days_from_data)
+
             mon_DS_year = []
             for month in range(1, 13):
                 # to find the last day of the month, we go up one month,
@@ -573,18 +692,12 @@ def generalized_aggregate_and_save(DS_year_merged,
                                                  '-' + str(1).zfill(2), 'ns')
 
                 mon_str = str(year) + '-' + str(month).zfill(2)
-                cur_mon = DS_year_merged[data_var].sel(time=mon_str)
-
-                if remove_nan_days_from_data:
-                    nonnan_days = []
-                    for i in range(len(cur_mon)):
-                        if(np.count_nonzero(~np.isnan(cur_mon[i].values)) > 0):
-                            nonnan_days.append(cur_mon[i])
-                    if nonnan_days:
-                        cur_mon = xr.concat((nonnan_days), dim='time')
 
-                mon_DA = cur_mon.mean(
-                    axis=0, skipna=skipna_in_mean, keep_attrs=True)
+                # the first record supplies the attributes and the
+                # non-time coordinates of the month
+                mon_DA = year_DA.isel(time=0, drop=True).copy(
+                    data=mon_means[np.datetime64(mon_str, 'M')])
+                mon_DA.encoding = {}
 
                 tb, ct = ea.make_time_bounds_from_ds64(cur_mon_year, 'AVG_MON')
 
@@ -639,24 +752,30 @@ def generalized_aggregate_and_save(DS_year_merged,
             np.where(np.isnan(DS_year_merged[data_var].values),
                      fill_values['netcdf'], DS_year_merged[data_var].values)
 
-        ea.save_to_disk(DS_year_merged,
-                        filenames['shortest'],
-                        fill_values['binary'], fill_values['netcdf'],
-                        output_dirs['netcdf'], output_dirs['binary'],
-                        binary_dtype, model_grid_type, save_binary=save_binary,
-                        save_netcdf=save_netcdf, data_var=data_var)
+        shortest_checksums = ea.save_to_disk(DS_year_merged,
+                                             filenames['shortest'],
+                                             fill_values['binary'], fill_values['netcdf'],
+                                             output_dirs['netcdf'], output_dirs['binary'],
+                                             binary_dtype, model_grid_type, save_binary=save_binary,
+                                             save_netcdf=save_netcdf, data_var=data_var,
+                                             checksum_algorithm=checksum_algorithm)
+        if checksums is not None:
+            checksums['shortest'] = shortest_checksums
 
         if do_monthly_aggregation:
             mon_DS_year_merged[data_var].values = \
                 np.where(np.isnan(mon_DS_year_merged[data_var].values),
                          fill_values['netcdf'], mon_DS_year_merged[data_var].values)
 
-            ea.save_to_disk(mon_DS_year_merged,
-                            filenames['monthly'],
-                            fill_values['binary'], fill_values['netcdf'],
-                            output_dirs['netcdf'], output_dirs['binary'],
-                            binary_dtype, model_grid_type, save_binary=save_binary,
-                            save_netcdf=save_netcdf, data_var=data_var)
+            monthly_checksums = ea.save_to_disk(mon_DS_year_merged,
+                                                filenames['monthly'],
+                                                fill_values['binary'], fill_values['netcdf'],
+                                                output_dirs['netcdf'], output_dirs['binary'],
+                                                binary_dtype, model_grid_type, save_binary=save_binary,
+                                                save_netcdf=save_netcdf, data_var=data_var,
+                                                checksum_algorithm=checksum_algorithm)
+            if checksums is not None:
+                checksums['monthly'] = monthly_checksums
 
         ## END   SAVE TO DISK                                ##
         #######################################################
@@ -47,6 +47,50 @@ def llc_tiles_to_compact(data_tiles, less_output = False):
     return data_compact
 
 
+def llc_tiles_to_compact_records(data_tiles, dtype=None):
+    """
+
+    Converts any number of records in the '13 tiles' format of the LLC
+    grids to the 'compact' format at once. Tiles 1-7 are already in
+    compact order, and the rotated tiles 8-10 and 11-13 are interleaved
+    row by row, so the whole conversion is one permutation of the axes
+    (j, tile, i) of the rotated tiles, done with strided copies instead
+    of going through the faces.
+
+    Parameters
+    ----------
+    data_tiles : ndarray
+        a numpy array organized by ... x 13 x llc x llc
+
+    dtype : data-type, optional, default data_tiles.dtype
+        the dtype of data_compact, e.g. a big-endian dtype for flat binary
+        files.  Values are cast while being rearranged
+
+    Returns
+    -------
+    data_compact : ndarray
+        a numpy array of dimension ... x 13*llc x llc
+
+    """
+
+    dims = data_tiles.shape
+    llc = dims[-1]
+    lead = dims[:-3]
+
+    data_compact = np.empty(lead + (13*llc, llc),
+                            dtype=data_tiles.dtype if dtype is None else dtype)
+
+    # tiles 1-7 (faces 1, 2 and 3)
+    data_compact[..., :7*llc, :] = data_tiles[..., :7, :, :].reshape(lead + (7*llc, llc))
+
+    # tiles 8-10 (face 4) and 11-13 (face 5): row j of the three tiles of a
+    # face are consecutive rows of the compact array
+    for t in [7, 10]:
+        data_compact[..., t*llc:(t+3)*llc, :].reshape(lead + (llc, 3, llc))[:] = \
+            np.swapaxes(data_tiles[..., t:t+3, :, :], -3, -2)
+
+    return data_compact
+
 
 def llc_tiles_to_faces(data_tiles, less_output=False):
     """
@@ -4,82 +4,985 @@ Created on Sun Jun 21 19:28:40 2020
 
 @author: Ian
 """
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+
 import numpy as np
 import pyresample as pr
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# version of the on-disk mapping operator format written by
+# save_mapping_operator.  increment when the layout changes.
+MAPPING_OPERATOR_FORMAT_VERSION = 1
+
+MAPPING_OPERATOR_ARRAYS = ['rows', 'offsets', 'indices', 'nearest']
+
+# arrays of mapping operators compressed to the wet points of the target
+# grid by compress_mapping_operator
+COMPRESSED_MAPPING_OPERATOR_ARRAYS = ['target_points']
+
+MAPPING_OPERATIONS = ['mean', 'nanmean', 'median', 'nanmedian', 'nearest',
+                      'count']
+
+# backends of the mapping operations.  'numba' reduces the median,
+# nanmedian and count operations with the kernels in _reduce_rows_kernel,
+# 'numpy' with vectorized numpy, and 'auto' uses numba when it is installed.
+MAPPING_BACKENDS = ['auto', 'numba', 'numpy']
+
+_KERNEL_OPERATIONS = {'median': 0, 'nanmedian': 1, 'count': 2}
+
 
 # %%
 
 
 # %%
-def transform_to_target_grid(source_indices_within_target_radius_i,
+def compile_mapping_operator(source_indices_within_target_radius_i,
                              num_source_indices_within_target_radius_i,
                              nearest_source_index_to_target_index_i,
-                             source_field, target_grid_shape,
-                             operation='mean', allow_nearest_neighbor=True):
+                             len_target_grid=None):
+    """
+
+    Compiles grid mapping factors into a 'mapping operator': a sparse,
+    compressed sparse row (CSR) representation of the mapping from the
+    source grid to the target grid plus a nearest neighbor fallback vector.
+
+    Applying the operator to a field with apply_mapping_operator replaces the
+    per-target-cell python loop of transform_to_target_grid with a handful of
+    vectorized gathers and reductions.
+
+    Parameters
+    ----------
+    source_indices_within_target_radius_i : dict or ndarray
+        either the dictionary returned by find_mappings_from_source_to_target
+        or the object array (-1 where there are no source indices) returned
+        by find_mappings_from_source_to_target_for_processing
+
+    num_source_indices_within_target_radius_i : ndarray or None
+        the count of source indices in each target grid cell.  Only used to
+        determine the size of the target grid, may be None.
+
+    nearest_source_index_to_target_index_i : dict or ndarray
+        either a dictionary of target index: nearest source index or an
+        integer array with -1 where there is no nearest source index
+
+    len_target_grid : int, optional
+        number of target grid cells.  Only needed if it cannot be
+        determined from the other arguments.
+
+    Returns
+    -------
+    mapping_operator : dict
+        a dictionary of numpy arrays
+
+        - rows    : target grid indices that have at least one source index
+                    within their radius, sorted by the number of source
+                    indices.  Rows of equal length are stored contiguously
+                    so that each group can be reduced as one 2D array.
+        - offsets : CSR offsets into 'indices' for each entry of 'rows'
+        - indices : source grid indices, in 'rows' order.  Within each row
+                    the order of the original factors is kept (closest first)
+        - nearest : nearest source index for every target grid cell,
+                    -1 where there is none
+
+    """
+
+    # number of target grid cells
+    if len_target_grid is None:
+        if num_source_indices_within_target_radius_i is not None:
+            len_target_grid = np.size(num_source_indices_within_target_radius_i)
+        elif not isinstance(nearest_source_index_to_target_index_i, dict):
+            len_target_grid = len(nearest_source_index_to_target_index_i)
+        else:
+            len_target_grid = len(source_indices_within_target_radius_i)
+
+    # pull out the target grid cells and their source indices
+    if isinstance(source_indices_within_target_radius_i, dict):
+        target_is = np.fromiter(source_indices_within_target_radius_i.keys(),
+                                dtype=np.int64,
+                                count=len(source_indices_within_target_radius_i))
+        segments = list(source_indices_within_target_radius_i.values())
+    else:
+        # -1 indicates that there are no source indices within the radius
+        target_is = np.array([i for i, s in
+                              enumerate(source_indices_within_target_radius_i)
+                              if isinstance(s, (list, np.ndarray))],
+                             dtype=np.int64)
+        segments = [source_indices_within_target_radius_i[i]
+                    for i in target_is]
+
+    counts = np.array([len(s) for s in segments], dtype=np.int64)
+
+    if len(segments) > 0:
+        indices = np.concatenate([np.asarray(s).ravel()
+                                  for s in segments]).astype(np.int64)
+    else:
+        indices = np.zeros(0, dtype=np.int64)
+
+    # nearest neighbor fallback vector, -1 where there is no nearest neighbor
+    if isinstance(nearest_source_index_to_target_index_i, dict):
+        nearest = np.full(len_target_grid, -1, dtype=np.int64)
+        if nearest_source_index_to_target_index_i:
+            nearest_keys = np.fromiter(nearest_source_index_to_target_index_i.keys(),
+                                       dtype=np.int64)
+            nearest_vals = np.fromiter(nearest_source_index_to_target_index_i.values(),
+                                       dtype=np.int64)
+            nearest[nearest_keys] = nearest_vals
+    else:
+        nearest = np.asarray(
+            nearest_source_index_to_target_index_i).ravel().astype(np.int64)
+
+    return _csr_to_mapping_operator(target_is, counts, indices, nearest)
 
-    # source_indices_within_target_radius_i
-    # num_source_indices_within_target_radius_i
-    # nearest_source_index_to_target_index_i
-    # source field: 2D field
-    # target_grid_shape : shape of target grid array (2D)
-    # operation : mean or median
 
-    source_field_r = source_field.ravel()
+# %%
+def _csr_to_mapping_operator(target_is, counts, indices, nearest):
+
+    # target_is : target grid indices of each row
+    # counts    : number of source indices in each row
+    # indices   : source indices of all rows, concatenated in row order
+    # nearest   : nearest source index for each target grid cell (or -1)
+    #
+    # returns the mapping operator dictionary (see compile_mapping_operator)
+
+    target_is = np.asarray(target_is, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.int64)
+
+    row_starts = np.zeros(len(counts), dtype=np.int64)
+    row_starts[1:] = np.cumsum(counts)[:-1]
+
+    # drop target grid cells without any source indices, then sort the rest
+    # by the number of source indices (stable, so equal lengths stay in
+    # target grid order)
+    keep = np.where(counts > 0)[0]
+    order = keep[np.argsort(counts[keep], kind='stable')]
+
+    rows = target_is[order]
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts[order])
+
+    # move each row's source indices to its new position, keeping the
+    # order within the row
+    shift = np.repeat(row_starts[order] - offsets[:-1], counts[order])
+    indices = indices[np.arange(offsets[-1], dtype=np.int64) + shift]
+
+    mapping_operator = {'rows': rows,
+                        'offsets': offsets,
+                        'indices': indices,
+                        'nearest': np.asarray(nearest, dtype=np.int64)}
+
+    return mapping_operator
+
+
+# %%
+def iterate_mapping_operator_segments(mapping_operator):
+    """
+
+    Generator over the groups of equal length rows of a mapping operator.
+
+    Yields
+    ------
+    (num_source_indices, target_rows, source_indices)
+        target_rows is a 1D array of target grid indices and source_indices
+        is a 2D view of shape (len(target_rows), num_source_indices)
+
+    """
+
+    offsets = mapping_operator['offsets']
+    indices = mapping_operator['indices']
+    rows = mapping_operator['rows']
+
+    counts = np.diff(offsets)
+
+    if len(counts) == 0:
+        return
+
+    # rows are sorted by length, find where the length changes
+    starts = np.where(np.diff(counts) != 0)[0] + 1
+    starts = np.concatenate(([0], starts, [len(counts)]))
+
+    for a, b in zip(starts[:-1], starts[1:]):
+        num_source_indices = int(counts[a])
+        yield num_source_indices, rows[a:b], \
+            indices[offsets[a]:offsets[b]].reshape(b - a, num_source_indices)
+
+
+# %%
+def apply_mapping_operator(mapping_operator, source_field,
+                           target_grid_shape=None,
+                           operation='mean', allow_nearest_neighbor=True,
+                           backend='auto'):
+    """
+
+    Maps source_field to the target grid using a mapping operator made by
+    compile_mapping_operator.
+
+    The result is identical to reducing the source values of each target
+    grid cell on its own (np.mean, np.nanmean, np.median, np.nanmedian),
+    but is done for all target grid cells with the same number of source
+    indices at once.
+
+    Parameters
+    ----------
+    mapping_operator : dict
+        from compile_mapping_operator
 
-    # define array that will contain source_field mapped to target_grid
-    source_on_target_grid = np.zeros((target_grid_shape))*np.nan
+    source_field : ndarray
+        field on the source grid, flattened before mapping
 
-    # get a 1D version of source_on_target_grid
-    tmp_r = source_on_target_grid.ravel()
+    target_grid_shape : tuple, optional
+        shape of the returned array.  If not given a 1D array is returned.
 
-    # loop through every target grid point
-    for i in range(len(tmp_r)):
+    operation : str, optional, default 'mean'
+        one of 'mean', 'nanmean', 'median', 'nanmedian', 'nearest' or
+        'count'.  'count' is the number of non-nan source values within the
+        radius of each target grid cell (0 where there are none, the
+        nearest neighbor is not used).
 
-        # if the number of source_field points at target grid cell i > 0
-        if num_source_indices_within_target_radius_i[i] > 0:
+    allow_nearest_neighbor : boolean, optional, default True
+        use the nearest source grid cell for target grid cells that have no
+        source grid cells within their radius
+
+    backend : str, optional, default 'auto'
+        one of 'auto', 'numba' or 'numpy'.  'numba' reduces the median,
+        nanmedian and count operations with compiled kernels (run as plain
+        python, slowly, if numba is not installed), 'numpy' with vectorized
+        numpy.  'auto' uses numba when it is installed.  Both give the same
+        results.
+
+    Returns
+    -------
+    source_on_target_grid : ndarray
+        source_field mapped to the target grid, nan where there is no data
+
+    """
+
+    source_field_r = np.asarray(source_field).ravel()
+
+    source_on_target_grid_r = \
+        _scatter_target_points(mapping_operator,
+                               _map_source_records(mapping_operator,
+                                                   source_field_r[np.newaxis, :],
+                                                   operation,
+                                                   allow_nearest_neighbor,
+                                                   backend))[0]
+
+    if target_grid_shape is not None:
+        return source_on_target_grid_r.reshape(target_grid_shape)
+
+    return source_on_target_grid_r
+
+
+# %%
+def transform_stack_to_target_grid(mapping_operators, source_stack,
+                                   target_grid_shape=None,
+                                   operation='mean',
+                                   allow_nearest_neighbor=True,
+                                   backend='auto'):
+    """
+
+    Maps a whole stack of source fields (e.g. time x level x source points)
+    to the target grid in one call.
+
+    Parameters
+    ----------
+    mapping_operators : dict or list of dicts
+        a single mapping operator from compile_mapping_operator, applied to
+        every field in the stack, or one mapping operator per vertical
+        level.  With per-level operators the second to last dimension of
+        source_stack is the level dimension and must have the same length
+        as mapping_operators.
+
+    source_stack : ndarray
+        array of dimension (..., num source points) or, with per-level
+        operators, (..., num levels, num source points)
+
+    target_grid_shape : tuple, optional
+        shape of each mapped field.  If not given the last dimension of the
+        result is the flattened target grid.
+
+    operation, allow_nearest_neighbor, backend :
+        see apply_mapping_operator
+
+    Per-level operators may be compressed to the wet points of each level
+    with compress_mapping_operator.
+
+    Returns
+    -------
+    source_on_target_grid : ndarray
+        array of dimension source_stack.shape[:-1] + target_grid_shape
+
+    Note
+    ----
+    Each field in the stack is mapped exactly as apply_mapping_operator
+    would map it on its own.
+
+    """
+
+    source_stack = np.asarray(source_stack)
+
+    per_level = isinstance(mapping_operators, (list, tuple))
+
+    if per_level:
+        if source_stack.ndim < 2 or \
+                source_stack.shape[-2] != len(mapping_operators):
+            raise ValueError('source_stack must have one level per mapping '
+                             f'operator ({len(mapping_operators)}), got shape '
+                             f'{source_stack.shape}')
+        len_target_grid = _len_target_grid(mapping_operators[0])
+    else:
+        len_target_grid = _len_target_grid(mapping_operators)
+
+    stack_shape = source_stack.shape[:-1]
+
+    source_on_target_grid = np.full(stack_shape + (len_target_grid,), np.nan)
+
+    # compressed mapping operators only fill their target points, the
+    # other target grid cells stay nan
+    if per_level:
+        for k, mapping_operator in enumerate(mapping_operators):
+            target_points = mapping_operator.get('target_points', slice(None))
+            source_records_k = \
+                source_stack[..., k, :].reshape(-1, source_stack.shape[-1])
+            source_on_target_grid[..., k, target_points] = \
+                _map_source_records(mapping_operator, source_records_k,
+                                    operation, allow_nearest_neighbor,
+                                    backend).reshape(stack_shape[:-1] + (-1,))
+    else:
+        target_points = mapping_operators.get('target_points', slice(None))
+        source_records = source_stack.reshape(-1, source_stack.shape[-1])
+        source_on_target_grid[..., target_points] = \
+            _map_source_records(mapping_operators, source_records,
+                                operation, allow_nearest_neighbor,
+                                backend).reshape(stack_shape + (-1,))
+
+    if target_grid_shape is not None:
+        return source_on_target_grid.reshape(stack_shape +
+                                             tuple(target_grid_shape))
+
+    return source_on_target_grid
+
+
+# %%
+def _map_source_records(mapping_operator, source_records, operation,
+                        allow_nearest_neighbor, backend='auto',
+                        max_gather_size=2**24):
+
+    # mapping_operator : from compile_mapping_operator
+    # source_records   : 2D array, (num records x num source points)
+    # backend          : 'auto', 'numba' or 'numpy', see
+    #                    apply_mapping_operator
+    # max_gather_size  : max # of source values gathered at once, limits the
+    #                    size of temporary arrays for long stacks of records
+    #
+    # returns a (num records x num target points) array
+
+    if operation not in MAPPING_OPERATIONS:
+        raise ValueError(f'unsupported operation: {operation}')
+
+    if backend not in MAPPING_BACKENDS:
+        raise ValueError(f'unsupported backend: {backend}')
+
+    if backend == 'auto':
+        backend = 'numpy' if numba is None else 'numba'
+
+    nearest = mapping_operator['nearest']
+    num_records = source_records.shape[0]
+
+    # define array that will contain source_records mapped to target_grid
+    if operation == 'count':
+        source_on_target_grid = np.zeros((num_records, len(nearest)))
+    else:
+        source_on_target_grid = np.full((num_records, len(nearest)), np.nan)
+
+    # number source indices within target radius is 0, then we can
+    # potentially use the nearest neighbor
+    if allow_nearest_neighbor and operation != 'count':
+        use_nearest = nearest >= 0
+        use_nearest[mapping_operator['rows']] = False
+        source_on_target_grid[:, use_nearest] = \
+            source_records[:, nearest[use_nearest]]
+
+    # nearest neighbor is the first source index of every row, a single
+    # gather over all target rows
+    if operation == 'nearest':
+        rows = mapping_operator['rows']
+        if len(rows) > 0:
+            first_indices = mapping_operator['indices'][
+                mapping_operator['offsets'][:-1]]
+            source_on_target_grid[:, rows] = source_records[:, first_indices]
+        return source_on_target_grid
+
+    # compiled kernel over the flat factor arrays, one thread per block
+    # of target rows
+    if backend == 'numba' and operation in _KERNEL_OPERATIONS:
+        _reduce_rows_kernel(np.asarray(source_records),
+                            np.asarray(mapping_operator['rows']),
+                            np.asarray(mapping_operator['offsets']),
+                            np.asarray(mapping_operator['indices']),
+                            _KERNEL_OPERATIONS[operation],
+                            source_on_target_grid)
+        return source_on_target_grid
+
+    for num_source_indices, target_rows, source_indices in \
+            iterate_mapping_operator_segments(mapping_operator):
+
+        # number of records to gather at once
+        step = max(1, max_gather_size // source_indices.size)
+
+        for r0 in range(0, num_records, step):
+            r1 = min(r0 + step, num_records)
+
+            # (records x target rows x num_source_indices) source values.
+            # np.take keeps the result C-contiguous, so each row is reduced
+            # in the same order as a 1D array of its values
+            source_values = np.take(source_records[r0:r1], source_indices,
+                                    axis=1)
 
             # average these values
             if operation == 'mean':
-                tmp_r[i] = \
-                    np.mean(source_field_r[source_indices_within_target_radius_i[i]])
+                source_on_target_grid[r0:r1, target_rows] = \
+                    np.mean(source_values, axis=-1)
 
-            # average of non-nan values (can be slow)
+            # average of non-nan values
             elif operation == 'nanmean':
-                tmp_r[i] = \
-                    np.nanmean(source_field_r[source_indices_within_target_radius_i[i]])
-
-            # median of these values
-            elif operation == 'median':
-                tmp_r[i] = \
-                    np.median(source_field_r[source_indices_within_target_radius_i[i]])
-
-            # median of non-nan values (can be slow)
-            elif operation == 'nanmedian':
-                tmp_r[i] = \
-                    np.nanmedian(source_field_r[source_indices_within_target_radius_i[i]])
-
-            # nearest neighbor is the first element in source_indices
-            elif operation == 'nearest':
-                tmp = source_indices_within_target_radius_i[i]
-                tmp_r[i] = source_field_r[tmp[0]]
-
-        # number source indices within target radius is 0, then we can potentially
-        # search for a nearest neighbor.
-        elif allow_nearest_neighbor:
-          # there is a nearest neighbor within range
-            if i in nearest_source_index_to_target_index_i.keys():
-                tmp_r[i] = source_field_r[nearest_source_index_to_target_index_i[i]]
+                source_on_target_grid[r0:r1, target_rows] = \
+                    np.nanmean(source_values, axis=-1)
+
+            # number of non-nan values
+            elif operation == 'count':
+                source_on_target_grid[r0:r1, target_rows] = \
+                    np.count_nonzero(~np.isnan(source_values), axis=-1)
+
+            # median of these values / of the non-nan values
+            else:
+                source_on_target_grid[r0:r1, target_rows] = \
+                    _segment_median(source_values,
+                                    skipna=(operation == 'nanmedian'))
 
     return source_on_target_grid
 
 
 # %%
-def find_mappings_from_source_to_target(source_grid, target_grid,
-                                        target_grid_radius,
-                                        source_grid_min_L, source_grid_max_L,
-                                        neighbours=100,
-                                        less_output = True):
+def _segment_median(source_values, skipna=False):
+
+    # median over the last axis of source_values, every row of one
+    # segment of the mapping operator has the same number of source values.
+    #
+    # the values are sorted within each row (nans sort to the end) and the
+    # median is the mean of the two middle values, the same as np.median /
+    # np.nanmedian of each row on its own:
+    #   skipna=False : nan if the row has a nan
+    #   skipna=True  : median of the non-nan values, nan if there are none
+
+    num_source_indices = source_values.shape[-1]
+
+    sorted_values = np.sort(source_values, axis=-1)
+
+    if skipna:
+        num_valid = num_source_indices - \
+            np.count_nonzero(np.isnan(source_values), axis=-1)
+    else:
+        num_valid = np.full(source_values.shape[:-1], num_source_indices)
+
+    lo = np.maximum((num_valid - 1) // 2, 0)
+    hi = np.maximum(num_valid // 2, 0)
+    hi = np.minimum(hi, num_source_indices - 1)
+
+    lo_values = np.take_along_axis(sorted_values, lo[..., np.newaxis],
+                                   axis=-1)[..., 0]
+    hi_values = np.take_along_axis(sorted_values, hi[..., np.newaxis],
+                                   axis=-1)[..., 0]
+
+    median = (lo_values + hi_values) / 2
+
+    if skipna:
+        median = np.where(num_valid > 0, median, np.nan)
+    else:
+        median = np.where(np.isnan(sorted_values[..., -1]), np.nan, median)
+
+    return median
+
+
+# %%
+def _reduce_rows_kernel(source_records, rows, offsets, indices, operation,
+                        source_on_target_grid):
+
+    # reduces the source values of every row of a mapping operator, compiled
+    # with numba (parallel over the rows) when it is installed.
+    #
+    # operation : 0 median, 1 nanmedian, 2 count (see _KERNEL_OPERATIONS)
+    #
+    # medians are the mean of the two middle sorted values, the same as
+    # _segment_median
+
+    num_records = source_records.shape[0]
+
+    for i in _prange(len(rows)):
+        row = rows[i]
+        a = offsets[i]
+        b = offsets[i + 1]
+
+        values = np.empty(b - a, dtype=source_records.dtype)
+
+        for r in range(num_records):
+            num_valid = 0
+            for j in range(a, b):
+                v = source_records[r, indices[j]]
+                if not np.isnan(v):
+                    values[num_valid] = v
+                    num_valid += 1
+
+            if operation == 2:
+                source_on_target_grid[r, row] = num_valid
+                continue
+
+            if num_valid == 0 or (operation == 0 and num_valid < b - a):
+                source_on_target_grid[r, row] = np.nan
+                continue
+
+            sorted_values = np.sort(values[:num_valid])
+            source_on_target_grid[r, row] = \
+                (sorted_values[(num_valid - 1) // 2] +
+                 sorted_values[num_valid // 2]) / 2
+
+
+if numba is not None:
+    _prange = numba.prange
+    _reduce_rows_kernel = numba.njit(parallel=True, cache=True)(
+        _reduce_rows_kernel)
+else:
+    _prange = range
+
+
+# %%
+def _len_target_grid(mapping_operator):
+
+    # length of the full target grid, compressed mapping operators only
+    # have rows and nearest neighbors for their target points
+    if 'target_points' in mapping_operator:
+        return int(mapping_operator['len_target_grid'])
+
+    return len(mapping_operator['nearest'])
+
+
+# %%
+def _scatter_target_points(mapping_operator, source_on_target_points):
+
+    # places (num records x num target points) values mapped with a
+    # compressed mapping operator on the full target grid, nan elsewhere
+    if 'target_points' not in mapping_operator:
+        return source_on_target_points
+
+    source_on_target_grid = \
+        np.full((source_on_target_points.shape[0],
+                 _len_target_grid(mapping_operator)), np.nan)
+    source_on_target_grid[:, mapping_operator['target_points']] = \
+        source_on_target_points
+
+    return source_on_target_grid
+
+
+# %%
+def compress_mapping_operator(mapping_operator, target_mask):
+    """
+
+    Returns a copy of mapping_operator restricted to the wet points of the
+    target grid.
+
+    Mapping with the compressed operator only reduces the source values
+    of the wet target grid cells and scatters them into the full target
+    grid at the end; all other cells are nan.  The result is the same as
+    mapping with mapping_operator and then masking the dry cells.
+
+    Parameters
+    ----------
+    mapping_operator : dict
+        from compile_mapping_operator, or an operator that was already
+        compressed (the wet points are then a subset of its target points)
+
+    target_mask : ndarray
+        mask over the full target grid, either boolean (True on wet points)
+        or float with nan on dry points (e.g. a land mask of ones and nans)
+
+    Returns
+    -------
+    compressed_operator : dict
+        rows, offsets, indices and nearest of the wet points only, plus
+        target_points (the flat target grid index of every wet point) and
+        len_target_grid (the size of the full target grid)
+
+    """
+
+    target_mask = np.asarray(target_mask).ravel()
+
+    if target_mask.dtype == bool:
+        wet = target_mask
+    else:
+        wet = ~np.isnan(target_mask)
+
+    len_target_grid = _len_target_grid(mapping_operator)
+    if len(wet) != len_target_grid:
+        raise ValueError(f'target_mask has {len(wet)} points, the target '
+                         f'grid has {len_target_grid}')
+
+    # wet points among the current target points of the operator
+    if 'target_points' in mapping_operator:
+        target_points = np.asarray(mapping_operator['target_points'])
+    else:
+        target_points = np.arange(len_target_grid, dtype=np.int64)
+
+    keep_points = wet[target_points]
+
+    # index of every current target point in the compressed operator
+    compressed_index = np.full(len(target_points), -1, dtype=np.int64)
+    compressed_index[keep_points] = np.arange(np.count_nonzero(keep_points))
+
+    # keep the rows of wet target points, in the same (sorted by length)
+    # order
+    rows = np.asarray(mapping_operator['rows'])
+    offsets = np.asarray(mapping_operator['offsets'])
+    counts = np.diff(offsets)
+
+    keep_rows = keep_points[rows]
+    kept_counts = counts[keep_rows]
+
+    compressed_operator = dict(mapping_operator)
+    compressed_operator['rows'] = compressed_index[rows[keep_rows]]
+    compressed_operator['offsets'] = \
+        np.concatenate(([0], np.cumsum(kept_counts))).astype(np.int64)
+    compressed_operator['indices'] = \
+        np.asarray(mapping_operator['indices'])[np.repeat(keep_rows, counts)]
+    compressed_operator['nearest'] = \
+        np.asarray(mapping_operator['nearest'])[keep_points]
+    compressed_operator['target_points'] = target_points[keep_points]
+    compressed_operator['len_target_grid'] = len_target_grid
+
+    return compressed_operator
+
+
+# %%
+def remap_mapping_operator_source(mapping_operator, source_index_map):
+    """
+
+    Returns a copy of mapping_operator whose source indices point into a
+    larger source array.
+
+    Useful when the factors were made for a subset of the source grid
+    (e.g. the wet points of one vertical level) but the mapping should be
+    applied to the full source field.
+
+    Parameters
+    ----------
+    mapping_operator : dict
+        from compile_mapping_operator
+
+    source_index_map : ndarray
+        flat index into the full source array of every point of the
+        source grid used to make mapping_operator
+
+    """
+
+    source_index_map = np.asarray(source_index_map).ravel().astype(np.int64)
+
+    nearest = mapping_operator['nearest']
+
+    remapped_operator = dict(mapping_operator)
+    remapped_operator['indices'] = source_index_map[mapping_operator['indices']]
+    remapped_operator['nearest'] = np.where(nearest >= 0,
+                                            source_index_map[np.maximum(nearest, 0)],
+                                            -1)
+
+    return remapped_operator
+
+
+# %%
+def save_mapping_operator(mapping_operator, factors_dir):
+    """
+
+    Saves a mapping operator to disk in a compact, memory-mappable format.
+
+    factors_dir becomes a directory with one .npy file per array of the
+    operator and a mapping_operator.json file recording the format
+    version.  Integer arrays are stored as int32 when their values fit.
+    The directory is written under a unique temporary name and renamed
+    when complete, so readers never see a partially written operator and
+    concurrent writers do not collide.  If another writer has already
+    saved an operator to factors_dir it is kept: operators are saved to
+    paths keyed on their inputs, so it is the same operator, and it may be
+    in use.
+
+    Parameters
+    ----------
+    mapping_operator : dict
+        from compile_mapping_operator or
+        find_mapping_operator_from_source_to_target
+
+    factors_dir : str or Path
+        directory to save the operator in.  Anything there that is not a
+        complete operator is replaced.
+
+    """
+
+    factors_dir = Path(factors_dir)
+    factors_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f'.{factors_dir.name}.',
+                                    suffix='.tmp', dir=factors_dir.parent))
+
+    # mkdtemp only gives the owner access, the operator is shared
+    os.chmod(tmp_dir, 0o755)
+
+    try:
+        _write_mapping_operator(mapping_operator, tmp_dir)
+        _move_mapping_operator(tmp_dir, factors_dir)
+    finally:
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# %%
+def _write_mapping_operator(mapping_operator, tmp_dir):
+
+    # write the arrays and metadata of an operator into the existing
+    # directory tmp_dir
+    array_names = MAPPING_OPERATOR_ARRAYS
+    if 'target_points' in mapping_operator:
+        array_names = array_names + COMPRESSED_MAPPING_OPERATOR_ARRAYS
+
+    dtypes = {}
+    for name in array_names:
+        array = np.asarray(mapping_operator[name])
+
+        # int32 is enough for all but the very largest grids
+        if array.size == 0 or (array.max() <= np.iinfo(np.int32).max and
+                               array.min() >= np.iinfo(np.int32).min):
+            array = array.astype(np.int32)
+
+        np.save(tmp_dir / f'{name}.npy', array)
+        dtypes[name] = str(array.dtype)
+
+    meta = {'format_version': MAPPING_OPERATOR_FORMAT_VERSION,
+            'len_target_grid': _len_target_grid(mapping_operator),
+            'num_rows': int(len(mapping_operator['rows'])),
+            'num_source_indices': int(len(mapping_operator['indices'])),
+            'dtypes': dtypes}
+
+    with open(tmp_dir / 'mapping_operator.json', 'w') as f:
+        json.dump(meta, f, indent=4)
+
+
+# %%
+def _move_mapping_operator(tmp_dir, factors_dir):
+
+    # rename the complete operator in tmp_dir to factors_dir.  renaming a
+    # directory is atomic, and fails if factors_dir is not empty
+    try:
+        os.rename(tmp_dir, factors_dir)
+        return
+    except OSError:
+        if is_mapping_operator_dir(factors_dir):
+            # saved by a concurrent writer
+            return
+
+    # not a complete operator (e.g. a file or partial copy): moved aside
+    # under a unique name before renaming, and only then removed
+    stale_path = Path(f'{tmp_dir}.stale')
+    try:
+        os.rename(factors_dir, stale_path)
+    except FileNotFoundError:
+        pass
+
+    try:
+        os.rename(tmp_dir, factors_dir)
+    except OSError:
+        if not is_mapping_operator_dir(factors_dir):
+            raise
+    finally:
+        if stale_path.is_dir():
+            shutil.rmtree(stale_path, ignore_errors=True)
+        elif stale_path.exists():
+            stale_path.unlink()
+
+
+# %%
+def load_mapping_operator(factors_dir, mmap_mode='r'):
+    """
+
+    Loads a mapping operator saved by save_mapping_operator.
+
+    With the default mmap_mode='r' the arrays are memory-mapped read-only,
+    so every process that loads the same operator shares one copy of it in
+    the operating system page cache.
+
+    Parameters
+    ----------
+    factors_dir : str or Path
+        directory the operator was saved in
+
+    mmap_mode : str or None, optional, default 'r'
+        passed to np.load.  None reads the arrays into memory.
+
+    Returns
+    -------
+    mapping_operator : dict
+
+    """
+
+    factors_dir = Path(factors_dir)
+
+    meta_path = factors_dir / 'mapping_operator.json'
+    if not meta_path.is_file():
+        raise ValueError(f'{factors_dir} is not a saved mapping operator')
+
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+
+    if meta.get('format_version') != MAPPING_OPERATOR_FORMAT_VERSION:
+        raise ValueError(f'unsupported mapping operator format version '
+                         f'{meta.get("format_version")} in {factors_dir}, '
+                         f'expected {MAPPING_OPERATOR_FORMAT_VERSION}')
+
+    # dtypes lists every saved array, including the target points of
+    # compressed operators
+    array_names = list(meta.get('dtypes', MAPPING_OPERATOR_ARRAYS))
+
+    mapping_operator = {name: np.load(factors_dir / f'{name}.npy',
+                                      mmap_mode=mmap_mode)
+                        for name in array_names}
+
+    if 'target_points' in mapping_operator:
+        mapping_operator['len_target_grid'] = meta['len_target_grid']
+
+    return mapping_operator
+
+
+# %%
+def is_mapping_operator_dir(factors_path):
+
+    # True if factors_path is a directory written by save_mapping_operator
+    return (Path(factors_path) / 'mapping_operator.json').is_file()
+
+
+# %%
+def compile_mapping_factors(factors, len_target_grid=None):
+    """
+
+    Compiles grid mapping factors in either of their legacy tuple forms
+    into a mapping operator.
+
+    Parameters
+    ----------
+    factors : tuple
+        returned by find_mappings_from_source_to_target (three items) or by
+        find_mappings_from_source_to_target_for_processing (two items)
+
+    len_target_grid : int, optional
+        number of target grid cells, if it cannot be determined from the
+        factors
+
+    Returns
+    -------
+    mapping_operator : dict
+
+    """
+
+    # find_mappings_from_source_to_target_for_processing returns two arrays
+    if len(factors) == 2:
+        return compile_mapping_operator(factors[0], None, factors[1],
+                                        len_target_grid)
+    elif len(factors) == 3:
+        return compile_mapping_operator(*factors,
+                                        len_target_grid=len_target_grid)
+
+    raise ValueError('factors are not grid mapping factors')
+
+
+# %%
+def convert_mapping_factors_pickle(pickle_path, factors_dir,
+                                   len_target_grid=None):
+    """
+
+    Converts pickled grid mapping factors to the on-disk mapping operator
+    format.
+
+    Parameters
+    ----------
+    pickle_path : str or Path
+        pickle of the tuple returned by find_mappings_from_source_to_target
+        or by find_mappings_from_source_to_target_for_processing
+
+    factors_dir : str or Path
+        directory to save the mapping operator in
+
+    len_target_grid : int, optional
+        number of target grid cells, if it cannot be determined from the
+        factors
+
+    Returns
+    -------
+    mapping_operator : dict
+        the converted operator, memory-mapped from factors_dir
+
+    """
+
+    with open(pickle_path, 'rb') as f:
+        factors = pickle.load(f)
+
+    try:
+        mapping_operator = compile_mapping_factors(factors, len_target_grid)
+    except ValueError:
+        raise ValueError(f'{pickle_path} does not contain grid mapping factors')
+
+    save_mapping_operator(mapping_operator, factors_dir)
+
+    return load_mapping_operator(factors_dir)
+
+
+# %%
+def transform_to_target_grid(source_indices_within_target_radius_i,
+                             num_source_indices_within_target_radius_i,
+                             nearest_source_index_to_target_index_i,
+                             source_field, target_grid_shape,
+                             operation='mean', allow_nearest_neighbor=True,
+                             mapping_operator=None):
+
+    # source_indices_within_target_radius_i
+    # num_source_indices_within_target_radius_i
+    # nearest_source_index_to_target_index_i
+    # source field: 2D field
+    # target_grid_shape : shape of target grid array (2D)
+    # operation : mean or median
+    # mapping_operator : (optional) the factors already compiled with
+    #                    compile_mapping_operator.  When given the first
+    #                    three arguments are ignored and can be None.
+
+    if mapping_operator is None:
+        mapping_operator = \
+            compile_mapping_operator(source_indices_within_target_radius_i,
+                                     num_source_indices_within_target_radius_i,
+                                     nearest_source_index_to_target_index_i,
+                                     len_target_grid=int(np.prod(target_grid_shape)))
+
+    return apply_mapping_operator(mapping_operator, source_field,
+                                  target_grid_shape,
+                                  operation=operation,
+                                  allow_nearest_neighbor=allow_nearest_neighbor)
+
+
+# %%
+def _find_neighbours_within_target_radius(source_grid, target_grid,
+                                          target_grid_radius,
+                                          source_grid_min_L, source_grid_max_L,
+                                          neighbours=100,
+                                          less_output=True):
 
     # source grid, target_grid : area or grid defintion objects from pyresample
 
@@ -94,10 +997,23 @@ def find_mappings_from_source_to_target(source_grid, target_grid,
     #                  Default is 100 to limit memory usage.
     #                  Value given must be a whole number greater than 0
 
+    # returns (valid_target_is, counts, indices, nearest)
+    #   valid_target_is : the target grid cells the kd-tree returned
+    #                     information for
+    #   counts          : the # of source grid cells within the radius of
+    #                     each valid target grid cell
+    #   indices         : those source grid cells, concatenated in
+    #                     valid_target_is order (closest first)
+    #   nearest         : the nearest source grid cell within
+    #                     source_grid_max_L of every target grid cell, -1
+    #                     where there is none
+
     # # of element of the source and target grids
     len_source_grid = source_grid.size
     len_target_grid = target_grid.size
 
+    target_grid_radius = np.asarray(target_grid_radius).ravel()
+
     # the maximum radius of the target grid
     max_target_grid_radius = np.nanmax(target_grid_radius)
 
@@ -143,15 +1059,6 @@ def find_mappings_from_source_to_target(source_grid, target_grid,
                                           max_target_grid_radius),
                                       neighbours=neighbours)
 
-    # define a dictionary, which will contain the list of SOURCE grid cells
-    # that are within the search radius of each TARGET grid cell
-    source_indices_within_target_radius_i = dict()
-
-    # define a vector which is a COUNT of the # of SOURCE grid cells
-    # that are within the search radius of each TARGET grid cell
-    num_source_indices_within_target_radius_i =\
-        np.zeros((target_grid_radius.shape))
-
     # SECOND FIND THE SINGLE SOURCE GRID CELL THAT IS CLOSEST TO EACH
     # TARGET GRID CELL, BUT ONLY SEARCH AS FAR AS SOURCE_GRID_MAX_L
 
@@ -168,72 +1075,100 @@ def find_mappings_from_source_to_target(source_grid, target_grid,
                                           source_grid_max_L),
                                       neighbours=1)
 
-    # define a vector that will store the index of the source grid closest to
-    # the target grid within the search radius 'source_grid_max_L'
-    nearest_source_index_to_target_index_i = dict()
+    if not less_output:
+        print('length of target grid: ', len_target_grid)
 
-    # >> a list of i's to print debug statements for
-    debug_is = np.linspace(0, len_target_grid, 20).astype(int)
+    # the kd-tree results only have rows for the valid target grid cells.
+    # row k of both results belongs to target grid cell valid_target_is[k]
+    valid_target_is = \
+        np.where(np.ravel(Ax_nearest_within_source_grid_max_L[1]))[0]
+    num_valid = len(valid_target_is)
+
+    # Ax[2][k,:] are the closest source grid indices
+    #            for valid target grid cell k
+    # dist_within_target_r[k,:] is the T/F array for which
+    #            of the closest 'neighbours' source grid indices are within
+    #            the radius of this target grid cell
+    # -- so we're pulling out just those source grid indices
+    #    that fall within the target grid cell radius.  missing neighbours
+    #    have an infinite distance and are never within the radius
+    src_indices_here = \
+        np.reshape(Ax_max_target_grid_r[2][:num_valid], (num_valid, -1))
+    dist_from_src_to_target = \
+        np.reshape(Ax_max_target_grid_r[3][:num_valid], (num_valid, -1))
+
+    dist_within_target_r = dist_from_src_to_target <= \
+        target_grid_radius[valid_target_is][:, np.newaxis]
+
+    # count the # source indices for each target grid cell and pull them
+    # out row by row (boolean indexing keeps the closest first order)
+    counts = np.sum(dist_within_target_r, axis=1).astype(np.int64)
+    indices = src_indices_here[dist_within_target_r].astype(np.int64)
+
+    # NOW RECORD THE NEAREST NEIGHBOR POINT WIHTIN SOURCE_GRID_MAX_L
+    # when there is no source index within the search radius then
+    # the 'get neighbour info' routine returns a dummy value of
+    # the length of the source grid.  so we test to see if that's the
+    # value that was returned.  If not, then we are good to go.
+    nearest_here = \
+        np.ravel(Ax_nearest_within_source_grid_max_L[2])[:num_valid].astype(np.int64)
+
+    nearest = np.full(len_target_grid, -1, dtype=np.int64)
+    has_nearest = nearest_here < len_source_grid
+    nearest[valid_target_is[has_nearest]] = nearest_here[has_nearest]
 
-    # loop through every TARGET grid cell, pull out the SOURCE grid cells
-    # that fall within the TARGET grid radius and stick into the
-    # 'source_indices_within_target_radius_i' dictionary
-    # and then do the same for the nearest neighbour business.
+    if not less_output:
+        print(f'valid target grid cells: {num_valid}, '
+              f'source indices within target radius: {len(indices)}')
 
-    current_valid_target_i = 0
+    return valid_target_is, counts, indices, nearest
 
-    if not less_output:
-        print('length of target grid: ', len_target_grid)
-        
-    for i in range(len_target_grid):
-
-        
-        if not less_output:
-            print('looping through all points of target grid: ', i)
-        
-        if Ax_nearest_within_source_grid_max_L[1][i] == True:
-
-            # Ax[2][i,:] are the closest source grid indices
-            #            for target grid cell i
-            # data_within_search_radius[i,:] is the T/F array for which
-            #            of the closest 'neighbours' source grid indices are within
-            #            the radius of this target grid cell i
-            # -- so we're pulling out just those source grid indices
-            #    that fall within the target grid cell radius
-
-            # FIRST RECORD THE SOURCE POINTS THAT FALL WITHIN TARGET_GRID_RADIUS
-            dist_from_src_to_target = Ax_max_target_grid_r[3][current_valid_target_i]
-
-            dist_within_target_r = dist_from_src_to_target <= target_grid_radius[i]
-
-            if neighbours > 1:
-                src_indicies_here = Ax_max_target_grid_r[2][current_valid_target_i, :]
-            else:
-                src_indicies_here = Ax_max_target_grid_r[2][current_valid_target_i]
 
-            source_indices_within_target_radius_i[i] = \
-                src_indicies_here[dist_within_target_r == True]
+# %%
+def find_mappings_from_source_to_target(source_grid, target_grid,
+                                        target_grid_radius,
+                                        source_grid_min_L, source_grid_max_L,
+                                        neighbours=100,
+                                        less_output = True):
+
+    # source grid, target_grid : area or grid defintion objects from pyresample
+
+    # target_grid_radius       : a vector indicating the radius of each
+    #                            target grid cell (m)
+
+    # source_grid_min_l, source_grid_max_L : min and max distances
+    #                            between adjacent source grid cells (m)
+
+    # neighbours     : Specifies number of neighbours to look for when getting
+    #                  the neighbour info of a cell using pyresample.
+    #                  Default is 100 to limit memory usage.
+    #                  Value given must be a whole number greater than 0
 
-            # count the # source indices here
-            num_source_indices_within_target_radius_i[i] = \
-                int(len(source_indices_within_target_radius_i[i]))
+    valid_target_is, counts, indices, nearest = \
+        _find_neighbours_within_target_radius(source_grid, target_grid,
+                                              target_grid_radius,
+                                              source_grid_min_L,
+                                              source_grid_max_L,
+                                              neighbours=neighbours,
+                                              less_output=less_output)
 
-            # NOW RECORD THE NEAREST NEIGHBOR POINT WIHTIN SOURCE_GRID_MAX_L
-            # when there is no source index within the search radius then
-            # the 'get neighbour info' routine returns a dummy value of
-            # the length of the source grid.  so we test to see if that's the
-            # value that was returned.  If not, then we are good to go.
-            if Ax_nearest_within_source_grid_max_L[2][current_valid_target_i]\
-                    < len_source_grid:
-                nearest_source_index_to_target_index_i[i] =\
-                    Ax_nearest_within_source_grid_max_L[2][current_valid_target_i]
+    # define a dictionary, which will contain the list of SOURCE grid cells
+    # that are within the search radius of each TARGET grid cell
+    source_indices_within_target_radius_i = \
+        dict(zip(valid_target_is.tolist(),
+                 np.split(indices, np.cumsum(counts)[:-1])))
 
-            # increment this little bastard
-            current_valid_target_i += 1
+    # define a vector which is a COUNT of the # of SOURCE grid cells
+    # that are within the search radius of each TARGET grid cell
+    num_source_indices_within_target_radius_i =\
+        np.zeros((np.shape(target_grid_radius)))
+    num_source_indices_within_target_radius_i.ravel()[valid_target_is] = counts
 
-        # print progress.  always nice
-        if i in debug_is:
-            print(str(int(i/len_target_grid*100)) + ' %')
+    # define a dictionary that will store the index of the source grid closest to
+    # the target grid within the search radius 'source_grid_max_L'
+    has_nearest = np.where(nearest >= 0)[0]
+    nearest_source_index_to_target_index_i = \
+        dict(zip(has_nearest.tolist(), nearest[has_nearest]))
 
     return source_indices_within_target_radius_i,\
         num_source_indices_within_target_radius_i,\
@@ -241,68 +1176,78 @@ def find_mappings_from_source_to_target(source_grid, target_grid,
 
 
 # %%
-def transform_to_target_grid_for_processing(source_indices_within_target_radius_i,
-                             nearest_source_index_to_target_index_i,
-                             source_field, target_grid_shape, land_mask=[],
-                             operation='mean', allow_nearest_neighbor=True):
+def find_mapping_operator_from_source_to_target(source_grid, target_grid,
+                                                target_grid_radius,
+                                                source_grid_min_L,
+                                                source_grid_max_L,
+                                                neighbours=100,
+                                                less_output=True):
+    """
 
-    # source_indices_within_target_radius_i
-    # nearest_source_index_to_target_index_i
-    # source field: 2D field
-    # target_grid_shape : shape of target grid array (2D)
-    # land_mask: land mask for current level (or nothing if creating land mask)
-    # operation : mean or median
+    Finds the mapping from the source grid to the target grid and returns
+    it directly as a mapping operator (see compile_mapping_operator).
 
-    source_field_r = source_field.ravel()
+    The result is the same as compiling the output of
+    find_mappings_from_source_to_target, but the per-target-cell
+    dictionaries are never built: the kd-tree output is turned into
+    flat CSR offset/index arrays with array operations only.
 
-    # define array that will contain source_field mapped to target_grid
-    source_on_target_grid = np.zeros((target_grid_shape))*np.nan
+    Parameters
+    ----------
+    see find_mappings_from_source_to_target
 
-    # get a 1D version of source_on_target_grid
-    tmp_r = source_on_target_grid.ravel()
+    Returns
+    -------
+    mapping_operator : dict
 
-    if land_mask == []:
-        land_mask = np.ones(len(tmp_r))
+    """
 
-    # loop through every VALID (wet) target grid point
-    for i in np.where(~np.isnan(land_mask))[0]:
+    valid_target_is, counts, indices, nearest = \
+        _find_neighbours_within_target_radius(source_grid, target_grid,
+                                              target_grid_radius,
+                                              source_grid_min_L,
+                                              source_grid_max_L,
+                                              neighbours=neighbours,
+                                              less_output=less_output)
 
-        # if the number of source_field points at target grid cell i > 0
-        if source_indices_within_target_radius_i[i] != -1:
+    return _csr_to_mapping_operator(valid_target_is, counts, indices, nearest)
 
-            tmp_source_indices = source_indices_within_target_radius_i[i]
 
-            # average these values
-            if operation == 'mean':
-                tmp_r[i] = \
-                    np.mean(source_field_r[tmp_source_indices])
+# %%
+def transform_to_target_grid_for_processing(source_indices_within_target_radius_i,
+                             nearest_source_index_to_target_index_i,
+                             source_field, target_grid_shape, land_mask=[],
+                             operation='mean', allow_nearest_neighbor=True,
+                             mapping_operator=None):
 
-            # average of non-nan values (can be slow)
-            elif operation == 'nanmean':
-                tmp_r[i] = \
-                    np.nanmean(source_field_r[tmp_source_indices])
-
-            # median of these values
-            elif operation == 'median':
-                tmp_r[i] = \
-                    np.median(source_field_r[tmp_source_indices])
-
-            # median of non-nan values (can be slow)
-            elif operation == 'nanmedian':
-                tmp_r[i] = \
-                    np.nanmedian(source_field_r[tmp_source_indices])
-
-            # nearest neighbor is the first element in source_indices
-            elif operation == 'nearest':
-                tmp = tmp_source_indices
-                tmp_r[i] = source_field_r[tmp[0]]
-
-        # number source indices within target radius is 0, then we can potentially
-        # search for a nearest neighbor.
-        elif allow_nearest_neighbor:
-            # there is a nearest neighbor within range
-            if nearest_source_index_to_target_index_i[i] != -1:
-                tmp_r[i] = source_field_r[nearest_source_index_to_target_index_i[i]]
+    # source_indices_within_target_radius_i
+    # nearest_source_index_to_target_index_i
+    # source field: 2D field
+    # target_grid_shape : shape of target grid array (2D)
+    # land_mask: land mask for current level (or nothing if creating land mask)
+    # operation : mean or median
+    # mapping_operator : (optional) the factors already compiled with
+    #                    compile_mapping_operator.  When given the first
+    #                    two arguments are ignored and can be None.
+
+    if mapping_operator is None:
+        mapping_operator = \
+            compile_mapping_operator(source_indices_within_target_radius_i,
+                                     None,
+                                     nearest_source_index_to_target_index_i,
+                                     len_target_grid=int(np.prod(target_grid_shape)))
+
+    # only VALID (wet) target grid points are mapped
+    if len(land_mask) > 0:
+        mapping_operator = compress_mapping_operator(mapping_operator,
+                                                     np.asarray(land_mask,
+                                                                dtype=float))
+
+    source_on_target_grid = \
+        apply_mapping_operator(mapping_operator, source_field,
+                               target_grid_shape,
+                               operation=operation,
+                               allow_nearest_neighbor=allow_nearest_neighbor)
 
     return source_on_target_grid
 
@@ -327,144 +1272,32 @@ def find_mappings_from_source_to_target_for_processing(source_grid, target_grid,
     #                  Default is 100 to limit memory usage.
     #                  Value given must be a whole number greater than 0
 
-    # # of element of the source and target grids
-    len_source_grid = source_grid.size
-    len_target_grid = target_grid.size
-
-    # the maximum radius of the target grid
-    max_target_grid_radius = np.nanmax(target_grid_radius)
-
-    # the maximum number of neighbors to consider when doing the bin averaging
-    # assuming that we have the largets target grid radius and the smallest
-    # source grid length. (upper bound)
-
-    # the ceiling is used to ensure the result is a whole number > 0
-    neighbours_upper_bound = np.ceil(
-        (max_target_grid_radius*2/source_grid_min_L)**2)
+    valid_target_is, counts, indices, nearest = \
+        _find_neighbours_within_target_radius(source_grid, target_grid,
+                                              target_grid_radius,
+                                              source_grid_min_L,
+                                              source_grid_max_L,
+                                              neighbours=neighbours,
+                                              less_output=less_output)
 
-    # compare provided and upper_bound value for neighbours.
-    # limit neighbours to the upper_bound if the supplied neighbours value is larger
-    # since you dont need more neighbours than exists within a cell.
-    if neighbours > neighbours_upper_bound:
-        print('using more neighbours than upper bound.  limiting to the upper bound '
-              f'of {int(neighbours_upper_bound)} neighbours')
-        neighbours = neighbours_upper_bound
-
-    # make sure neighbours is an int for pyresample
-    # neighbours_upper_bound is float, and user input can be float
-    neighbours = int(neighbours)
-
-    # FIRST FIND THE SET OF SOURCE GRID CELLS THAT FALL WITHIN THE SEARCH
-    # RADIUS OF EACH TARGET GRID CELL
-
-    # "target_grid_radius" is the half of the distance between
-    # target grid cells.  No need to search for source
-    # grid points more than halfway to the next target grid cell.
-
-    # the get_neighbour_info returned from pyresample is quite useful.
-    # Ax[2] is the matrix of
-    # closest SOURCE grid points for each TARGET grid point
-    # Ax[3] is the actual distance in meters
-    # also cool is that Ax[3] is sorted, first column is closest, last column
-    # is furthest.
-    # for some reason the radius of influence has to be in an int.
-
-    Ax_max_target_grid_r = \
-        pr.kd_tree.get_neighbour_info(source_grid,
-                                      target_grid,
-                                      radius_of_influence=int(
-                                          max_target_grid_radius),
-                                      neighbours=neighbours)
-
-    # define a dictionary, which will contain the list of SOURCE grid cells
+    # define an array, which will contain the list of SOURCE grid cells
     # that are within the search radius of each TARGET grid cell
     # A value of -1 indicates an invalid value, or 0 source cells within radius
     # Where there are source indices within radius, a list of indices is returned
     source_indices_within_target_radius_i =\
         np.full((target_grid_radius.shape), -1, dtype=object)
 
-    # SECOND FIND THE SINGLE SOURCE GRID CELL THAT IS CLOSEST TO EACH
-    # TARGET GRID CELL, BUT ONLY SEARCH AS FAR AS SOURCE_GRID_MAX_L
-
-    # the kd_tree can also find the sigle nearest neighbor within the
-    # radius 'source_grid_max_L'.  This second search is needed because sometimes
-    # the source grid is finer than the target grid and therefore we may
-    # end up in a situation where none of the centers of the SOURCE grid
-    # fall within the small centers of the TARGET grid.
-    # we'll look for the nearest SOURCE grid cell within 'source_grid_max_L'
-
-    Ax_nearest_within_source_grid_max_L = \
-        pr.kd_tree.get_neighbour_info(source_grid, target_grid,
-                                      radius_of_influence=int(
-                                          source_grid_max_L),
-                                      neighbours=1)
+    source_indices_r = source_indices_within_target_radius_i.ravel()
+    for i, src_indices_here in zip(valid_target_is,
+                                   np.split(indices, np.cumsum(counts)[:-1])):
+        if len(src_indices_here) > 0:
+            source_indices_r[i] = list(src_indices_here)
 
     # define a vector that will store the index of the source grid closest to
     # the target grid within the search radius 'source_grid_max_L'
     # A value of -1 indicates an invalid value (or no nearest source)
     nearest_source_index_to_target_index_i =\
-        np.full((target_grid_radius.shape), -1, dtype=np.int32)
-
-    # >> a list of i's to print debug statements for
-    debug_is = np.linspace(0, len_target_grid, 20).astype(int)
-
-    # loop through every TARGET grid cell, pull out the SOURCE grid cells
-    # that fall within the TARGET grid radius and stick into the
-    # 'source_indices_within_target_radius_i' list
-    # and then do the same for the nearest neighbour business.
-
-    current_valid_target_i = 0
-
-    if not less_output:
-        print('length of target grid: ', len_target_grid)
-        
-    for i in range(len_target_grid):
-
-        
-        if not less_output:
-            print('looping through all points of target grid: ', i)
-        
-        if Ax_nearest_within_source_grid_max_L[1][i] == True:
-
-            # Ax[2][i,:] are the closest source grid indices
-            #            for target grid cell i
-            # data_within_search_radius[i,:] is the T/F array for which
-            #            of the closest 'neighbours' source grid indices are within
-            #            the radius of this target grid cell i
-            # -- so we're pulling out just those source grid indices
-            #    that fall within the target grid cell radius
-
-            # FIRST RECORD THE SOURCE POINTS THAT FALL WITHIN TARGET_GRID_RADIUS
-            dist_from_src_to_target = Ax_max_target_grid_r[3][current_valid_target_i]
-
-            dist_within_target_r = dist_from_src_to_target <= target_grid_radius[i]
-
-            if neighbours > 1:
-                src_indicies_here = Ax_max_target_grid_r[2][current_valid_target_i, :]
-            else:
-                src_indicies_here = Ax_max_target_grid_r[2][current_valid_target_i]
-            
-
-            if src_indicies_here[dist_within_target_r == True].shape[0] != 0:
-                source_indices_within_target_radius_i[i] = \
-                    list(src_indicies_here[dist_within_target_r == True])
-
-            # NOW RECORD THE NEAREST NEIGHBOR POINT WIHTIN SOURCE_GRID_MAX_L
-            # when there is no source index within the search radius then
-            # the 'get neighbour info' routine returns a dummy value of
-            # the length of the source grid.  so we test to see if that's the
-            # value that was returned.  If not, then we are good to go.
-            if Ax_nearest_within_source_grid_max_L[2][current_valid_target_i]\
-                    < len_source_grid:
-                nearest_source_index_to_target_index_i[i] =\
-                    Ax_nearest_within_source_grid_max_L[2][current_valid_target_i]
-
-            # increment this little bastard
-            current_valid_target_i += 1
-
-        # print progress.  always nice
-        if i in debug_is:
-            print(str(int(i/len_target_grid*100)) + ' %')
+        nearest.astype(np.int32).reshape(target_grid_radius.shape)
 
     return source_indices_within_target_radius_i,\
         nearest_source_index_to_target_index_i
@@ -4,19 +4,19 @@ Created on Sun Jun 21 17:24:13 2020
 
 @author: Ian
 """
+import hashlib
+import weakref
 import xarray as xr
 import numpy as np
 from netCDF4 import default_fillvals
 from pathlib import Path
-from .llc_array_conversion import llc_tiles_to_compact
+from .llc_array_conversion import llc_tiles_to_compact_records
 
 # %%
 
 
-def make_empty_record(standard_name, long_name, units,
-                      record_date,
-                      model_grid, model_grid_type,
-                      array_precision):
+def _make_empty_record_template(record_date, model_grid, model_grid_type,
+                                array_precision):
 
     # model_grid must contain the corrdinates XC and YC
 
@@ -99,8 +99,63 @@ def make_empty_record(standard_name, long_name, units,
     data_DA.XC.attrs = model_grid.XC.attrs
     data_DA.YC.attrs = model_grid.YC.attrs
 
+    return data_DA
+
+
+# %%
+
+
+# Empty record templates, keyed by model grid object, grid type and precision.
+# Each entry holds a weak reference to its model grid, so a template is never
+# used for a different grid that happens to get the same id
+_empty_record_templates = {}
+
+
+def make_empty_record(standard_name, long_name, units,
+                      record_date,
+                      model_grid, model_grid_type,
+                      array_precision):
+
+    # building the coordinates of an empty record is expensive, so it is done
+    # once per model grid and precision, and each record is a cheap copy of
+    # that template with its own data and time values
+
+    key = (id(model_grid), model_grid_type, np.dtype(array_precision).str)
+
+    if key in _empty_record_templates and \
+            _empty_record_templates[key][0]() is model_grid:
+        template = _empty_record_templates[key][1]
+    else:
+        template = _make_empty_record_template(record_date, model_grid,
+                                               model_grid_type,
+                                               array_precision)
+        if isinstance(template, list):
+            # unsupported grid
+            return template
+
+        # forget templates of model grids that no longer exist
+        for cached_key in list(_empty_record_templates.keys()):
+            if _empty_record_templates[cached_key][0]() is None:
+                del _empty_record_templates[cached_key]
+
+        _empty_record_templates[key] = (weakref.ref(model_grid), template)
+
+    # new time, start and end time records. default is same value as record date.
+    # the other coordinates are shared with the template
+    record_time = np.array([np.datetime64(record_date, 'ns')])
+
+    coords = {name: template.coords[name].variable
+              for name in template.coords}
+    coords['time'] = ('time', record_time)
+    coords['time_start'] = ('time', record_time.copy())
+    coords['time_end'] = ('time', record_time.copy())
+
+    # all values are nans
+    data_DA = xr.DataArray(np.full(template.shape, np.nan, dtype=array_precision),
+                           coords=coords, dims=template.dims)
+
     # add some metadata
-    data_DA.attrs = []
+    data_DA.attrs = {}
     data_DA.attrs['long_name'] = long_name
     data_DA.attrs['standard_name'] = standard_name
     data_DA.attrs['units'] = units
@@ -112,11 +167,50 @@ def make_empty_record(standard_name, long_name, units,
 # %%
 
 
+# Size in bytes of the groups of records written to flat binary files at once
+BINARY_CHUNK_BYTES = 2**27
+
+
+def binary_records(records, binary_fill_value, binary_output_dtype,
+                   model_grid_type):
+
+    # converts records (time first) to the layout of flat binary files, in
+    # the binary output dtype, with nans replaced by the binary fill value
+    # (something like -9999). llc tiles of all records are rearranged to the
+    # compact format at once, while being cast to the output dtype
+
+    dt_out = np.dtype(binary_output_dtype)
+
+    # if we have an llc grid, then we have to reform to compact
+    if model_grid_type == 'llc':
+        binary = llc_tiles_to_compact_records(records, dtype=dt_out)
+
+    # otherwise assume grid is x,y (2 dimensions)
+    elif model_grid_type == 'latlon':
+        binary = records.astype(dt_out)
+
+    else:
+        print('unknown model grid type!')
+        return []
+
+    binary[np.isnan(binary)] = binary_fill_value
+
+    return binary
+
+
 def save_to_disk(data,
                  output_filename,
                  binary_fill_value, netcdf_fill_value,
                  netcdf_output_dir, binary_output_dir, binary_output_dtype,
-                 model_grid_type, save_binary=True, save_netcdf=True, data_var=''):
+                 model_grid_type, save_binary=True, save_netcdf=True, data_var='',
+                 checksum_algorithm=None):
+
+    # returns the checksums of the files written ('binary' and 'netcdf' keys)
+    # when a hashlib checksum_algorithm is given. binary files are hashed
+    # from the bytes being written, netCDF files right after they are
+    # written, while still in the page cache
+
+    checksums = {}
 
     if save_binary:
         if data_var:
@@ -133,40 +227,30 @@ def save_to_disk(data,
         # define binary output filename
         binary_output_filename = binary_output_dir / output_filename
 
-        # replace nans with the binary fill value (something like -9999)
-        tmp_fields = np.where(np.isnan(data_values),
-                              binary_fill_value, data_values)
+        if model_grid_type not in ['llc', 'latlon']:
+            print('unknown model grid type!')
+            return []
 
         # SAVE FLAT BINARY
-        # loop through each record of the year, save binary fields one at a time
-        # appending each record as we go
-        fd1 = open(str(binary_output_filename), 'wb')
-        fd1 = open(str(binary_output_filename), 'ab')
-
-        for i in range(len(data.time)):
-            # print('saving binary record: ', str(i))
-
-            # if we have an llc grid, then we have to reform to compact
-            if model_grid_type == 'llc':
-                tmp_field = llc_tiles_to_compact(
-                    tmp_fields[i, :], less_output=True)
-
-            # otherwise assume grid is x,y (2 dimensions)
-            elif model_grid_type == 'latlon':
-                tmp_field = tmp_fields[i, :]
-
-            else:
-                print('unknown model grid type!')
-                tmp_field = []
-                return []
-
-            # make sure we have something to save...
-            if len(tmp_field) > 0:
-                # if this is the first record, create new binary file
-                tmp_field.astype(dt_out).tofile(fd1)
-
-        # close the file at the end of the operation
-        fd1.close()
+        # records are converted and appended in groups of consecutive
+        # records, each group with one vectorized conversion and one write
+        records_per_write = max(1, BINARY_CHUNK_BYTES //
+                                max(1, data_values[:1].nbytes))
+
+        if checksum_algorithm:
+            binary_hash = hashlib.new(checksum_algorithm)
+
+        with open(str(binary_output_filename), 'wb') as fd1:
+            for i in range(0, len(data_values), records_per_write):
+                records = binary_records(data_values[i:i + records_per_write],
+                                         binary_fill_value, dt_out,
+                                         model_grid_type)
+                if checksum_algorithm:
+                    binary_hash.update(records)
+                records.tofile(fd1)
+
+        if checksum_algorithm:
+            checksums['binary'] = binary_hash.hexdigest()
 
     if save_netcdf:
         # print('saving netcdf record')
@@ -223,4 +307,14 @@ def save_to_disk(data,
         data_DS.to_netcdf(netcdf_output_filename,  encoding=encoding)
         data_DS.close()
 
+        if checksum_algorithm:
+            netcdf_hash = hashlib.new(checksum_algorithm)
+            with open(netcdf_output_filename, 'rb') as f:
+                for block in iter(lambda: f.read(BINARY_CHUNK_BYTES), b''):
+                    netcdf_hash.update(block)
+
+            checksums['netcdf'] = netcdf_hash.hexdigest()
+
+    return checksums
+
 # %%
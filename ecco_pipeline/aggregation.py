@@ -1,14 +1,18 @@
 import json
 import logging
+import os
 import sys
 import uuid
+from collections import defaultdict
 from datetime import datetime, timedelta
+from multiprocessing import Pool
 from pathlib import Path
 
+import netCDF4
 import numpy as np
 import xarray as xr
 from netCDF4 import default_fillvals  # pylint: disable=no-name-in-module
-from utils import solr_utils
+from utils import file_utils, solr_utils
 
 logging.config.fileConfig('logs/log.ini', disable_existing_loggers=False)
 log = logging.getLogger(__name__)
@@ -25,15 +29,33 @@ def years_to_aggregate(dataset_name, grid_name):
 
     years = []
 
+    # All transformation and aggregation docs for this grid, in two paged queries
     fq = [f'dataset_s:{dataset_name}',
           'type_s:transformation', f'grid_name_s:{grid_name}']
-    r = solr_utils.solr_query(fq)
-    transformation_years = list(set([t['date_s'][:4] for t in r]))
-    transformation_years.sort()
-    transformation_docs = r
-
-    # Years with transformations that exist for this dataset and this grid
-    for year in transformation_years:
+    fl = 'date_s,field_s,transformation_completed_dt'
+    latest_transformations = {}
+    transformation_counts = defaultdict(int)
+    for t in solr_utils.solr_query_iter(fq, fl):
+        year = t['date_s'][:4]
+        latest_transformations[year] = max(latest_transformations.get(year, ''),
+                                           t['transformation_completed_dt'])
+        transformation_counts[(year, t['field_s'])] += 1
+
+    fq = [f'dataset_s:{dataset_name}', 'type_s:aggregation',
+          f'grid_name_s:{grid_name}']
+    fl = 'year_s,field_s,aggregation_time_dt,transformation_count_l'
+    aggregation_times = {}
+    years_with_removed_transformations = set()
+    for a in solr_utils.solr_query_iter(fq, fl):
+        year = a['year_s']
+        aggregation_times[year] = min(aggregation_times.get(year, a['aggregation_time_dt']),
+                                      a['aggregation_time_dt'])
+        if transformations_removed(a, transformation_counts[(year, a['field_s'])]):
+            years_with_removed_transformations.add(year)
+
+    # Years with transformations that exist for this dataset and this grid, and
+    # aggregated years that have lost all of theirs
+    for year in sorted(set(latest_transformations) | years_with_removed_transformations):
         # We want to see if we need to aggregate this year again
         # 1. check if aggregation exists - if not add it to years to aggregate
         # 2. if it does - compare prcessing times:
@@ -41,34 +63,695 @@ def years_to_aggregate(dataset_name, grid_name):
         #     no need to aggregate
         #   - if at least one transformation occured after agg time, year needs to
         #     be aggregated
-        fq = [f'dataset_s:{dataset_name}', 'type_s:aggregation',
-              f'grid_name_s:{grid_name}', f'year_s:{year}']
-        r = solr_utils.solr_query(fq)
-
-        if r:
-            agg_time = r[0]['aggregation_time_dt']
-            for t in transformation_docs:
-                if t['date_s'][:4] != year:
-                    continue
-                if t['transformation_completed_dt'] > agg_time:
-                    years.append(year)
-                    break
-        else:
+        # 3. if transformations were removed since the year was aggregated, year
+        #    needs to be aggregated
+        if year in years_with_removed_transformations or \
+                year not in aggregation_times or \
+                latest_transformations[year] > aggregation_times[year]:
             years.append(year)
 
     return years
 
 
-def aggregation(output_dir, config, grids_to_use=[]):
+def transformations_removed(aggregation_doc, transformation_count):
     """
-    Aggregates data into annual files, saves them, and updates Solr
+    Returns whether a (grid, field, year) has fewer transformations than when
+    it was aggregated. Aggregations from before transformation counts were
+    recorded are assumed unchanged.
     """
+    return transformation_count < aggregation_doc.get('transformation_count_l', 0)
 
-    # =====================================================
-    # Code to import ecco utils locally...
-    # =====================================================
-    sys.path.append('../ecco-cloud-utils/')
-    import ecco_cloud_utils as ea  # pylint: disable=import-error
+
+def count_year_transformations(year_transformations, field_name, year):
+    """
+    Returns the number of transformations of a field dated within year, as
+    recorded in its aggregation entry.
+    """
+    return sum(len(docs) for (field, date), docs in year_transformations.items()
+               if field == field_name and date[:4] == year)
+
+
+def get_year_transformations(dataset_name, grid_name, year, tolerance=0):
+    """
+    Returns the transformation docs of a grid for a year, indexed by
+    (field, 'YYYY-MM-DD'), with one paged query. tolerance extends the date
+    range on either side of the year so monthly tolerance windows can be
+    resolved in memory.
+    """
+    start = np.datetime64(f'{year}-01-01') - np.timedelta64(tolerance, 'D')
+    end = np.datetime64(f'{int(year)+1}-01-01') + np.timedelta64(tolerance, 'D')
+
+    # date_s values are 'YYYY-MM-DDT00:00:00Z' strings
+    fq = [f'dataset_s:{dataset_name}', 'type_s:transformation',
+          f'grid_name_s:{grid_name}', f'date_s:["{start}" TO "{end}"}}']
+
+    transformations = defaultdict(list)
+    for doc in solr_utils.solr_query_iter(fq, solr_utils.TRANSFORMATION_FL):
+        transformations[(doc['field_s'], doc['date_s'][:10])].append(doc)
+
+    return transformations
+
+
+def get_harvested_metadata(dataset_name, year, tolerance=0):
+    """
+    Returns the granule docs of a dataset for a year (extended by tolerance
+    days on either side), indexed by pre_transformation_file_path_s.
+    """
+    start = np.datetime64(f'{year}-01-01') - np.timedelta64(tolerance, 'D')
+    end = np.datetime64(f'{int(year)+1}-01-01') + np.timedelta64(tolerance, 'D')
+
+    fq = [f'dataset_s:{dataset_name}', 'type_s:granule',
+          f'date_s:["{start}" TO "{end}"}}']
+
+    harvested_metadata = defaultdict(list)
+    for doc in solr_utils.solr_query_iter(fq, solr_utils.GRANULE_FL):
+        if 'pre_transformation_file_path_s' in doc:
+            harvested_metadata[doc['pre_transformation_file_path_s']].append(doc)
+
+    return harvested_metadata
+
+
+def read_cf_times(nc, name):
+    """
+    Returns the decoded datetime64 values of a time variable of an open netCDF4
+    Dataset, as xarray would decode them.
+    """
+    time_var = nc.variables[name]
+    time_var.set_auto_maskandscale(False)
+
+    # Bounds variables can inherit their units from time
+    units = getattr(time_var, 'units', getattr(nc.variables['time'], 'units', None))
+    calendar = getattr(time_var, 'calendar',
+                       getattr(nc.variables['time'], 'calendar', 'standard'))
+
+    return xr.coding.times.decode_cf_datetime(time_var[:], units, calendar)
+
+
+def write_cf_times(nc, name, values, indices):
+    """
+    Encodes datetime64 values and writes them at indices of a time variable of
+    an open netCDF4 Dataset, with the variable's own units.
+    """
+    time_var = nc.variables[name]
+    time_var.set_auto_maskandscale(False)
+
+    units = getattr(time_var, 'units', getattr(nc.variables['time'], 'units', None))
+    calendar = getattr(time_var, 'calendar',
+                       getattr(nc.variables['time'], 'calendar', 'standard'))
+
+    num_dates, _, _ = xr.coding.times.encode_cf_datetime(values[indices], units, calendar)
+    time_var[indices] = num_dates.astype(time_var.dtype)
+
+
+def find_data_var(nc, data_var):
+    """
+    Returns data_var if it is in the open netCDF4 Dataset, otherwise the name of
+    the one variable that is not a coordinate.
+    """
+    if data_var in nc.variables:
+        return data_var
+
+    coord_names = set(nc.dimensions)
+    coord_names.update(getattr(nc, 'coordinates', '').split())
+    for var in nc.variables.values():
+        coord_names.update(getattr(var, 'coordinates', '').split())
+        coord_names.update(getattr(var, 'bounds', '').split())
+
+    return [name for name in nc.variables if name not in coord_names][0]
+
+
+def read_transformed_record(file_path, data_var, out):
+    """
+    Reads the single data variable of a transformed file into out, with fill
+    values as NaN. Returns the variable's name and attributes, the file's
+    global attributes, and its decoded time and time bounds.
+    """
+    with netCDF4.Dataset(file_path) as nc:
+        data_var = find_data_var(nc, data_var)
+
+        var = nc.variables[data_var]
+        var.set_auto_maskandscale(False)
+
+        values = var[0]
+        out[...] = values
+        for fill_attr in ['_FillValue', 'missing_value']:
+            if fill_attr in var.ncattrs():
+                out[values == var.getncattr(fill_attr)] = np.nan
+
+        var_attrs = {attr: var.getncattr(attr) for attr in var.ncattrs()
+                     if attr not in ['_FillValue', 'missing_value', 'coordinates']}
+        global_attrs = {attr: nc.getncattr(attr) for attr in nc.ncattrs()
+                        if attr != 'coordinates'}
+
+        time = read_cf_times(nc, 'time')[0]
+        time_bnds = read_cf_times(nc, 'time_bnds')[0]
+
+    return data_var, var_attrs, global_attrs, time, time_bnds
+
+
+def empty_record_times(date, data_time_scale):
+    """
+    Returns the center time and time bounds of an empty record for date.
+    """
+    start_time = np.datetime64(date, 'ns')
+
+    # MONTHLY cannot use timedelta64 since it has a variable
+    # number of ns/s/d. DAILY can so we use it.
+    if data_time_scale.upper() == 'MONTHLY':
+        end_time = np.datetime64(np.datetime64(date, 'M') + 1, 'ns')
+    elif data_time_scale.upper() == 'DAILY':
+        end_time = start_time + np.timedelta64(1, 'D')
+
+    _, ct = ea.make_time_bounds_from_ds64(end_time, 'AVG_MON')
+
+    return ct, np.array([start_time, end_time])
+
+
+def read_record(date, file_paths, data_var, data_time_scale, out):
+    """
+    Reads the transformed files of one record into out, merging hemispheres:
+    the first file with data is used, with its NaNs filled from the other.
+    Returns the data variable name and attributes of the file used (None for
+    empty records), the record's time and time bounds, and the global
+    attributes of all files.
+    """
+    out[...] = np.nan
+
+    record_var_name = None
+    record_var_attrs = None
+    time, time_bnds = empty_record_times(date, data_time_scale)
+    global_attrs = {}
+
+    for file_path in file_paths:
+        if np.isnan(out).all():
+            # First file, or the first hemisphere had no data
+            record_var_name, record_var_attrs, file_attrs, time, time_bnds = \
+                read_transformed_record(file_path, data_var, out)
+        else:
+            # Fill the NaNs of the first hemisphere with the second one
+            record = np.empty_like(out)
+            _, _, file_attrs, _, _ = read_transformed_record(file_path, data_var, record)
+            np.copyto(out, record, where=np.isnan(out))
+
+        for key, value in file_attrs.items():
+            global_attrs.setdefault(key, value)
+
+    return record_var_name, record_var_attrs, time, time_bnds, global_attrs
+
+
+def assemble_year(year_records, data_var, field, model_grid, grid_type, array_precision,
+                  data_time_scale):
+    """
+    Builds the yearly Dataset of a field from its transformed files.
+    year_records is a list of (date, [transformation file paths]) for every
+    record of the year, dates without files become empty (NaN) records.
+    One (time x grid) array is preallocated and each file's data variable is
+    read straight into its slot. Hemispheres are merged in place.
+    """
+    field_name = field['name_s']
+
+    # Coordinates and attributes of empty records
+    template = ea.make_empty_record(field['standard_name_s'], field['long_name_s'],
+                                    field['units_s'], year_records[0][0], model_grid,
+                                    grid_type, array_precision)
+    empty_record_attrs = dict(template.attrs)
+    empty_record_attrs['original_field_name'] = field_name
+    empty_record_attrs['interpolation_date'] = str(np.datetime64(datetime.now(), 'D'))
+
+    num_records = len(year_records)
+    data = np.full((num_records,) + template.shape[1:], np.nan, dtype=array_precision)
+    times = np.empty(num_records, dtype='datetime64[ns]')
+    time_bnds = np.empty((num_records, 2), dtype='datetime64[ns]')
+
+    data_var_name = data_var
+    data_var_attrs = empty_record_attrs
+    global_attrs = {}
+    first_file_path = None
+
+    for t, (date, file_paths) in enumerate(year_records):
+        record_var_name, record_var_attrs, times[t], time_bnds[t], file_attrs = \
+            read_record(date, file_paths, data_var, data_time_scale, data[t])
+
+        if file_paths and first_file_path is None:
+            first_file_path = file_paths[0]
+
+        for key, value in file_attrs.items():
+            global_attrs.setdefault(key, value)
+
+        if t == 0 and record_var_name is not None:
+            data_var_name = record_var_name
+            data_var_attrs = record_var_attrs
+
+    # Grid coordinates come from the transformed files when there are any
+    time_attrs = {'bounds': 'time_bnds'}
+    if first_file_path is not None:
+        with xr.open_dataset(first_file_path) as first_DS:
+            grid_coords = {name: first_DS.coords[name].variable.load()
+                           for name in first_DS.coords if name not in ['time', 'time_bnds']}
+            time_attrs = dict(first_DS.time.attrs)
+    else:
+        grid_coords = {name: template.coords[name].variable
+                       for name in template.coords
+                       if name not in ['time', 'time_start', 'time_end']}
+
+    coords = dict(grid_coords)
+    coords['time'] = ('time', times, time_attrs)
+    coords['time_bnds'] = (('time', 'nv'), time_bnds)
+
+    DS_year = xr.Dataset({data_var_name: (template.dims, data, data_var_attrs)},
+                         coords=coords, attrs=global_attrs)
+
+    return DS_year
+
+
+def write_binary_records(binary_path, records, indices, binary_fill_value, binary_dtype,
+                         grid_type):
+    """
+    Overwrites records of an existing flat binary file in place.
+    """
+    # llc grids are saved in compact form
+    records = ea.binary_records(records, binary_fill_value, binary_dtype, grid_type)
+
+    with open(binary_path, 'r+b') as f:
+        for t, record in zip(indices, records):
+            f.seek(t * record.nbytes)
+            record.tofile(f)
+
+
+def monthly_mean(records, skipna, remove_nan_days):
+    """
+    Mean of the daily records of a month, as computed by
+    generalized_aggregate_and_save.
+    """
+    return ea.monthly_means(records, [0] * len(records), skipna, remove_nan_days)[0]
+
+
+def patch_aggregated_year(year_records, changed_indices, data_var, output_filepaths, config,
+                          fill_values, binary_dtype, grid_type, data_time_scale, year):
+    """
+    Overwrites the changed records of an existing daily aggregation in place,
+    in its netCDF and binary files, and recomputes the monthly means of the
+    months they fall in. Returns the uuids of the daily and monthly files.
+    """
+    save_binary = config['save_binary']
+    uuids = ['', '']
+
+    with netCDF4.Dataset(output_filepaths['daily_netCDF'], 'r+') as nc:
+        if str(getattr(nc, 'aggregation_version', '')) != str(config['a_version']):
+            raise ValueError(f'{output_filepaths["daily_netCDF"]} was made with aggregation '
+                             f'version {getattr(nc, "aggregation_version", "")}')
+
+        var = nc.variables[find_data_var(nc, data_var)]
+        var.set_auto_maskandscale(False)
+
+        if var.shape[0] != len(year_records):
+            raise ValueError(f'{output_filepaths["daily_netCDF"]} has {var.shape[0]} '
+                             f'records, expected {len(year_records)}')
+
+        netcdf_fill_value = var.getncattr('_FillValue')
+
+        year_data = var[:]
+        year_data[year_data == netcdf_fill_value] = np.nan
+
+        times = read_cf_times(nc, 'time')
+        time_bnds = read_cf_times(nc, 'time_bnds')
+        previous_times = times.copy()
+
+        for t in changed_indices:
+            date, file_paths = year_records[t]
+            _, _, times[t], time_bnds[t], _ = read_record(date, file_paths, data_var,
+                                                          data_time_scale, year_data[t])
+
+            var[t] = np.where(np.isnan(year_data[t]), netcdf_fill_value, year_data[t])
+
+        if changed_indices:
+            write_cf_times(nc, 'time', times, changed_indices)
+            write_cf_times(nc, 'time_bnds', time_bnds, changed_indices)
+
+            var.setncattr('valid_min', np.nanmin(year_data))
+            var.setncattr('valid_max', np.nanmax(year_data))
+
+            if 0 in changed_indices:
+                nc.setncattr('time_coverage_start', str(time_bnds[0][0])[0:19])
+            if len(year_records) - 1 in changed_indices:
+                nc.setncattr('time_coverage_end', str(time_bnds[-1][-1])[0:19])
+
+        uuids[0] = nc.getncattr('uuid')
+
+    if save_binary and changed_indices:
+        write_binary_records(output_filepaths['daily_bin'], year_data[changed_indices],
+                             changed_indices, fill_values['binary'], binary_dtype, grid_type)
+
+    if not config['do_monthly_aggregation']:
+        return uuids
+
+    # Months of the changed records, before and after the patch
+    changed_months = {str(np.datetime64(time, 'M'))
+                      for time in np.concatenate((previous_times[changed_indices],
+                                                  times[changed_indices]))}
+    months = [month for month in range(1, 13)
+              if f'{year}-{str(month).zfill(2)}' in changed_months]
+
+    record_months = times.astype('datetime64[M]')
+
+    with netCDF4.Dataset(output_filepaths['monthly_netCDF'], 'r+') as nc:
+        mon_var = nc.variables[find_data_var(nc, data_var)]
+        mon_var.set_auto_maskandscale(False)
+
+        mon_fill_value = mon_var.getncattr('_FillValue')
+
+        mon_data = mon_var[:]
+        mon_data[mon_data == mon_fill_value] = np.nan
+
+        for month in months:
+            in_month = record_months == np.datetime64(f'{year}-{str(month).zfill(2)}')
+
+            mon_data[month - 1] = monthly_mean(year_data[in_month], config['skipna_in_mean'],
+                                               config['remove_nan_days_from_data'])
+
+            mon_var[month - 1] = np.where(np.isnan(mon_data[month - 1]),
+                                          mon_fill_value, mon_data[month - 1])
+
+        if months:
+            nc.setncattr('valid_min', np.nanmin(mon_data))
+            nc.setncattr('valid_max', np.nanmax(mon_data))
+
+        mon_attrs = {attr: nc.getncattr(attr) for attr in ['valid_min', 'valid_max']}
+        uuids[1] = nc.getncattr('uuid')
+
+    # generalized_aggregate_and_save writes the monthly global attributes to
+    # the daily file too
+    if months:
+        with netCDF4.Dataset(output_filepaths['daily_netCDF'], 'r+') as nc:
+            for attr, value in mon_attrs.items():
+                if attr in nc.ncattrs():
+                    nc.setncattr(attr, value)
+
+    if save_binary and months:
+        month_indices = [month - 1 for month in months]
+        write_binary_records(output_filepaths['monthly_bin'], mon_data[month_indices],
+                             month_indices, fill_values['binary'], binary_dtype, grid_type)
+
+    return uuids
+
+
+# Arguments shared by every aggregation unit, set once per worker process
+worker_args = {}
+
+# Model grids opened by this process, by grid path
+model_grids = {}
+
+
+def init_worker(config, output_dir):
+    """
+    Pool initializer storing the arguments shared by all aggregation units,
+    so they are sent to each worker once instead of with every unit.
+    """
+    worker_args['config'] = config
+    worker_args['output_dir'] = output_dir
+
+
+def get_model_grid(grid_path):
+    """
+    Returns the model grid at grid_path, opened once per process.
+    """
+    if grid_path not in model_grids:
+        model_grids[grid_path] = xr.open_dataset(grid_path, decode_times=True)
+    return model_grids[grid_path]
+
+
+def get_output_precision(config):
+    """
+    Returns the array precision of the output files, with the matching binary
+    dtype and the binary and netCDF fill values. float32 is standard.
+    """
+    array_precision = getattr(np, config['array_precision'])
+
+    # Define fill values for binary and netcdf
+    if array_precision == np.float32:
+        binary_dtype = '>f4'
+        netcdf_fill_value = default_fillvals['f4']
+
+    elif array_precision == np.float64:
+        binary_dtype = '>f8'
+        netcdf_fill_value = default_fillvals['f8']
+
+    fill_values = {'binary': -9999, 'netcdf': netcdf_fill_value}
+
+    return array_precision, binary_dtype, fill_values
+
+
+def aggregate_unit(unit):
+    """
+    Aggregates one (grid, field, year) unit into its annual files. Daily years
+    that were aggregated before are patched in place, others are built from
+    their transformed files. Only touches the unit's own files, so units can
+    run in parallel; Solr is updated by the caller from the returned result.
+    """
+    config = worker_args['config']
+    output_dir = worker_args['output_dir']
+
+    dataset_name = config['ds_name']
+    grid_name = unit['grid_name']
+    grid_type = unit['grid_type']
+    field = unit['field']
+    field_name = field['name_s']
+    year = unit['year']
+    data_time_scale = unit['data_time_scale']
+    year_records = unit['year_records']
+    changed_indices = unit['changed_indices']
+
+    array_precision, binary_dtype, fill_values = get_output_precision(config)
+
+    print(
+        f'\n====== Aggregating {str(year)}_{grid_name}_{field_name} ======\n')
+
+    # variable to store name of data values in dataset
+    data_var = f'{field_name}_interpolated_to_{grid_name}'
+
+    # Create filenames based on date time scale
+    # If data time scale is monthly, shortest_filename is monthly
+    shortest_filename = f'{dataset_name}_{grid_name}_{data_time_scale.upper()}_{field_name}_{year}'
+    monthly_filename = f'{dataset_name}_{grid_name}_MONTHLY_{field_name}_{year}'
+
+    output_filenames = {'shortest': shortest_filename,
+                        'monthly': monthly_filename}
+
+    output_path = f'{output_dir}/{dataset_name}/transformed_products/{grid_name}/aggregated/{field_name}/'
+
+    bin_output_dir = Path(output_path) / 'bin'
+    bin_output_dir.mkdir(parents=True, exist_ok=True)
+
+    netCDF_output_dir = Path(output_path) / 'netCDF'
+    netCDF_output_dir.mkdir(parents=True, exist_ok=True)
+
+    # generalized_aggregate_and_save expects Paths
+    output_dirs = {'binary': bin_output_dir,
+                   'netcdf': netCDF_output_dir}
+
+    # used for Solr docs metadata
+    solr_output_filepaths = {'daily_bin': f'{output_path}bin/{shortest_filename}',
+                             'daily_netCDF': f'{output_path}netCDF/{shortest_filename}.nc',
+                             'monthly_bin': f'{output_path}bin/{monthly_filename}',
+                             'monthly_netCDF': f'{output_path}netCDF/{monthly_filename}.nc'}
+
+    # Daily years that were aggregated before are patched in place, only
+    # rebuilding the changed records and the months they fall in.
+    # Years are fully rebuilt when the aggregation version changes or
+    # transformations were removed
+    aggregation_files = ['daily_netCDF']
+    if config['save_binary']:
+        aggregation_files.append('daily_bin')
+    if config['do_monthly_aggregation']:
+        aggregation_files.append('monthly_netCDF')
+        if config['save_binary']:
+            aggregation_files.append('monthly_bin')
+
+    incremental = not unit['aggregate_all_years'] and not unit['rebuild'] and \
+        data_time_scale == 'daily' and unit['existing_aggregation'] and config['save_netcdf'] and \
+        all(os.path.exists(solr_output_filepaths[f]) for f in aggregation_files)
+
+    if incremental:
+        try:
+            uuids = patch_aggregated_year(year_records, changed_indices, data_var,
+                                          solr_output_filepaths, config, fill_values,
+                                          binary_dtype, grid_type, data_time_scale, year)
+
+            print(
+                f' - Patching {len(changed_indices)} records of {str(year)}_{grid_name}_{field_name} DONE')
+
+            # Patched files were changed in place, so they are hashed again
+            output_checksums = file_utils.checksums(
+                [solr_output_filepaths[f] for f in aggregation_files])
+            output_checksums = {f: output_checksums[solr_output_filepaths[f]]
+                                for f in aggregation_files}
+
+            empty_year = False
+            success = True
+
+        except Exception as e:
+            log.exception(
+                f'{dataset_name} incremental aggregation error, rebuilding year! {e}')
+            incremental = False
+
+    if not incremental:
+        uuids = [str(uuid.uuid1()), str(uuid.uuid1())]
+        saved_checksums = {}
+
+        try:
+            # Read all data files within the year into one array
+            model_grid = get_model_grid(unit['grid_path'])
+            daily_DS_year_merged = assemble_year(year_records, data_var, field, model_grid,
+                                                 grid_type, array_precision, data_time_scale)
+            data_var = list(daily_DS_year_merged.keys())[0]
+
+            daily_DS_year_merged.attrs['aggregation_version'] = config['a_version']
+
+            daily_DS_year_merged[data_var].attrs['valid_min'] = np.nanmin(
+                daily_DS_year_merged[data_var].values)
+            daily_DS_year_merged[data_var].attrs['valid_max'] = np.nanmax(
+                daily_DS_year_merged[data_var].values)
+
+            remove_keys = []
+            for (key, _) in daily_DS_year_merged[data_var].attrs.items():
+                if ('original' in key and key != 'original_field_name'):
+                    remove_keys.append(key)
+
+            for key in remove_keys:
+                del daily_DS_year_merged[data_var].attrs[key]
+
+            # Performs the aggreagtion of the yearly data, and saves it
+            empty_year = ea.generalized_aggregate_and_save(daily_DS_year_merged,
+                                                           data_var,
+                                                           config['do_monthly_aggregation'],
+                                                           int(year),
+                                                           config['skipna_in_mean'],
+                                                           output_filenames,
+                                                           fill_values,
+                                                           output_dirs,
+                                                           binary_dtype,
+                                                           grid_type,
+                                                           on_aws=False,
+                                                           save_binary=config['save_binary'],
+                                                           save_netcdf=config['save_netcdf'],
+                                                           remove_nan_days_from_data=config[
+                                                               'remove_nan_days_from_data'],
+                                                           data_time_scale=data_time_scale,
+                                                           uuids=uuids,
+                                                           checksums=saved_checksums)
+
+            # Files are hashed as they are written
+            output_checksums = {}
+            for key, filename_key in [('daily', 'shortest'), ('monthly', 'monthly')]:
+                for file_key, checksum_key in [('bin', 'binary'), ('netCDF', 'netcdf')]:
+                    if checksum_key in saved_checksums.get(filename_key, {}):
+                        output_checksums[f'{key}_{file_key}'] = saved_checksums[filename_key][checksum_key]
+                        file_utils.cache_checksum(solr_output_filepaths[f'{key}_{file_key}'],
+                                                  saved_checksums[filename_key][checksum_key])
+
+            print(
+                f' - Saving {str(year)}_{grid_name}_{field_name} file(s) DONE')
+
+            success = True
+
+        except Exception as e:
+            log.exception(f'{dataset_name} aggregation error! {e}')
+            empty_year = True
+            success = False
+
+    empty_year = empty_year and success
+
+    if empty_year or not success:
+        solr_output_filepaths = {'daily_bin': '',
+                                 'daily_netCDF': '',
+                                 'monthly_bin': '',
+                                 'monthly_netCDF': ''}
+        output_checksums = {}
+
+    return {'grid_name': grid_name,
+            'field_name': field_name,
+            'year': year,
+            'success': success,
+            'empty_year': empty_year,
+            'uuids': uuids,
+            'filepaths': solr_output_filepaths,
+            'checksums': output_checksums,
+            'transformation_count': unit['transformation_count']}
+
+
+def make_aggregation_update(result, existing_aggregation, config, data_time_scale,
+                            aggregation_time):
+    """
+    Returns the Solr update for the aggregation entry of an aggregated unit,
+    updating the existing entry by id or creating a new one.
+    """
+    aggregation_version = str(config['a_version'])
+    solr_output_filepaths = result['filepaths']
+    uuids = result['uuids']
+    checksums = result['checksums']
+
+    # If aggregation exists, update using Solr entry id
+    if existing_aggregation:
+        update = {
+            "id": existing_aggregation['id'],
+            "aggregation_time_dt": {"set": aggregation_time},
+            "aggregation_version_s": {"set": aggregation_version},
+            "transformation_count_l": {"set": result['transformation_count']}
+        }
+    else:
+        # Create new aggregation entry if it doesn't exist
+        update = {
+            "type_s": 'aggregation',
+            "dataset_s": config['ds_name'],
+            "year_s": result['year'],
+            "grid_name_s": result['grid_name'],
+            "field_s": result['field_name'],
+            "aggregation_time_dt": aggregation_time,
+            "aggregation_success_b": result['success'],
+            "aggregation_version_s": aggregation_version,
+            "transformation_count_l": result['transformation_count']
+        }
+
+    # Update file paths according to the data time scale and do monthly aggregation config field
+    if data_time_scale == 'daily':
+        update["aggregated_daily_bin_path_s"] = {
+            "set": solr_output_filepaths['daily_bin']}
+        update["aggregated_daily_netCDF_path_s"] = {
+            "set": solr_output_filepaths['daily_netCDF']}
+        update["daily_aggregated_uuid_s"] = {"set": uuids[0]}
+        update["aggregated_daily_bin_checksum_s"] = {
+            "set": checksums.get('daily_bin', '')}
+        update["aggregated_daily_netCDF_checksum_s"] = {
+            "set": checksums.get('daily_netCDF', '')}
+    if data_time_scale == 'monthly' or config['do_monthly_aggregation']:
+        update["aggregated_monthly_bin_path_s"] = {
+            "set": solr_output_filepaths['monthly_bin']}
+        update["aggregated_monthly_netCDF_path_s"] = {
+            "set": solr_output_filepaths['monthly_netCDF']}
+        update["monthly_aggregated_uuid_s"] = {"set": uuids[1]}
+        update["aggregated_monthly_bin_checksum_s"] = {
+            "set": checksums.get('monthly_bin', '')}
+        update["aggregated_monthly_netCDF_checksum_s"] = {
+            "set": checksums.get('monthly_netCDF', '')}
+
+    if result['empty_year']:
+        update["notes_s"] = {
+            "set": 'Empty year (no data present in grid), not saving to disk.'}
+    else:
+        update["notes_s"] = {"set": ''}
+
+    return update
+
+
+def aggregation(output_dir, config, grids_to_use=[], multiprocessing=False, user_cpus=1):
+    """
+    Aggregates data into annual files, saves them, and updates Solr.
+
+    Solr is read up front to plan one unit per (grid, field, year). When
+    multiprocessing, units are aggregated by up to user_cpus processes, which
+    also bounds the concurrent disk use. Solr is then updated from the units'
+    results in batches by a single writer.
+    """
 
     # =====================================================
     # Set configuration options and Solr metadata
@@ -79,7 +762,8 @@ def aggregation(output_dir, config, grids_to_use=[]):
     # Pull metadata from Solr
     # =====================================================
     fq = ['type_s:grid']
-    grids = [grid for grid in solr_utils.solr_query(fq)]
+    fl = 'grid_name_s,grid_path_s,grid_type_s'
+    grids = [grid for grid in solr_utils.solr_query(fq, fl)]
 
     # Update grids to only use those in grids_to_use
     if grids_to_use:
@@ -87,11 +771,11 @@ def aggregation(output_dir, config, grids_to_use=[]):
 
     # Query Solr for fields
     fq = ['type_s:field', f'dataset_s:{dataset_name}']
-    fields = solr_utils.solr_query(fq)
+    fields = solr_utils.solr_query(fq, solr_utils.FIELD_FL)
 
     # Query Solr for dataset metadata
     fq = ['type_s:dataset', f'dataset_s:{dataset_name}']
-    dataset_metadata = solr_utils.solr_query(fq)[0]
+    dataset_metadata = solr_utils.solr_query(fq, solr_utils.ALL_FL)[0]
 
     aggregate_all_years = False
     aggregation_version = str(config['a_version'])
@@ -102,23 +786,30 @@ def aggregation(output_dir, config, grids_to_use=[]):
 
     data_time_scale = dataset_metadata['data_time_scale_s']
 
-    # Define precision of output files, float32 is standard
-    array_precision = getattr(np, config['array_precision'])
-
-    # Define fill values for binary and netcdf
-    if array_precision == np.float32:
-        binary_dtype = '>f4'
-        netcdf_fill_value = default_fillvals['f4']
+    # Days around the first of the month searched for monthly data
+    if data_time_scale == 'monthly':
+        if config['monthly_tolerance']:
+            tolerance = int(config['monthly_tolerance'])
+        else:
+            tolerance = 8
+    else:
+        tolerance = 0
 
-    elif array_precision == np.float64:
-        binary_dtype = '>f8'
-        netcdf_fill_value = default_fillvals['f8']
+    # Aggregation entries are timestamped with the start of planning, so
+    # transformations completed while aggregating are picked up next run
+    aggregation_time = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
 
-    fill_values = {'binary': -9999, 'netcdf': netcdf_fill_value}
+    # Granule docs of each year, shared by all grids
+    harvested_metadata_by_year = {}
 
-    update_body = []
+    # Descendants doc ids of each year, shared by all grids
+    descendants_ids_by_year = {}
 
-    aggregation_successes = True
+    # Units to aggregate, with their existing aggregation docs and
+    # transformations, by (grid, field, year)
+    units = []
+    existing_aggregations = {}
+    transformations_by_unit = {}
 
     # =====================================================
     # Loop through grids
@@ -146,7 +837,12 @@ def aggregation(output_dir, config, grids_to_use=[]):
         print(
             f'\nAggregating years {min(years)} to {max(years)} for {grid_name}\n')
 
-        model_grid = xr.open_dataset(grid_path, decode_times=True)
+        # Existing aggregation docs for this grid
+        fq = [f'dataset_s:{dataset_name}', 'type_s:aggregation',
+              f'grid_name_s:{grid_name}']
+        fl = 'id,field_s,year_s,aggregation_time_dt,transformation_count_l'
+        for doc in solr_utils.solr_query_iter(fq, fl):
+            existing_aggregations[(grid_name, doc['field_s'], doc['year_s'])] = doc
 
         # =====================================================
         # Loop through years
@@ -162,6 +858,21 @@ def aggregation(output_dir, config, grids_to_use=[]):
                     f'{year}-01', f'{int(year)+1}-01', dtype='datetime64[M]')
                 dates_in_year = [f'{date}-01' for date in dates_in_year]
 
+            # All transformations and granules for this year, resolved by date in memory
+            year_transformations = get_year_transformations(dataset_name, grid_name, year,
+                                                            tolerance)
+            if year not in harvested_metadata_by_year:
+                harvested_metadata_by_year[year] = get_harvested_metadata(dataset_name, year,
+                                                                          tolerance)
+            harvested_metadata_by_path = harvested_metadata_by_year[year]
+
+            # Descendants entries from this year
+            if year not in descendants_ids_by_year:
+                fq = ['type_s:descendants',
+                      f'dataset_s:{dataset_name}', f'date_s:{year}*']
+                descendants_ids_by_year[year] = [doc['id'] for doc in
+                                                 solr_utils.solr_query_iter(fq, 'id')]
+
             # =====================================================
             # Loop through fields
             # =====================================================
@@ -169,34 +880,24 @@ def aggregation(output_dir, config, grids_to_use=[]):
 
                 field_name = field['name_s']
 
-                print(
-                    f'\n====== Aggregating {str(year)}_{grid_name}_{field_name} ======\n')
-
-                json_output = {}
                 transformations = []
-                json_output['dataset'] = dataset_metadata
 
-                daily_DS_year = []
+                # Transformed files of each record of the year
+                year_records = []
+
+                # Records with transformations newer than the existing aggregation
+                existing_aggregation = existing_aggregations.get((grid_name, field_name, year))
+                changed_indices = []
 
                 # =====================================================
                 # Loop through dates
                 # =====================================================
                 for date in dates_in_year:
-                    # variable to store name of data values in dataset
-                    data_var = f'{field_name}_interpolated_to_{grid_name}'
-
-                    # Query for date
-                    fq = [f'dataset_s:{dataset_name}', 'type_s:transformation',
-                          f'grid_name_s:{grid_name}', f'field_s:{field_name}', f'date_s:{date}*']
-
-                    docs = solr_utils.solr_query(fq)
+                    # Transformations for date
+                    docs = year_transformations.get((field_name, str(date)), [])
 
-                    # If first of month is not found, query with 7 day tolerance only for monthly data
+                    # If first of month is not found, look within the tolerance only for monthly data
                     if not docs and data_time_scale == 'monthly':
-                        if config['monthly_tolerance']:
-                            tolerance = int(config['monthly_tolerance'])
-                        else:
-                            tolerance = 8
                         start_month_date = datetime.strptime(date, '%Y-%m-%d')
                         tolerance_days = []
 
@@ -210,352 +911,134 @@ def aggregation(output_dir, config, grids_to_use=[]):
                                 datetime.strftime(neg_date, '%Y-%m-%d'))
 
                         for tol_date in tolerance_days:
-                            fq = [f'dataset_s:{dataset_name}', 'type_s:transformation',
-                                  f'grid_name_s:{grid_name}', f'field_s:{field_name}', f'date_s:{tol_date}*']
-                            docs = solr_utils.solr_query(fq)
+                            docs = year_transformations.get((field_name, tol_date), [])
 
                             if docs:
                                 break
 
-                    # If transformed file is present for date, grid, and field combination
-                    # open the file, otherwise make empty record
-                    opened_datasets = []
+                    # If transformed files are present for date, grid, and field combination
+                    # they are read into the year, otherwise the record is empty.
+                    # More than one file implies hemisphered data
                     for doc in docs:
-                        data_DS = xr.open_dataset(
-                            doc['transformation_file_path_s'], decode_times=True)
-
-                        # get name of data variable in the dataset
-                        # to be used when accessing the values of the transformed data
-                        # since the transformed files only have one variable, we index at zero to get it
-                        # type is str
-                        data_var = list(data_DS.keys())[0]
-
-                        opened_datasets.append((data_DS, data_var))
-
                         # Update JSON transformations list
-                        fq = [f'dataset_s:{dataset_name}', 'type_s:granule',
-                              f'pre_transformation_file_path_s:"{doc["pre_transformation_file_path_s"]}"']
-                        harvested_metadata = solr_utils.solr_query(fq)
+                        harvested_metadata = harvested_metadata_by_path.get(
+                            doc['pre_transformation_file_path_s'], [])
 
                         transformation_metadata = doc
                         transformation_metadata['harvested'] = harvested_metadata
                         transformations.append(transformation_metadata)
 
-                    # If there are more than one files for this grid/field/date combination (implies hemisphered data),
-                    # combine hemispheres on nonempty datafile, if present.
-                    if len(opened_datasets) == 2:
-                        first_DS = opened_datasets[0][0]
-                        first_DS_name = opened_datasets[0][1]
-                        second_DS = opened_datasets[1][0]
-                        second_DS_name = opened_datasets[1][1]
-                        if ~np.isnan(first_DS[first_DS_name].values).all():
-                            data_DS = first_DS.copy()
-                            data_DS[first_DS_name].values = np.where(
-                                np.isnan(data_DS[first_DS_name].values), second_DS[second_DS_name].values, data_DS[first_DS_name].values)
-                            data_var = first_DS_name
-                        else:
-                            data_DS = second_DS.copy()
-                            data_DS[second_DS_name].values = np.where(
-                                np.isnan(data_DS[second_DS_name].values), first_DS[first_DS_name].values, data_DS[second_DS_name].values)
-                            data_var = second_DS_name
-                    elif len(opened_datasets) == 1:
-                        data_DS = opened_datasets[0][0]
-                        data_var = opened_datasets[0][1]
-                    else:
-                        data_DA = ea.make_empty_record(
-                            field['standard_name_s'], field['long_name_s'], field['units_s'], date, model_grid, grid_type, array_precision)
-                        data_DA.name = data_var
-
-                        empty_record_attrs = data_DA.attrs
-                        empty_record_attrs['original_field_name'] = field_name
-                        empty_record_attrs['interpolation_date'] = str(
-                            np.datetime64(datetime.now(), 'D'))
-                        data_DA.attrs = empty_record_attrs
-
-                        data_DS = data_DA.to_dataset()
-
-                        # add time_bnds coordinate
-                        # [start_time, end_time] dimensions
-                        # MONTHLY cannot use timedelta64 since it has a variable
-                        # number of ns/s/d. DAILY can so we use it.
-                        if data_time_scale.upper() == 'MONTHLY':
-                            end_time = str(data_DS.time_end.values[0])
-                            month = str(np.datetime64(end_time, 'M') + 1)
-                            end_time = [str(np.datetime64(month, 'ns'))]
-                        elif data_time_scale.upper() == 'DAILY':
-                            end_time = data_DS.time_end.values + \
-                                np.timedelta64(1, 'D')
-
-                        _, ct = ea.make_time_bounds_from_ds64(
-                            np.datetime64(end_time[0], 'ns'), 'AVG_MON')
-                        data_DS.time.values[0] = ct
-
-                        start_time = data_DS.time_start.values
-
-                        time_bnds = np.array(
-                            [start_time, end_time], dtype='datetime64')
-                        time_bnds = time_bnds.T
-
-                        data_DS = data_DS.assign_coords(
-                            {'time_bnds': (['time', 'nv'], time_bnds)})
-
-                        data_DS.time.attrs.update(bounds='time_bnds')
-
-                        data_DS = data_DS.drop('time_start')
-                        data_DS = data_DS.drop('time_end')
-
-                    # Append each day's data to annual list
-                    daily_DS_year.append(data_DS)
-
-                # Concatenate all data files within annual list
-                daily_DS_year_merged = xr.concat(
-                    (daily_DS_year), dim='time', combine_attrs='no_conflicts')
-                data_var = list(daily_DS_year_merged.keys())[0]
-
-                daily_DS_year_merged.attrs['aggregation_version'] = config['a_version']
-
-                daily_DS_year_merged[data_var].attrs['valid_min'] = np.nanmin(
-                    daily_DS_year_merged[data_var].values)
-                daily_DS_year_merged[data_var].attrs['valid_max'] = np.nanmax(
-                    daily_DS_year_merged[data_var].values)
-
-                remove_keys = []
-                for (key, _) in daily_DS_year_merged[data_var].attrs.items():
-                    if ('original' in key and key != 'original_field_name'):
-                        remove_keys.append(key)
-
-                for key in remove_keys:
-                    del daily_DS_year_merged[data_var].attrs[key]
-
-                # Create filenames based on date time scale
-                # If data time scale is monthly, shortest_filename is monthly
-                shortest_filename = f'{dataset_name}_{grid_name}_{data_time_scale.upper()}_{field_name}_{year}'
-                monthly_filename = f'{dataset_name}_{grid_name}_MONTHLY_{field_name}_{year}'
-
-                output_filenames = {'shortest': shortest_filename,
-                                    'monthly': monthly_filename}
-
-                output_path = f'{output_dir}/{dataset_name}/transformed_products/{grid_name}/aggregated/{field_name}/'
-
-                bin_output_dir = Path(output_path) / 'bin'
-                bin_output_dir.mkdir(parents=True, exist_ok=True)
-
-                netCDF_output_dir = Path(output_path) / 'netCDF'
-                netCDF_output_dir.mkdir(parents=True, exist_ok=True)
-
-                # generalized_aggregate_and_save expects Paths
-                output_dirs = {'binary': bin_output_dir,
-                               'netcdf': netCDF_output_dir}
-
-                # used for Solr docs metadata
-                solr_output_filepaths = {'daily_bin': f'{output_path}bin/{shortest_filename}',
-                                         'daily_netCDF': f'{output_path}netCDF/{shortest_filename}.nc',
-                                         'monthly_bin': f'{output_path}bin/{monthly_filename}',
-                                         'monthly_netCDF': f'{output_path}netCDF/{monthly_filename}.nc'}
-
-                uuids = [str(uuid.uuid1()), str(uuid.uuid1())]
-
-                try:
-                    # Performs the aggreagtion of the yearly data, and saves it
-                    empty_year = ea.generalized_aggregate_and_save(daily_DS_year_merged,
-                                                                   data_var,
-                                                                   config['do_monthly_aggregation'],
-                                                                   int(year),
-                                                                   config['skipna_in_mean'],
-                                                                   output_filenames,
-                                                                   fill_values,
-                                                                   output_dirs,
-                                                                   binary_dtype,
-                                                                   grid_type,
-                                                                   on_aws=False,
-                                                                   save_binary=config['save_binary'],
-                                                                   save_netcdf=config['save_netcdf'],
-                                                                   remove_nan_days_from_data=config[
-                                                                       'remove_nan_days_from_data'],
-                                                                   data_time_scale=data_time_scale,
-                                                                   uuids=uuids)
-
-                    print(
-                        f' - Saving {str(year)}_{grid_name}_{field_name} file(s) DONE')
-
-                    success = True
-
-                except Exception as e:
-                    log.exception(f'{dataset_name} aggregation error! {e}')
-                    empty_year = True
-                    success = False
-                    solr_output_filepaths = {'daily_bin': '',
-                                             'daily_netCDF': '',
-                                             'monthly_bin': '',
-                                             'monthly_netCDF': ''}
-
-                aggregation_successes = aggregation_successes and success
-                empty_year = empty_year and success
-
-                if empty_year:
-                    solr_output_filepaths = {'daily_bin': '',
-                                             'daily_netCDF': '',
-                                             'monthly_bin': '',
-                                             'monthly_netCDF': ''}
-
-                # Query Solr for existing aggregation
-                fq = [f'dataset_s:{dataset_name}', 'type_s:aggregation',
-                      f'grid_name_s:{grid_name}', f'field_s:{field_name}', f'year_s:{year}']
-                docs = solr_utils.solr_query(fq)
-
-                # If aggregation exists, update using Solr entry id
-                if len(docs) > 0:
-                    doc_id = docs[0]['id']
-                    update_body = [
-                        {
-                            "id": doc_id,
-                            "aggregation_time_dt": {"set": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")},
-                            "aggregation_version_s": {"set": aggregation_version}
-                        }
-                    ]
-
-                    # Update file paths according to the data time scale and do monthly aggregation config field
-                    if (data_time_scale == 'daily') and (config['do_monthly_aggregation']):
-                        update_body[0]["aggregated_daily_bin_path_s"] = {
-                            "set": solr_output_filepaths['daily_bin']}
-                        update_body[0]["aggregated_daily_netCDF_path_s"] = {
-                            "set": solr_output_filepaths['daily_netCDF']}
-                        update_body[0]["aggregated_monthly_bin_path_s"] = {
-                            "set": solr_output_filepaths['monthly_bin']}
-                        update_body[0]["aggregated_monthly_netCDF_path_s"] = {
-                            "set": solr_output_filepaths['monthly_netCDF']}
-                        update_body[0]["daily_aggregated_uuid_s"] = {
-                            "set": uuids[0]}
-                        update_body[0]["monthly_aggregated_uuid_s"] = {
-                            "set": uuids[1]}
-                    elif (data_time_scale == 'daily') and not (config['do_monthly_aggregation']):
-                        update_body[0]["aggregated_daily_bin_path_s"] = {
-                            "set": solr_output_filepaths['daily_bin']}
-                        update_body[0]["aggregated_daily_netCDF_path_s"] = {
-                            "set": solr_output_filepaths['daily_netCDF']}
-                        update_body[0]["daily_aggregated_uuid_s"] = {
-                            "set": uuids[0]}
-                    elif data_time_scale == 'monthly':
-                        update_body[0]["aggregated_monthly_bin_path_s"] = {
-                            "set": solr_output_filepaths['monthly_bin']}
-                        update_body[0]["aggregated_monthly_netCDF_path_s"] = {
-                            "set": solr_output_filepaths['monthly_netCDF']}
-                        update_body[0]["monthly_aggregated_uuid_s"] = {
-                            "set": uuids[1]}
-
-                    if empty_year:
-                        update_body[0]["notes_s"] = {
-                            "set": 'Empty year (no data present in grid), not saving to disk.'}
-                    else:
-                        update_body[0]["notes_s"] = {"set": ''}
-
-                else:
-                    # Create new aggregation entry if it doesn't exist
-                    update_body = [
-                        {
-                            "type_s": 'aggregation',
-                            "dataset_s": dataset_name,
-                            "year_s": year,
-                            "grid_name_s": grid_name,
-                            "field_s": field_name,
-                            "aggregation_time_dt": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
-                            "aggregation_success_b": success,
-                            "aggregation_version_s": aggregation_version
-                        }
-                    ]
-
-                    # Update file paths according to the data time scale and do monthly aggregation config field
-                    if (data_time_scale == 'daily') and (config['do_monthly_aggregation']):
-                        update_body[0]["aggregated_daily_bin_path_s"] = {
-                            "set": solr_output_filepaths['daily_bin']}
-                        update_body[0]["aggregated_daily_netCDF_path_s"] = {
-                            "set": solr_output_filepaths['daily_netCDF']}
-                        update_body[0]["aggregated_monthly_bin_path_s"] = {
-                            "set": solr_output_filepaths['monthly_bin']}
-                        update_body[0]["aggregated_monthly_netCDF_path_s"] = {
-                            "set": solr_output_filepaths['monthly_netCDF']}
-                        update_body[0]["daily_aggregated_uuid_s"] = {
-                            "set": uuids[0]}
-                        update_body[0]["monthly_aggregated_uuid_s"] = {
-                            "set": uuids[1]}
-                    elif (data_time_scale == 'daily') and (not config['do_monthly_aggregation']):
-                        update_body[0]["aggregated_daily_bin_path_s"] = {
-                            "set": solr_output_filepaths['daily_bin']}
-                        update_body[0]["aggregated_daily_netCDF_path_s"] = {
-                            "set": solr_output_filepaths['daily_netCDF']}
-                        update_body[0]["daily_aggregated_uuid_s"] = {
-                            "set": uuids[0]}
-                    elif data_time_scale == 'monthly':
-                        update_body[0]["aggregated_monthly_bin_path_s"] = {
-                            "set": solr_output_filepaths['monthly_bin']}
-                        update_body[0]["aggregated_monthly_netCDF_path_s"] = {
-                            "set": solr_output_filepaths['monthly_netCDF']}
-                        update_body[0]["monthly_aggregated_uuid_s"] = {
-                            "set": uuids[1]}
-
-                    if empty_year:
-                        update_body[0]["notes_s"] = {
-                            "set": 'Empty year (no data present in grid), not saving to disk.'}
-                    else:
-                        update_body[0]["notes_s"] = {"set": ''}
-
-                r = solr_utils.solr_update(update_body, r=True)
-
-                if r.status_code != 200:
-                    print(
-                        f'Failed to update Solr aggregation entry for {field_name} in {dataset_name} for {year} and grid {grid_name}')
-
-                # Query for descendants entries from this year
-                fq = ['type_s:descendants',
-                      f'dataset_s:{dataset_name}', f'date_s:{year}*']
-                existing_descendants_docs = solr_utils.solr_query(fq)
-
-                # if descendants entries already exist, update them
-                if len(existing_descendants_docs) > 0:
-                    for doc in existing_descendants_docs:
-                        doc_id = doc['id']
-
-                        update_body = [
-                            {
-                                "id": doc_id,
-                                "all_aggregation_success_b": {"set": aggregation_successes}
-                            }
-                        ]
-
-                        # Add aggregation file path fields to descendants entry
-                        for key, value in solr_output_filepaths.items():
-                            update_body[0][f'{grid_name}_{field_name}_aggregated_{key}_path_s'] = {
-                                "set": value}
-
-                        r = solr_utils.solr_update(update_body, r=True)
-
-                        if r.status_code != 200:
-                            print(
-                                f'Failed to update Solr aggregation entry for {field_name} in {dataset_name} for {year} and grid {grid_name}')
-
-                fq = [f'dataset_s:{dataset_name}', 'type_s:aggregation',
-                      f'grid_name_s:{grid_name}', f'field_s:{field_name}', f'year_s:{year}']
-                docs = solr_utils.solr_query(fq)
-
-                # Export annual descendants JSON file for each aggregation created
-                print(
-                    f' - Exporting {year} descendants for grid {grid_name} and field {field_name}')
-                json_output['aggregation'] = docs
-                json_output['transformations'] = transformations
-                json_output_path = f'{output_dir}/{dataset_name}/transformed_products/{grid_name}/aggregated/{field_name}/{dataset_name}_{field_name}_{grid_name}_{year}_descendants'
-                with open(json_output_path, 'w') as f:
-                    resp_out = json.dumps(json_output, indent=4)
-                    f.write(resp_out)
+                    if existing_aggregation and \
+                            any(doc['transformation_completed_dt'] > existing_aggregation['aggregation_time_dt']
+                                for doc in docs):
+                        changed_indices.append(len(year_records))
+
+                    year_records.append(
+                        (date, [doc['transformation_file_path_s'] for doc in docs]))
+
+                transformations_by_unit[(grid_name, field_name, year)] = transformations
+
+                # Days whose transformations were removed can't be found from
+                # the remaining ones, so the year is rebuilt
+                transformation_count = count_year_transformations(year_transformations,
+                                                                  field_name, year)
+                rebuild = existing_aggregation is not None and \
+                    transformations_removed(existing_aggregation, transformation_count)
+
+                units.append({'grid_name': grid_name,
+                              'grid_path': grid_path,
+                              'grid_type': grid_type,
+                              'field': field,
+                              'year': year,
+                              'data_time_scale': data_time_scale,
+                              'aggregate_all_years': aggregate_all_years,
+                              'existing_aggregation': existing_aggregation is not None,
+                              'rebuild': rebuild,
+                              'transformation_count': transformation_count,
+                              'year_records': year_records,
+                              'changed_indices': changed_indices})
+
+    # =====================================================
+    # Aggregate units
+    # =====================================================
+    if multiprocessing and user_cpus > 1 and len(units) > 1:
+        processes = min(user_cpus, len(units))
+        print(f'Aggregating {len(units)} units with {processes} processes')
+
+        with Pool(processes=processes, initializer=init_worker,
+                  initargs=(config, output_dir)) as pool:
+            results = list(pool.imap_unordered(aggregate_unit, units))
+    else:
+        init_worker(config, output_dir)
+        results = [aggregate_unit(unit) for unit in units]
+
+    aggregation_successes = all(result['success'] for result in results)
+
+    # =====================================================
+    # Update Solr aggregation and descendants entries
+    # =====================================================
+    descendants_updates = {}
+
+    with solr_utils.SolrWriter() as writer:
+        for result in results:
+            grid_name = result['grid_name']
+            field_name = result['field_name']
+            year = result['year']
+
+            writer.add(make_aggregation_update(result,
+                                               existing_aggregations.get(
+                                                   (grid_name, field_name, year)),
+                                               config, data_time_scale, aggregation_time))
+
+            # if descendants entries already exist, update them
+            # Add aggregation file path fields to descendants entry
+            for doc_id in descendants_ids_by_year[year]:
+                update = descendants_updates.setdefault(
+                    doc_id, {"id": doc_id, "all_aggregation_success_b": {"set": aggregation_successes}})
+
+                for key, value in result['filepaths'].items():
+                    update[f'{grid_name}_{field_name}_aggregated_{key}_path_s'] = {
+                        "set": value}
+
+        for update in descendants_updates.values():
+            writer.add(update)
+
+    if writer.failures:
+        print(
+            f'Failed to update Solr aggregation and descendants entries for {dataset_name}')
+
+    # Export annual descendants JSON file for each aggregation created
+    if results:
+        fq = [f'dataset_s:{dataset_name}', 'type_s:aggregation']
+        aggregation_docs = defaultdict(list)
+        for doc in solr_utils.solr_query_iter(fq, solr_utils.AGGREGATION_FL):
+            aggregation_docs[(doc['grid_name_s'], doc['field_s'], doc['year_s'])].append(doc)
+
+    for result in results:
+        grid_name = result['grid_name']
+        field_name = result['field_name']
+        year = result['year']
+
+        print(
+            f' - Exporting {year} descendants for grid {grid_name} and field {field_name}')
+        json_output = {}
+        json_output['dataset'] = dataset_metadata
+        json_output['aggregation'] = aggregation_docs[(grid_name, field_name, year)]
+        json_output['transformations'] = transformations_by_unit[(grid_name, field_name, year)]
+        json_output_path = f'{output_dir}/{dataset_name}/transformed_products/{grid_name}/aggregated/{field_name}/{dataset_name}_{field_name}_{grid_name}_{year}_descendants'
+        with open(json_output_path, 'w') as f:
+            resp_out = json.dumps(json_output, indent=4)
+            f.write(resp_out)
 
     # Query Solr for successful aggregation documents
     fq = [f'dataset_s:{dataset_name}',
           'type_s:aggregation', 'aggregation_success_b:true']
-    successful_aggregations = solr_utils.solr_query(fq)
+    successful_aggregations = solr_utils.solr_query(fq, 'id')
 
     # Query Solr for failed aggregation documents
     fq = [f'dataset_s:{dataset_name}',
           'type_s:aggregation', 'aggregation_success_b:false']
-    failed_aggregations = solr_utils.solr_query(fq)
+    failed_aggregations = solr_utils.solr_query(fq, 'id')
 
     aggregation_status = 'All aggregations successful'
 
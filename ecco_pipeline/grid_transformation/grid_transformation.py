@@ -1,7 +1,12 @@
+import bz2
+import gzip
+import hashlib
+import json
 import logging
 import logging.config
 import os
 import pickle
+import shutil
 import sys
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -25,6 +30,371 @@ except Exception as e:
     log.exception(e)
 
 
+# Process-local caches, shared by all granules transformed by a process.
+# Model grids are keyed by grid file checksum, so a changed grid is reloaded.
+cache = {'datasets': {}, 'grids': {}, 'model_grids': {}, 'factors': {}}
+
+
+def clear_cache():
+    """
+    Empties the process-local caches of metadata, model grids and factors
+    """
+    for entries in cache.values():
+        entries.clear()
+
+
+def get_dataset_metadata(dataset_name):
+    """
+    Returns the (cached) Solr dataset entry
+    """
+    if dataset_name not in cache['datasets']:
+        fq = [f'dataset_s:{dataset_name}', 'type_s:dataset']
+        cache['datasets'][dataset_name] = solr_utils.solr_query(fq, solr_utils.ALL_FL)[0]
+
+    return cache['datasets'][dataset_name]
+
+
+def get_grid_metadata(grid_name):
+    """
+    Returns the (cached) Solr grid entry
+    """
+    if grid_name not in cache['grids']:
+        fq = ['type_s:grid', f'grid_name_s:{grid_name}']
+        cache['grids'][grid_name] = solr_utils.solr_query(fq, solr_utils.GRID_FL)[0]
+
+    return cache['grids'][grid_name]
+
+
+# Model grid variables used by transformations: coordinates and grid radius
+MODEL_GRID_VARIABLES = ['XC', 'YC', 'effective_grid_radius', 'effective_radius',
+                        'RAD', 'rA']
+
+
+def get_model_grid(grid_metadata):
+    """
+    Returns the (cached) model grid, loaded into memory. Only the variables
+    used by transformations are read: the coordinates, grid radius and the
+    surface level of the wet mask (as maskC), not full 3D grid variables.
+    """
+    key = grid_metadata['grid_checksum_s']
+
+    if key not in cache['model_grids']:
+        with xr.open_dataset(grid_metadata['grid_path_s']) as model_grid:
+            model_grid = model_grid.reset_coords()
+            variables = [var for var in MODEL_GRID_VARIABLES if var in model_grid]
+            subset = model_grid[variables]
+
+            mask = get_surface_wet_mask(model_grid)
+            if mask is not None:
+                subset['maskC'] = mask
+
+            cache['model_grids'][key] = subset.load()
+
+    return cache['model_grids'][key]
+
+
+def get_factors(factors_path):
+    """
+    Returns the (cached) factors as a mapping operator: memory-mapped if
+    saved by save_mapping_operator, or compiled once from legacy pickled
+    factors.
+    """
+    if factors_path not in cache['factors']:
+        if ea.is_mapping_operator_dir(factors_path):
+            factors = ea.load_mapping_operator(factors_path)
+        else:
+            with open(factors_path, 'rb') as f:
+                factors = ea.compile_mapping_factors(pickle.load(f))
+
+        cache['factors'][factors_path] = factors
+
+    return cache['factors'][factors_path]
+
+
+def get_source_grid_definition(config, hemi=''):
+    """
+    Returns the definition of a dataset's source grid (for the given hemisphere,
+    if the data is stored in hemispheres) in a normalized form
+    """
+    data_res = config['data_res']
+
+    # If data_res is fractional, convert from string to float
+    if type(data_res) is str and '/' in data_res:
+        num, den = data_res.replace(' ', '').split('/')
+        data_res = float(num) / float(den)
+
+    # Use hemisphere specific variables if data is hemisphere specific
+    source_grid_definition = {
+        'data_res': float(data_res),
+        'data_max_lat': float(config[f'data_max_lat{hemi}']),
+        'area_extent': [float(x) for x in config[f'area_extent{hemi}']],
+        'dims': [int(x) for x in config[f'dims{hemi}']],
+        'proj_info': dict(config[f'proj_info{hemi}'])
+    }
+
+    return source_grid_definition
+
+
+def get_factors_path(source_grid_definition, grid_metadata, output_dir, neighbours=100,
+                     wet_points_only=False):
+    """
+    Returns the content-addressed path of the mapping factors between a source
+    grid and a model grid. The path is keyed on a hash of the source grid
+    definition, the model grid file checksum and the neighbour search settings,
+    so every dataset on the same source grid uses the same factors.
+    """
+    key_fields = {
+        'source_grid': source_grid_definition,
+        'grid_checksum': grid_metadata['grid_checksum_s'],
+        'neighbours': neighbours,
+        'format_version': ea.mapping.MAPPING_OPERATOR_FORMAT_VERSION
+    }
+
+    # Factors compressed to the wet points of the model grid are kept apart
+    if wet_points_only:
+        key_fields['wet_points_only'] = True
+
+    key = hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+    return f'{output_dir}/mapping_factors/{grid_metadata["grid_name_s"]}_{key}'
+
+
+def get_surface_wet_mask(model_grid):
+    """
+    Returns the (lazy) surface level of a model grid's maskC or hFacC wet
+    mask, or None if the model grid has neither.
+    """
+    if 'maskC' in model_grid:
+        mask = model_grid.maskC
+    elif 'hFacC' in model_grid:
+        mask = model_grid.hFacC > 0
+    else:
+        return None
+
+    # Surface level of 3D masks
+    vertical_dims = [dim for dim in mask.dims if dim not in model_grid.XC.dims]
+    return mask.isel({dim: 0 for dim in vertical_dims}, drop=True)
+
+
+def get_model_grid_wet_mask(model_grid):
+    """
+    Returns a boolean mask of the wet (ocean) points of the surface level of
+    a model grid, from its maskC or hFacC variable. Returns None if the model
+    grid has neither.
+    """
+    mask = get_surface_wet_mask(model_grid)
+    if mask is None:
+        return None
+
+    return mask.transpose(*model_grid.XC.dims).values.astype(bool)
+
+
+def make_factors(source_grid_definition, model_grid, short_name, neighbours=100,
+                 wet_points_only=False):
+    """
+    Computes the mapping factors between a source grid and a model grid.
+    Returns None if the model grid has no grid radius information.
+    With wet_points_only the factors are compressed to the wet points of the
+    model grid, so only ocean cells are regridded (land cells are NaN).
+    """
+    source_grid_min_L, source_grid_max_L, source_grid, \
+        _, _ = ea.generalized_grid_product(short_name,
+                                           source_grid_definition['data_res'],
+                                           source_grid_definition['data_max_lat'],
+                                           source_grid_definition['area_extent'],
+                                           source_grid_definition['dims'],
+                                           source_grid_definition['proj_info'])
+
+    # Define the 'swath' as the lats/lon pairs of the model grid
+    target_grid = pr.geometry.SwathDefinition(lons=model_grid.XC.values.ravel(),
+                                              lats=model_grid.YC.values.ravel())
+
+    # Retrieve target_grid_radius from model_grid file
+    if 'effective_grid_radius' in model_grid:
+        target_grid_radius = model_grid.effective_grid_radius.values.ravel()
+    elif 'effective_radius' in model_grid:
+        target_grid_radius = model_grid.effective_radius.values.ravel()
+    elif 'RAD' in model_grid:
+        target_grid_radius = model_grid.RAD.values.ravel()
+    elif 'rA' in model_grid:
+        target_grid_radius = 0.5*np.sqrt(model_grid.rA.values.ravel())
+    else:
+        return None
+
+    # Compute the mapping between the data and model grid
+    factors = ea.find_mapping_operator_from_source_to_target(source_grid,
+                                                             target_grid,
+                                                             target_grid_radius,
+                                                             source_grid_min_L,
+                                                             source_grid_max_L,
+                                                             neighbours=neighbours)
+
+    if wet_points_only:
+        wet_mask = get_model_grid_wet_mask(model_grid)
+
+        if wet_mask is None:
+            log.warning('Model grid has no maskC or hFacC, '
+                        'using factors for all grid points')
+        else:
+            factors = ea.compress_mapping_operator(factors, wet_mask)
+
+    return factors
+
+
+# Decompressed granule copies are evicted once older than this many days, or,
+# oldest first, once they take up more than this many bytes in total
+DECOMPRESSED_MAX_AGE_DAYS = 30
+DECOMPRESSED_MAX_BYTES = 100 * 1024**3
+
+
+def decompress_granule(source_file_path, checksum, cache_dir):
+    """
+    Returns the path to the decompressed copy of a .bz2 or .gz granule,
+    decompressing it into cache_dir if needed. Each granule has its own
+    directory of copies keyed by the checksum of the compressed granule, so
+    an updated granule replaces its outdated copy.
+    """
+    compressed_name = os.path.basename(source_file_path)
+    open_func = bz2.open if compressed_name.endswith('.bz2') else gzip.open
+    file_name = os.path.splitext(compressed_name)[0]
+
+    # The extension is kept so xarray can tell the file format
+    granule_dir = f'{cache_dir}/{file_name}'
+    decompressed_path = f'{granule_dir}/{checksum}{os.path.splitext(file_name)[1]}'
+
+    if os.path.exists(decompressed_path):
+        # Marks the copy as recently used for eviction
+        os.utime(decompressed_path)
+        return decompressed_path
+
+    os.makedirs(granule_dir, exist_ok=True)
+
+    # Remove copies of older versions of this granule
+    for cached_file in os.listdir(granule_dir):
+        if not cached_file.startswith(checksum) and not cached_file.endswith('.tmp'):
+            os.remove(f'{granule_dir}/{cached_file}')
+
+    # Decompress to a temporary file first so a partial copy is never used
+    tmp_path = f'{decompressed_path}.{os.getpid()}.tmp'
+    with open_func(source_file_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp_path, decompressed_path)
+
+    return decompressed_path
+
+
+def evict_decompressed_granules(cache_dir, max_age_days=DECOMPRESSED_MAX_AGE_DAYS,
+                                max_bytes=DECOMPRESSED_MAX_BYTES):
+    """
+    Removes decompressed granule copies from cache_dir that have not been
+    used for more than max_age_days, then the least recently used copies
+    until the cache takes up at most max_bytes. Returns the number of copies
+    removed.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    now = datetime.now().timestamp()
+    oldest_allowed = now - max_age_days * 24 * 3600
+
+    copies = []
+    for entry in os.scandir(cache_dir):
+        if not entry.is_dir():
+            continue
+        for cached_file in os.scandir(entry.path):
+            stat = cached_file.stat()
+            # Recent temporary files are copies still being written, older
+            # ones were left behind by interrupted runs
+            if cached_file.name.endswith('.tmp') and stat.st_mtime > now - 24 * 3600:
+                continue
+            copies.append((stat.st_mtime, stat.st_size, cached_file.path))
+
+    copies.sort()
+    total_bytes = sum(size for _, size, _ in copies)
+
+    removed = 0
+    for mtime, size, path in copies:
+        if mtime >= oldest_allowed and total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+        removed += 1
+
+        # Remove the granule's directory once it is empty
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+    return removed
+
+
+def open_source_granule(source_file_path, fields, extra_information, checksum, cache_dir):
+    """
+    Lazily opens a source granule, keeping only the variables needed to
+    transform it: the given fields, and the time and time bounds variables
+    used by extra_information. Nothing is read from disk until a variable's
+    values are used. .bz2 and .gz granules are decompressed once into
+    cache_dir and reused.
+    """
+    if source_file_path.endswith(('.bz2', '.gz')):
+        source_file_path = decompress_granule(source_file_path, checksum,
+                                              cache_dir)
+
+    ds = xr.open_dataset(source_file_path, decode_times=True)
+
+    variables_to_keep = {field['name_s'] for field in fields}
+    if 'time_bounds_var' in extra_information:
+        variables_to_keep.update(
+            ['Time_bounds', 'time_bnds', 'time_bounds', 'timebounds'])
+    if 'time_var' in extra_information:
+        variables_to_keep.update(['Time', 'time'])
+
+    return ds.drop_vars([var for var in ds.data_vars if var not in variables_to_keep])
+
+
+def generate_factors(config, grid_metadata, hemi, output_dir, short_name, model_grid=None, verbose=True):
+    """
+    Makes sure the mapping factors between a dataset's source grid (for the
+    given hemisphere) and a model grid exist in the factor cache, computing
+    and saving them if needed. Returns the path to the factors, or None if
+    the model grid is not supported.
+    """
+    # Use print function if verbose is True, otherwise use a no-op
+    verboseprint = print if verbose else lambda *a, **k: None
+
+    grid_name = grid_metadata['grid_name_s']
+
+    wet_points_only = config.get('wet_points_only', False)
+
+    source_grid_definition = get_source_grid_definition(config, hemi)
+    factors_path = get_factors_path(source_grid_definition, grid_metadata,
+                                    output_dir, wet_points_only=wet_points_only)
+
+    if ea.is_mapping_operator_dir(factors_path):
+        return factors_path
+
+    verboseprint(f' - Creating {grid_name}{hemi} factors')
+
+    if model_grid is None:
+        model_grid = xr.open_dataset(
+            grid_metadata['grid_path_s']).reset_coords()
+
+    factors = make_factors(source_grid_definition, model_grid, short_name,
+                           wet_points_only=wet_points_only)
+
+    if factors is None:
+        return None
+
+    verboseprint(f' - Saving {grid_name}{hemi} factors')
+    ea.save_mapping_operator(factors, factors_path)
+
+    return factors_path
+
+
 def transformation(source_file_path, remaining_transformations, output_dir, config, verbose=True):
     """
     Performs and saves locally all remaining transformations for a given source granule
@@ -57,14 +427,12 @@ def transformation(source_file_path, remaining_transformations, output_dir, conf
     dataset_name = config['ds_name']
     transformation_version = config['t_version']
 
-    # Query Solr for dataset entry
-    fq = [f'dataset_s:{dataset_name}', 'type_s:dataset']
-    dataset_metadata = solr_utils.solr_query(fq)[0]
+    dataset_metadata = get_dataset_metadata(dataset_name)
 
     # Query Solr for harvested entry to get origin_checksum and date
     query_fq = [f'dataset_s:{dataset_name}', 'type_s:granule',
                 f'pre_transformation_file_path_s:"{source_file_path}"']
-    harvested_metadata = solr_utils.solr_query(query_fq)[0]
+    harvested_metadata = solr_utils.solr_query(query_fq, 'checksum_s,date_s,hemisphere_s')[0]
     origin_checksum = harvested_metadata['checksum_s']
     date = harvested_metadata['date_s']
 
@@ -76,9 +444,18 @@ def transformation(source_file_path, remaining_transformations, output_dir, conf
     else:
         hemi = ''
 
+    # Query Solr for existing transformation entries for this granule
+    query_fq = [f'dataset_s:{dataset_name}', 'type_s:transformation',
+                f'pre_transformation_file_path_s:"{source_file_path}"']
+    existing_transformations = {(doc['grid_name_s'], doc['field_s']): doc['id']
+                                for doc in solr_utils.solr_query(query_fq, fl='id,grid_name_s,field_s')}
+
     transformation_successes = True
     transformation_file_paths = {}
 
+    # Solr updates made once transformations are saved, sent together at the end
+    final_updates = []
+
     grids_updated = []
 
     # =====================================================
@@ -86,25 +463,25 @@ def transformation(source_file_path, remaining_transformations, output_dir, conf
     # =====================================================
     verboseprint(f'\n====== Loading {file_name} data =======\n')
 
-    ds = xr.open_dataset(source_file_path, decode_times=True)
+    # Only the fields being transformed (for any grid) are read
+    fields_to_read = [field for fields in remaining_transformations.values()
+                      for field in fields]
+    ds = open_source_granule(source_file_path, fields_to_read, config['extra_information'], origin_checksum,
+                             f'{output_dir}/{dataset_name}/decompressed_granules')
     ds.attrs['original_file_name'] = file_name
 
     # Iterate through grids in remaining_transformations
     for grid_name in remaining_transformations.keys():
         fields = remaining_transformations[grid_name]
 
-        # Query Solr for grid metadata
-        fq = ['type_s:grid', f'grid_name_s:{grid_name}']
-        grid_metadata = solr_utils.solr_query(fq)[0]
-
-        grid_path = grid_metadata['grid_path_s']
+        grid_metadata = get_grid_metadata(grid_name)
         grid_type = grid_metadata['grid_type_s']
 
         # =====================================================
         # Load grid
         # =====================================================
         verboseprint(f' - Loading {grid_name} model grid')
-        model_grid = xr.open_dataset(grid_path).reset_coords()
+        model_grid = get_model_grid(grid_metadata)
 
         # =====================================================
         # Make model grid factors if not present locally
@@ -112,106 +489,27 @@ def transformation(source_file_path, remaining_transformations, output_dir, conf
         grid_factors = f'{grid_name}{hemi}_factors_path_s'
         grid_factors_version = f'{grid_name}{hemi}_factors_version_f'
 
-        # check to see if there is 'grid_factors_version' key in the
-        # dataset and whether the transformation version matches with the
-        # current version
-        if grid_factors_version in dataset_metadata.keys() and \
-                transformation_version == dataset_metadata[grid_factors_version]:
+        # Factors are shared by all datasets on the same source grid, and
+        # are only rebuilt when the source grid or the model grid changes
+        factors_path = generate_factors(config, grid_metadata, hemi, output_dir,
+                                        dataset_metadata['short_name_s'],
+                                        model_grid=model_grid, verbose=verbose)
 
-            factors_path = dataset_metadata[grid_factors]
+        if factors_path is None:
+            print(f'ERROR - {grid_name} grid not supported')
+            continue
 
-            verboseprint(f' - Loading {grid_name} factors')
-            with open(factors_path, "rb") as f:
-                factors = pickle.load(f)
-
-        else:
-            verboseprint(f' - Creating {grid_name} factors')
-
-            fq = [f'dataset_s:{dataset_name}', 'type_s:dataset']
-            short_name = dataset_metadata['short_name_s']
-
-            data_res = config['data_res']
-
-            # If data_res is fractional, convert from string to float
-            if type(data_res) is str and '/' in data_res:
-                num, den = data_res.replace(' ', '').split('/')
-                data_res = float(num) / float(den)
-
-            # Use hemisphere specific variables if data is hemisphere specific
-            if hemi:
-                hemi_dim = config[f'dims{hemi}']
-                hemi_area_extent = config[f'area_extent{hemi}']
-                hemi_proj_info = config[f'proj_info{hemi}']
-                hemi_data_max_lat = config[f'data_max_lat{hemi}']
-
-                source_grid_min_L, source_grid_max_L, source_grid, \
-                    data_grid_lons, data_grid_lats = ea.generalized_grid_product(short_name,
-                                                                                 data_res,
-                                                                                 hemi_data_max_lat,
-                                                                                 hemi_area_extent,
-                                                                                 hemi_dim,
-                                                                                 hemi_proj_info)
-            else:
-                source_grid_min_L, source_grid_max_L, source_grid, \
-                    data_grid_lons, data_grid_lats = ea.generalized_grid_product(short_name,
-                                                                                 data_res,
-                                                                                 config['data_max_lat'],
-                                                                                 config['area_extent'],
-                                                                                 config['dims'],
-                                                                                 config['proj_info'])
-
-            # Define the 'swath' as the lats/lon pairs of the model grid
-            target_grid = pr.geometry.SwathDefinition(lons=model_grid.XC.values.ravel(),
-                                                      lats=model_grid.YC.values.ravel())
-
-            # Retrieve target_grid_radius from model_grid file
-            if 'effective_grid_radius' in model_grid:
-                target_grid_radius = model_grid.effective_grid_radius.values.ravel()
-            elif 'effective_radius' in model_grid:
-                target_grid_radius = model_grid.effective_radius.values.ravel()
-            elif 'RAD' in model_grid:
-                target_grid_radius = model_grid.RAD.values.ravel()
-            elif 'rA' in model_grid:
-                target_grid_radius = 0.5*np.sqrt(model_grid.rA.values.ravel())
-            else:
-                print(f'ERROR - {grid_name} grid not supported')
-                continue
-
-            # Compute the mapping between the data and model grid
-            source_indices_within_target_radius_i,\
-                num_source_indices_within_target_radius_i,\
-                nearest_source_index_to_target_index_i = \
-                ea.find_mappings_from_source_to_target(source_grid,
-                                                       target_grid,
-                                                       target_grid_radius,
-                                                       source_grid_min_L,
-                                                       source_grid_max_L)
-
-            factors = (source_indices_within_target_radius_i,
-                       num_source_indices_within_target_radius_i,
-                       nearest_source_index_to_target_index_i)
-
-            verboseprint(f' - Saving {grid_name} factors')
-            factors_path = f'{output_dir}/{dataset_name}/transformed_products/{grid_name}/'
-
-            # Create directory if needed and save factors
-            if not os.path.exists(factors_path):
-                os.makedirs(factors_path)
-
-            factors_path += f'{grid_name}{hemi}_factors'
-
-            with open(factors_path, 'wb') as f:
-                pickle.dump(factors, f)
+        # Memory-mapped, so all processes share one copy
+        factors = get_factors(factors_path)
 
+        # Record the factors used by this dataset in its Solr entry
+        if dataset_metadata.get(grid_factors) != factors_path:
             verboseprint(' - Updating Solr with factors')
-            # Query Solr for dataset entry
-            query_fq = [f'dataset_s:{dataset_name}', 'type_s:dataset']
-            dataset_metadata_id = solr_utils.solr_query(query_fq)[0]['id']
 
             # Update Solr dataset entry with factors metadata
             update_body = [
                 {
-                    "id": dataset_metadata_id,
+                    "id": dataset_metadata['id'],
                     f'{grid_factors}': {"set": factors_path},
                     f'{grid_name}{hemi}_factors_stored_dt': {"set": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")},
                     f'{grid_factors_version}': {"set": transformation_version}
@@ -221,6 +519,7 @@ def transformation(source_file_path, remaining_transformations, output_dir, conf
             r = solr_utils.solr_update(update_body, r=True)
 
             if r.status_code == 200:
+                dataset_metadata[grid_factors] = factors_path
                 verboseprint(
                     '    - Successfully updated Solr with factors information')
             else:
@@ -232,23 +531,17 @@ def transformation(source_file_path, remaining_transformations, output_dir, conf
         # Iterate through remaining transformation fields
         for field in fields:
             field_name = field["name_s"]
-
-            # Query if grid/field combination transformation entry exists
-            query_fq = [f'dataset_s:{dataset_name}', 'type_s:transformation', f'grid_name_s:{grid_name}',
-                        f'field_s:{field_name}', f'pre_transformation_file_path_s:"{source_file_path}"']
-            docs = solr_utils.solr_query(query_fq)
-            update_body = []
             transform = {}
 
             # If grid/field combination transformation exists, update transformation status
             # Otherwise initialize new transformation entry
-            if len(docs) > 0:
+            if (grid_name, field_name) in existing_transformations:
                 # Reset status fields
-                transform['id'] = docs[0]['id']
+                transform['id'] = existing_transformations[(
+                    grid_name, field_name)]
                 transform['transformation_in_progress_b'] = {"set": True}
                 transform['success_b'] = {"set": False}
                 update_body.append(transform)
-                r = solr_utils.solr_update(update_body, r=True)
             else:
                 # Initialize new transformation entry
                 transform['type_s'] = 'transformation'
@@ -266,11 +559,21 @@ def transformation(source_file_path, remaining_transformations, output_dir, conf
                 transform['transformation_in_progress_b'] = True
                 transform['success_b'] = False
                 update_body.append(transform)
-                r = solr_utils.solr_update(update_body, r=True)
 
-            if r.status_code != 200:
-                verboseprint(
-                    f'Failed to update Solr transformation status for {dataset_name} on {date}')
+        # Update transformation status for all fields at once
+        r = solr_utils.solr_update(update_body, r=True)
+
+        if r.status_code != 200:
+            verboseprint(
+                f'Failed to update Solr transformation status for {dataset_name} on {date}')
+
+        # Query Solr for the ids of newly created transformation entries
+        if any((grid_name, field['name_s']) not in existing_transformations for field in fields):
+            query_fq = [f'dataset_s:{dataset_name}', 'type_s:transformation', f'grid_name_s:{grid_name}',
+                        f'pre_transformation_file_path_s:"{source_file_path}"']
+            for doc in solr_utils.solr_query(query_fq, fl='id,grid_name_s,field_s'):
+                existing_transformations[(
+                    doc['grid_name_s'], doc['field_s'])] = doc['id']
 
         # =====================================================
         # Run transformation
@@ -335,23 +638,21 @@ def transformation(source_file_path, remaining_transformations, output_dir, conf
 
             Path(output_path).mkdir(parents=True, exist_ok=True)
 
-            # save field_DS
-            ea.save_to_disk(field_DS, output_filename[:-3], fill_values['binary'],
-                            fill_values['netcdf'], Path(output_path),
-                            Path(output_path), binary_dtype, grid_type, save_binary=False)
-
-            # Query Solr for transformation entry
-            query_fq = [f'dataset_s:{dataset_name}', 'type_s:transformation', f'grid_name_s:{grid_name}',
-                        f'field_s:{field_name}', f'pre_transformation_file_path_s:"{source_file_path}"']
+            # save field_DS, hashing the file as it is written
+            output_checksums = ea.save_to_disk(field_DS, output_filename[:-3], fill_values['binary'],
+                                               fill_values['netcdf'], Path(output_path),
+                                               Path(output_path), binary_dtype, grid_type,
+                                               save_binary=False, checksum_algorithm='md5')
+            transformation_checksum = output_checksums['netcdf']
+            file_utils.cache_checksum(transformed_location, transformation_checksum)
 
-            docs = solr_utils.solr_query(query_fq)
-            doc_id = solr_utils.solr_query(query_fq)[0]['id']
+            doc_id = existing_transformations[(grid_name, field_name)]
 
             transformation_successes = transformation_successes and success
             transformation_file_paths[f'{grid_name}_{field_name}_transformation_file_path_s'] = transformed_location
 
             # Update Solr transformation entry with file paths and status
-            update_body = [
+            final_updates.append(
                 {
                     "id": doc_id,
                     "filename_s": {"set": output_filename},
@@ -359,16 +660,10 @@ def transformation(source_file_path, remaining_transformations, output_dir, conf
                     "transformation_completed_dt": {"set": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")},
                     "transformation_in_progress_b": {"set": False},
                     "success_b": {"set": success},
-                    "transformation_checksum_s": {"set": file_utils.md5(transformed_location)},
+                    "transformation_checksum_s": {"set": transformation_checksum},
                     "transformation_version_f": {"set": transformation_version}
                 }
-            ]
-
-            r = solr_utils.solr_update(update_body, r=True)
-
-            if r.status_code != 200:
-                verboseprint(
-                    f'Failed to update Solr transformation entry for {field["name_s"]} in {dataset_name} on {date}')
+            )
 
             if success and grid_name not in grids_updated:
                 grids_updated.append(grid_name)
@@ -377,32 +672,38 @@ def transformation(source_file_path, remaining_transformations, output_dir, conf
         print(
             f' - CPU id {os.getpid()} saving {file_name} output file for grid {grid_name}')
 
+    ds.close()
+
     # Query Solr for descendants entry by date
     query_fq = [f'dataset_s:{dataset_name}',
                 'type_s:descendants', f'date_s:{date[:10]}*']
     if hemi:
         query_fq.append(f'hemisphere_s:{hemi[1:]}')
 
-    docs = solr_utils.solr_query(query_fq)
-    doc_id = solr_utils.solr_query(query_fq)[0]['id']
+    doc_id = solr_utils.solr_query(query_fq, fl='id')[0]['id']
 
     # Update descendants entry in Solr
-    update_body = [
-        {
-            "id": doc_id,
-            "all_transformations_success_b": {"set": transformation_successes}
-        }
-    ]
+    descendants_update = {
+        "id": doc_id,
+        "all_transformations_success_b": {"set": transformation_successes}
+    }
 
     # Add transformaiton file path fields to descendants entry
     for key, path in transformation_file_paths.items():
-        update_body[0][key] = {"set": path}
+        descendants_update[key] = {"set": path}
 
-    r = solr_utils.solr_update(update_body, r=True)
+    final_updates.append(descendants_update)
 
-    if r.status_code != 200:
-        verboseprint(
-            f'Failed to update Solr with descendants information for {dataset_name} on {date}')
+    # Send transformation and descendants updates in one batch. They are
+    # committed by Solr within COMMIT_WITHIN ms, or by the commit at the end
+    # of the transformation stage, whichever comes first.
+    with solr_utils.SolrWriter(commit_within=solr_utils.COMMIT_WITHIN, verbose=verbose) as writer:
+        for update in final_updates:
+            writer.add(update)
+
+    if writer.failures:
+        print(
+            f'Failed to update Solr transformation entries for {dataset_name} on {date}')
 
     return grids_updated, date[:4]
 
@@ -444,10 +745,24 @@ def run_in_any_env(model_grid, grid_name, grid_type, fields, factors, ds, record
                 log.exception(f'Pre-transformation {func_to_run} failed: {e}')
                 return []
 
+    # =====================================================
+    # Transform all fields in one pass
+    # =====================================================
+    # Falls back to transforming one field at a time if this fails, so one
+    # bad field does not fail the others
+    try:
+        transformed_DAs = ea.generalized_transform_fields_to_model_grid_solr(fields, record_date, model_grid, grid_type,
+                                                                             array_precision, record_file_name, data_time_scale,
+                                                                             extra_information, ds, factors, time_zone_included_with_time,
+                                                                             grid_name)
+    except Exception as e:
+        log.exception(f'Transformation of all fields failed: {e}')
+        transformed_DAs = [None] * len(fields)
+
     # =====================================================
     # Loop through fields to transform
     # =====================================================
-    for data_field_info in fields:
+    for data_field_info, field_DA in zip(fields, transformed_DAs):
         field_name = data_field_info['name_s']
         standard_name = data_field_info['standard_name_s']
         long_name = data_field_info['long_name_s']
@@ -457,10 +772,11 @@ def run_in_any_env(model_grid, grid_name, grid_type, fields, factors, ds, record
             f'    - Transforming {record_file_name} for field {field_name}')
 
         try:
-            field_DA = ea.generalized_transform_to_model_grid_solr(data_field_info, record_date, model_grid, grid_type,
-                                                                   array_precision, record_file_name, data_time_scale,
-                                                                   extra_information, ds, factors, time_zone_included_with_time,
-                                                                   grid_name)
+            if field_DA is None:
+                field_DA = ea.generalized_transform_to_model_grid_solr(data_field_info, record_date, model_grid, grid_type,
+                                                                       array_precision, record_file_name, data_time_scale,
+                                                                       extra_information, ds, factors, time_zone_included_with_time,
+                                                                       grid_name)
             success = True
 
             # =====================================================
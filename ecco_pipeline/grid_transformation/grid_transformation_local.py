@@ -2,104 +2,121 @@ import itertools
 import logging
 import logging.config
 import os
+import time
 from collections import defaultdict
-from multiprocessing import Pool
-
-import requests
+from multiprocessing import Pool, TimeoutError
 
 from utils import solr_utils
-from conf.global_settings import SOLR_HOST, SOLR_COLLECTION
-from grid_transformation.grid_transformation import transformation
+from grid_transformation.grid_transformation import (DECOMPRESSED_MAX_AGE_DAYS,
+                                                      DECOMPRESSED_MAX_BYTES,
+                                                      clear_cache, ea,
+                                                      evict_decompressed_granules,
+                                                      generate_factors,
+                                                      get_factors_path,
+                                                      get_source_grid_definition,
+                                                      transformation)
 
 logging.config.fileConfig('logs/log.ini', disable_existing_loggers=False)
 log = logging.getLogger(__name__)
 
+# Fields of transformation docs needed to find remaining transformations
+EXISTING_TRANSFORMATION_FL = ('pre_transformation_file_path_s,grid_name_s,field_s,'
+                              'transformation_version_f,origin_checksum_s')
+
 
-def get_remaining_transformations(config, granule_file_path, grids):
+def find_remaining_transformations(config, granule, grids, fields, existing_transformations):
     """
-    Given a single granule, the function uses Solr to find all combinations of
-    grids and fields that have yet to be transformed. It returns a dictionary
-    where the keys are grids and the values are lists of fields.
+    Given a single granule, the function uses already queried field and
+    transformation entries to find all combinations of grids and fields that
+    have yet to be transformed. existing_transformations is a dictionary where
+    the keys are (pre transformation file path, grid, field) tuples and the
+    values are transformation entries. It returns a dictionary where the keys
+    are grids and the values are lists of fields.
     """
-    dataset_name = config['ds_name']
+    granule_file_path = granule['pre_transformation_file_path_s']
+    harvested_checksum = granule.get('checksum_s', '')
 
-    # Query for fields
-    fq = ['type_s:field', f'dataset_s:{dataset_name}']
-    docs = solr_utils.solr_query(fq)
-    fields = [field_entry for field_entry in docs]
+    # Build dictionary of remaining transformations
+    # -- grid_field_dict has grid key, entries is list of fields
+    grid_field_dict = defaultdict(list)
 
     # Cartesian product of grid/field combinations
-    grid_field_combinations = list(itertools.product(grids, fields))
-
-    # Query for existing transformations
-    fq = [f'dataset_s:{dataset_name}', 'type_s:transformation',
-          f'pre_transformation_file_path_s:"{granule_file_path}"']
-    docs = solr_utils.solr_query(fq)
+    for grid, field in itertools.product(grids, fields):
+        transformation = existing_transformations.get(
+            (granule_file_path, grid, field['name_s']))
+
+        # if a transformation entry exists for this granule, check to see if the
+        # checksum of the harvested granule matches the checksum recorded in the
+        # transformation entry for this granule, if not then we have to retransform
+        # also check to see if the version of the transformation code recorded in
+        # the entry matches the current version of the transformation code, if not
+        # redo the transformation.
+
+        # Triple if:
+        # 1. do we have a version entry,
+        # 2. compare transformation version number and current transformation version number
+        # 3. compare checksum of harvested file (currently in solr) and checksum
+        #    of the harvested file that was previously transformed (recorded in transformation entry)
+        if transformation and \
+                'transformation_version_f' in transformation.keys() and \
+                transformation['transformation_version_f'] == config['t_version'] and \
+                transformation.get('origin_checksum_s') == harvested_checksum:
+
+            # all tests passed, we do not need to redo the transformation
+            # for this grid/field pair
+            continue
 
-    # if a transformation entry exists for this granule, check to see if the
-    # checksum of the harvested granule matches the checksum recorded in the
-    # transformation entry for this granule, if not then we have to retransform
-    # also check to see if the version of the transformation code recorded in
-    # the entry matches the current version of the transformation code, if not
-    # redo the transformation.
-
-    # these checks are made for each grid/field pair associated with the
-    # harvested granule)
-
-    if len(docs) > 0:
-
-        # Dictionary where key is grid, field tuple and value is harvested granule checksum
-        # For existing transformations pulled from Solr
-        existing_transformations = {
-            (doc['grid_name_s'], doc['field_s']): doc['origin_checksum_s'] for doc in docs}
+        grid_field_dict[grid].append(field)
 
-        drop_list = []
+    return dict(grid_field_dict)
 
-        for (grid, field) in grid_field_combinations:
-            field_name = field['name_s']
 
-            # If transformation exists, must compare checksums and versions for updates
-            if (grid, field_name) in existing_transformations:
+def index_transformations(docs):
+    """
+    Indexes transformation entries by (pre transformation file path, grid, field).
+    """
+    return {(doc['pre_transformation_file_path_s'], doc['grid_name_s'], doc['field_s']): doc
+            for doc in docs}
 
-                # Query for harvested granule checksum
-                fq = [f'dataset_s:{dataset_name}', 'type_s:granule',
-                      f'pre_transformation_file_path_s:"{granule_file_path}"']
-                harvested_checksum = solr_utils.solr_query(fq)[0]['checksum_s']
 
-                origin_checksum = existing_transformations[(grid, field_name)]
+def plan_transformations(config, granules, grids):
+    """
+    Finds the remaining transformations for every granule of a dataset at once.
+    Fields and existing transformations are pulled from Solr in one query each
+    and matched in memory, instead of querying Solr for every granule. It
+    returns a dictionary where the keys are pre transformation file paths and
+    the values are dictionaries where the keys are grids and the values are
+    lists of the fields left to transform to that grid. Granules with nothing
+    left to transform are left out.
+    """
+    dataset_name = config['ds_name']
 
-                # Query for existing transformation
-                fq = [f'dataset_s:{dataset_name}', 'type_s:transformation',
-                      f'pre_transformation_file_path_s:"{granule_file_path}"']
-                transformation = solr_utils.solr_query(fq)[0]
+    # Query for fields
+    fq = ['type_s:field', f'dataset_s:{dataset_name}']
+    fields = solr_utils.solr_query(fq, solr_utils.FIELD_FL)
 
-                # Triple if:
-                # 1. do we have a version entry,
-                # 2. compare transformation version number and current transformation version number
-                # 3. compare checksum of harvested file (currently in solr) and checksum
-                #    of the harvested file that was previously transformed (recorded in transformation entry)
-                if 'transformation_version_f' in transformation.keys() and \
-                        transformation['transformation_version_f'] == config['t_version'] and \
-                        origin_checksum == harvested_checksum:
+    # Query for all existing transformations for this dataset, fetching
+    # only the fields needed to compare them
+    fq = [f'dataset_s:{dataset_name}', 'type_s:transformation']
+    existing_transformations = index_transformations(
+        solr_utils.solr_query_iter(fq, EXISTING_TRANSFORMATION_FL))
 
-                    # all tests passed, we do not need to redo the transformation
-                    # for this grid/field pair
+    plan = {}
 
-                    # Add grid/field combination to drop_list
-                    drop_list.append((grid, field))
+    for granule in granules:
+        f = granule.get('pre_transformation_file_path_s', '')
 
-        # Remove drop_list grid/field combinations from list of remaining transformations
-        grid_field_combinations = [
-            combo for combo in grid_field_combinations if combo not in drop_list]
+        # Skips granules that weren't harvested properly
+        if f == '':
+            continue
 
-    # Build dictionary of remaining transformations
-    # -- grid_field_dict has grid key, entries is list of fields
-    grid_field_dict = defaultdict(list)
+        remaining_transformations = find_remaining_transformations(config, granule, grids, fields,
+                                                                   existing_transformations)
 
-    for grid, field in grid_field_combinations:
-        grid_field_dict[grid].append(field)
+        if remaining_transformations:
+            plan[f] = remaining_transformations
 
-    return dict(grid_field_dict)
+    return plan
 
 
 def delete_mismatch_transformations(config):
@@ -114,61 +131,99 @@ def delete_mismatch_transformations(config):
 
     # Query for existing transformations
     fq = [f'dataset_s:{dataset_name}', 'type_s:transformation']
-    transformations = solr_utils.solr_query(fq)
+    fl = 'id,transformation_version_f,transformation_file_path_s'
+    transformations = solr_utils.solr_query(fq, fl)
 
-    for transformation in transformations:
-        if transformation['transformation_version_f'] != config_version:
-            # Remove file from disk
-            if os.path.exists(transformation['transformation_file_path_s']):
-                os.remove(transformation['transformation_file_path_s'])
+    with solr_utils.SolrWriter() as writer:
+        for transformation in transformations:
+            if transformation['transformation_version_f'] != config_version:
+                # Remove file from disk
+                if os.path.exists(transformation['transformation_file_path_s']):
+                    os.remove(transformation['transformation_file_path_s'])
 
-            # Remove transformation entry from Solr
-            url = f'{SOLR_HOST}{SOLR_COLLECTION}/update?commit=true'
-            requests.post(url, json={'delete': [transformation['id']]})
+                # Remove transformation entry from Solr
+                writer.delete(transformation['id'])
 
 
-def multiprocess_transformation(granule, config, output_path, grids):
+# Arguments shared by every transformation task, set once per worker process
+worker_args = {}
+
+
+def init_worker(config, output_path):
     """
-    Callable function that performs the actual transformation on a granule.
+    Pool initializer storing the arguments shared by all transformation tasks,
+    so they are sent to each worker once instead of with every task.
     """
+    worker_args['config'] = config
+    worker_args['output_path'] = output_path
 
-    # f is file path to granule from solr
-    f = granule.get('pre_transformation_file_path_s', '')
 
-    # Skips granules that weren't harvested properly
-    if f == '':
-        print("ERROR - pre transformation path doesn't exist")
-        return ('', '')
+def multiprocess_transformation(tasks):
+    """
+    Callable function that performs the actual transformation on a chunk of
+    granules. Each task is a (granule file path, remaining transformations)
+    tuple. Returns, for each task, the file path, the grids updated, the year
+    and an error message (empty if the transformation ran).
+    """
+    results = []
 
-    # Get transformations to be completed for this file
-    remaining_transformations = get_remaining_transformations(config, f, grids)
+    for f, remaining_transformations in tasks:
+        # Perform remaining transformations
+        try:
+            grids_updated, year = transformation(f, remaining_transformations, worker_args['output_path'],
+                                                 worker_args['config'], verbose=False)
+        except Exception as e:
+            log.exception(e)
+            results.append((f, [], '', f'{type(e).__name__}: {e}'))
+            continue
 
-    # Perform remaining transformations
-    if remaining_transformations:
-        grids_updated, year = transformation(
-            f, remaining_transformations, output_path, config, verbose=False)
+        results.append((f, grids_updated, year, ''))
 
-        return (grids_updated, year)
-    else:
-        print(
-            f' - CPU id {os.getpid()} no new transformations for {granule["filename_s"]}')
-        return ('', '')
+    return results
 
 
-def main(config, output_path, multiprocessing=False, user_cpus=1, wipe=False, grids_to_use=[]):
+def multiprocess_factors(config, output_path, grid_metadata, hemi, short_name):
+    """
+    Callable function that generates the factors for a single grid and hemisphere.
+    """
+    print(
+        f' - CPU id {os.getpid()} generating {grid_metadata["grid_name_s"]}{hemi} factors')
+
+    return generate_factors(config, grid_metadata, hemi, output_path,
+                            short_name, verbose=False)
+
+
+def main(config, output_path, multiprocessing=False, user_cpus=1, wipe=False, grids_to_use=[],
+         max_chunksize=8, task_timeout=3600, progress_interval=60):
     """
     This function performs all remaining grid/field transformations for all harvested
     granules for a dataset. It also makes use of multiprocessing to perform multiple
     transformations at the same time. After all transformations have been attempted,
     the Solr dataset entry is updated with additional metadata.
+
+    When multiprocessing, results are recorded as each granule finishes and progress
+    is printed every progress_interval seconds. Granules are sent to processes in
+    chunks of up to max_chunksize, and if no granule finishes anywhere in the pool
+    within task_timeout seconds (per granule in a chunk), the remaining granules
+    are abandoned.
     """
 
     dataset_name = config['ds_name']
-    transformation_version = config['t_version']
 
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
+    # Metadata cached by earlier runs in this process may be out of date
+    clear_cache()
+
+    # Keep the decompressed granule cache within its age and size limits
+    evicted = evict_decompressed_granules(
+        f'{output_path}/{dataset_name}/decompressed_granules',
+        max_age_days=config.get('decompressed_max_age_days', DECOMPRESSED_MAX_AGE_DAYS),
+        max_bytes=config.get('decompressed_max_gb', DECOMPRESSED_MAX_BYTES / 1024**3) * 1024**3)
+    if evicted:
+        print(f'Removed {evicted} decompressed granules from the cache')
+
     if wipe:
         print(
             'Removing transformations with out of sync version numbers from Solr and disk')
@@ -177,130 +232,197 @@ def main(config, output_path, multiprocessing=False, user_cpus=1, wipe=False, gr
     # Get all harvested granules for this dataset
     fq = [f'dataset_s:{dataset_name}',
           'type_s:granule', 'harvest_success_b:true']
-    harvested_granules = solr_utils.solr_query(fq)
+    fl = 'pre_transformation_file_path_s,checksum_s,hemisphere_s'
+    harvested_granules = solr_utils.solr_query(fq, fl)
 
     years_updated = defaultdict(list)
 
     # Query for grids
     if not grids_to_use:
         fq = ['type_s:grid']
-        docs = solr_utils.solr_query(fq)
+        docs = solr_utils.solr_query(fq, 'grid_name_s')
         grids = [doc['grid_name_s'] for doc in docs]
     else:
         grids = grids_to_use
 
+    # Find remaining transformations for every granule up front
+    transformation_plan = plan_transformations(
+        config, harvested_granules, grids)
+
+    print(f'{len(transformation_plan)} of {len(harvested_granules)} granules have remaining transformations')
+
     if multiprocessing:
-        # PRE GENERATE FACTORS TO ACCOMODATE MULTIPROCESSING
-        # Query for dataset metadata
+        # Query for dataset and grid metadata, used to locate cached factors
         fq = [f'dataset_s:{dataset_name}', 'type_s:dataset']
-        dataset_metadata = solr_utils.solr_query(fq)[0]
+        dataset_metadata = solr_utils.solr_query(fq, 'short_name_s')[0]
 
-        # Precompute grid factors using one dataset data file
-        # (or one from each hemisphere, if data is hemispherical) before running main loop
-        data_for_factors = []
-        for grid in grids:
-            data_for_factors = []
-            nh_added = False
-            sh_added = False
+        fq = ['type_s:grid']
+        grids_metadata = {doc['grid_name_s']: doc
+                          for doc in solr_utils.solr_query(fq, solr_utils.GRID_FL)}
 
-            # Find appropriate granule(s) to use for factor calculation
-            for granule in harvested_granules:
-                if 'hemisphere_s' in granule.keys():
-                    hemi = f'_{granule["hemisphere_s"]}'
-                else:
-                    hemi = ''
+        # Hemispheres present in the harvested data ('' if data is not stored in hemispheres)
+        hemis = sorted({f'_{granule["hemisphere_s"]}' if 'hemisphere_s' in granule.keys() else ''
+                        for granule in harvested_granules})
 
-                grid_factors = f'{grid}{hemi}_factors_path_s'
-                grid_factors_version = f'{grid}{hemi}_factors_version_f'
+        # One factor generation task for each grid/hemisphere pair not yet in the factor cache
+        factors_tasks = []
+        for grid in grids:
+            for hemi in hemis:
+                source_grid_definition = get_source_grid_definition(
+                    config, hemi)
+                factors_path = get_factors_path(source_grid_definition,
+                                                grids_metadata[grid],
+                                                output_path,
+                                                wet_points_only=config.get('wet_points_only', False))
 
-                if grid_factors in dataset_metadata.keys() and transformation_version == dataset_metadata[grid_factors_version]:
-                    continue
+                if not ea.is_mapping_operator_dir(factors_path):
+                    factors_tasks.append((grid, hemi))
 
-                file_path = granule.get('pre_transformation_file_path_s', '')
-                if file_path:
-                    if hemi:
-                        # Get one of each
-                        if hemi == '_nh' and not nh_added:
-                            data_for_factors.append(granule)
-                            nh_added = True
-                        elif hemi == '_sh' and not sh_added:
-                            data_for_factors.append(granule)
-                            sh_added = True
-                        if nh_added and sh_added:
-                            break
-                    else:
-                        data_for_factors.append(granule)
-                        break
+        pending_grids = [grid for grid in grids
+                         if any(grid == task_grid for task_grid, _ in factors_tasks)]
+        ready_grids = [grid for grid in grids if grid not in pending_grids]
 
-        # Actually perform transformation on chosen granule(s)
-        # This will generate factors and avoid redundant calculations when using multiprocessing
-        for granule in data_for_factors:
-            file_path = granule['pre_transformation_file_path_s']
+        print('\nUSING MULTIPROCESSING. LOW VERBOSITY FOR TRANSFORMATIONS.\n')
 
-            # Get transformations to be completed for this file
-            remaining_transformations = get_remaining_transformations(
-                config, file_path, grids)
+        # Progress of transformation tasks, updated as each one finishes
+        total_tasks = 0
+        completed_tasks = 0
+        failed_tasks = []
+        timed_out_tasks = 0
+        start_time = time.time()
+        last_report = start_time
+
+        with Pool(processes=user_cpus, initializer=init_worker,
+                  initargs=(config, output_path)) as pool:
+            # Factor generation tasks are queued first so they are picked up
+            # before any transformations
+            factors_results = defaultdict(list)
+            for grid, hemi in factors_tasks:
+                factors_results[grid].append(pool.apply_async(
+                    multiprocess_factors, (config, output_path, grids_metadata[grid], hemi,
+                                           dataset_metadata['short_name_s'])))
+
+            def start_transformations(grids_to_transform):
+                tasks = []
+                for f, remaining_transformations in transformation_plan.items():
+                    remaining_transformations = {grid: fields for grid, fields in remaining_transformations.items()
+                                                 if grid in grids_to_transform}
+                    if remaining_transformations:
+                        tasks.append((f, remaining_transformations))
 
-            grids_updated, year = transformation(
-                file_path, remaining_transformations, output_path, config, verbose=True)
+                print(
+                    f'Running {len(tasks)} transformations for {grids_to_transform} grids\n')
 
-            for grid in grids_updated:
-                if year not in years_updated[grid]:
-                    years_updated[grid].append(year)
-        # END PRE GENERATE FACTORS TO ACCOMODATE MULTIPROCESSING
+                # Several tasks per chunk to limit IPC overhead, while keeping
+                # enough chunks to balance the load across processes
+                chunksize = max(1, min(max_chunksize,
+                                       len(tasks) // (4 * user_cpus)))
+                chunks = [tasks[i:i + chunksize]
+                          for i in range(0, len(tasks), chunksize)]
 
-        # BEGIN MULTIPROCESSING
-        # Create list of tuples of function arguments (necessary for using pool.starmap)
-        multiprocess_tuples = [(granule, config, output_path, grids)
-                               for granule in harvested_granules]
+                # [results iterator, remaining tasks, chunksize]
+                return [pool.imap_unordered(multiprocess_transformation, chunks),
+                        len(tasks), chunksize]
 
-        grid_years_list = []
+            running = []
 
-        print('\nUSING MULTIPROCESSING. LOW VERBOSITY FOR TRANSFORMATIONS.\n')
+            # Chunks of later grids queue behind those already submitted, so
+            # stalls are timed pool-wide: from the last finished chunk or
+            # factors task, or from when the pool had nothing to do
+            last_progress = time.time()
 
-        # for grid in grids:
-        print(f'Running transformations for {grids} grids\n')
+            # Grids with cached factors can start right away
+            if ready_grids:
+                running.append(start_transformations(ready_grids))
 
-        with Pool(processes=user_cpus) as pool:
-            grid_years_list = pool.starmap(
-                multiprocess_transformation, multiprocess_tuples)
-            pool.close()
-            pool.join()
+            while pending_grids or running:
+                # Start each remaining grid as soon as its factors are ready
+                for grid in list(pending_grids):
+                    if not all(result.ready() for result in factors_results[grid]):
+                        continue
 
-        for (grids, year) in grid_years_list:
-            if grids and year:
-                for grid in grids:
-                    if year not in years_updated[grid]:
-                        years_updated[grid].append(year)
+                    pending_grids.remove(grid)
+                    last_progress = time.time()
 
-    else:
-        for granule in harvested_granules:
-            # f is file path to granule from solr
-            f = granule.get('pre_transformation_file_path_s', '')
+                    if all(result.successful() and result.get() for result in factors_results[grid]):
+                        running.append(start_transformations([grid]))
+                    else:
+                        print(f'ERROR - unable to generate {grid} factors')
 
-            # Skips granules that weren't harvested properly
-            if f == '':
-                print("ERROR - pre transformation path doesn't exist")
-                continue
+                total_tasks = completed_tasks + sum(batch[1] for batch in running)
 
-            # Get transformations to be completed for this file
-            remaining_transformations = get_remaining_transformations(
-                config, f, grids)
+                if not running:
+                    factors_results[pending_grids[0]][0].wait(1)
+                    last_progress = time.time()
+                    continue
 
-            # Perform remaining transformations
-            if remaining_transformations:
-                grids_updated, year = transformation(
-                    f, remaining_transformations, output_path, config, verbose=True)
-
-                for grid in grids_updated:
-                    if grid in years_updated.keys():
-                        if year not in years_updated[grid]:
-                            years_updated[grid].append(year)
-                    else:
-                        years_updated[grid] = [year]
+                # Record results as they arrive
+                for batch in list(running):
+                    try:
+                        results = batch[0].next(timeout=1)
+                    except StopIteration:
+                        running.remove(batch)
+                        continue
+                    except TimeoutError:
+                        continue
+
+                    batch[1] -= len(results)
+                    last_progress = time.time()
+                    completed_tasks += len(results)
+
+                    for f, grids_updated, year, error in results:
+                        if error:
+                            print(
+                                f'ERROR - transformation of {f} failed: {error}')
+                            failed_tasks.append(f)
+
+                        for grid in grids_updated:
+                            if year not in years_updated[grid]:
+                                years_updated[grid].append(year)
+
+                # Workers generating factors are not stalled, they are not
+                # running transformation chunks yet
+                if any(not result.ready() for results in factors_results.values()
+                       for result in results):
+                    last_progress = time.time()
+
+                # No chunk finished anywhere in the pool for longer than the
+                # slowest chunk may take: the workers are stuck
+                stall_timeout = task_timeout * max([batch[2] for batch in running], default=1)
+                if running and time.time() - last_progress > stall_timeout:
+                    remaining_tasks = sum(batch[1] for batch in running)
+                    print(f'ERROR - no transformation task finished in {stall_timeout}s, '
+                          f'abandoning {remaining_tasks} remaining tasks')
+                    timed_out_tasks += remaining_tasks
+                    completed_tasks += remaining_tasks
+                    running = []
+
+                if time.time() - last_report >= progress_interval or not (pending_grids or running):
+                    last_report = time.time()
+                    elapsed = max(last_report - start_time, 1)
+                    print(f' - {completed_tasks}/{total_tasks} tasks done '
+                          f'({len(failed_tasks)} failed, {timed_out_tasks} timed out) in {elapsed:.0f}s, '
+                          f'{completed_tasks / elapsed:.2f} tasks/s')
+
+            # Abandoned tasks may still be running
+            if timed_out_tasks:
+                pool.terminate()
             else:
-                print(
-                    f' - CPU id {os.getpid()} no new transformations for {granule["filename_s"]}')
+                pool.close()
+            pool.join()
+
+    else:
+        for f, remaining_transformations in transformation_plan.items():
+            # Perform remaining transformations
+            grids_updated, year = transformation(
+                f, remaining_transformations, output_path, config, verbose=True)
+
+            for grid in grids_updated:
+                if year not in years_updated[grid]:
+                    years_updated[grid].append(year)
+
+    # Make all transformation updates visible before querying them
+    solr_utils.solr_commit()
 
     # Query Solr for dataset metadata
     fq = [f'dataset_s:{dataset_name}', 'type_s:dataset']
@@ -309,12 +431,12 @@ def main(config, output_path, multiprocessing=False, user_cpus=1, wipe=False, gr
     # Query Solr for successful transformation documents
     fq = [f'dataset_s:{dataset_name}',
           'type_s:transformation', 'success_b:true']
-    successful_transformations = solr_utils.solr_query(fq)
+    successful_transformations = solr_utils.solr_query(fq, 'id')
 
     # Query Solr for failed transformation documents
     fq = [f'dataset_s:{dataset_name}',
           'type_s:transformation', 'success_b:false']
-    failed_transformations = solr_utils.solr_query(fq)
+    failed_transformations = solr_utils.solr_query(fq, 'id')
 
     transformation_status = f'All transformations successful'
 
@@ -32,13 +32,17 @@ def main(grids_to_use=[], verify=False):
     # Query for Solr Grid-type Documents
     # =====================================================
     fq = ['type_s:grid']
-    docs = solr_utils.solr_query(fq)
+    docs = solr_utils.solr_query(fq, 'grid_name_s,grid_checksum_s')
 
     grids_in_solr = [doc['grid_name_s'] for doc in docs]
 
     # =====================================================
     # Create Solr grid-type document for each missing grid type
     # =====================================================
+    # Hash all grid files at once (unchanged files come from the checksum cache)
+    grid_checksums = file_utils.checksums(
+        [f'grids/{grid_file}' for _, _, grid_file in grids])
+
     for grid_name, grid_type, grid_file in grids:
 
         grid_path = f'grids/{grid_file}'
@@ -55,11 +59,11 @@ def main(grids_to_use=[], verify=False):
             grid_meta['date_added_dt'] = datetime.utcnow().strftime(
                 "%Y-%m-%dT%H:%M:%SZ")
 
-            grid_meta['grid_checksum_s'] = file_utils.md5(grid_path)
+            grid_meta['grid_checksum_s'] = grid_checksums[grid_path]
             update_body.append(grid_meta)
         # Verify grid in solr matches grid file
         else:
-            current_checksum = file_utils.md5(grid_path)
+            current_checksum = grid_checksums[grid_path]
 
             for doc in docs:
                 if doc['grid_name_s'] == grid_name:
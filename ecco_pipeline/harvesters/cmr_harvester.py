@@ -253,7 +253,7 @@ def harvester(config, output_path, grids_to_use=[]):
 
     # Query for existing harvested docs
     fq = ['type_s:granule', f'dataset_s:{dataset_name}']
-    harvested_docs = solr_utils.solr_query(fq)
+    harvested_docs = solr_utils.solr_query(fq, 'id,filename_s,harvest_success_b,download_time_dt')
 
     # Dictionary of existing harvested docs
     # harvested doc filename : solr entry for that doc
@@ -263,7 +263,7 @@ def harvester(config, output_path, grids_to_use=[]):
 
     # Query for existing descendants docs
     fq = ['type_s:descendants', f'dataset_s:{dataset_name}']
-    existing_descendants_docs = solr_utils.solr_query(fq)
+    existing_descendants_docs = solr_utils.solr_query(fq, 'id,date_s,hemisphere_s')
 
     # Dictionary of existing descendants docs
     # descendant doc date : solr entry for that doc
@@ -408,8 +408,7 @@ def harvester(config, output_path, grids_to_use=[]):
                             req.add_header('Authorization',
                                            'Basic {0}'.format(credentials))
                             opener = build_opener(HTTPCookieProcessor())
-                            data = opener.open(req).read()
-                            open(local_fp, 'wb').write(data)
+                            file_utils.download(opener.open(req), local_fp)
 
                         # If file exists locally, but is out of date, download it
                         elif str(datetime.fromtimestamp(os.path.getmtime(local_fp))) <= modified_time:
@@ -421,8 +420,7 @@ def harvester(config, output_path, grids_to_use=[]):
                             req.add_header('Authorization',
                                            'Basic {0}'.format(credentials))
                             opener = build_opener(HTTPCookieProcessor())
-                            data = opener.open(req).read()
-                            open(local_fp, 'wb').write(data)
+                            file_utils.download(opener.open(req), local_fp)
 
                         else:
                             print(
@@ -561,7 +559,7 @@ def harvester(config, output_path, grids_to_use=[]):
 
         # Query for Solr field documents
         fq = ['type_s:field', f'dataset_s:{dataset_name}']
-        field_query = solr_utils.solr_query(fq)
+        field_query = solr_utils.solr_query(fq, 'id,name_s')
 
         body = []
         for field in config['fields']:
@@ -94,7 +94,7 @@ def harvester(config, output_path, grids_to_use=[]):
 
     # Query for existing harvested docs
     fq = ['type_s:granule', f'dataset_s:{dataset_name}']
-    query_docs = solr_utils.solr_query(fq)
+    query_docs = solr_utils.solr_query(fq, 'id,filename_s,harvest_success_b,download_time_dt')
 
     if len(query_docs) > 0:
         for doc in query_docs:
@@ -102,7 +102,7 @@ def harvester(config, output_path, grids_to_use=[]):
 
     # Query for existing descendants docs
     fq = ['type_s:descendants', f'dataset_s:{dataset_name}']
-    existing_descendants_docs = solr_utils.solr_query(fq)
+    existing_descendants_docs = solr_utils.solr_query(fq, 'id,date_s,hemisphere_s')
 
     if len(existing_descendants_docs) > 0:
         for doc in existing_descendants_docs:
@@ -197,7 +197,7 @@ def harvester(config, output_path, grids_to_use=[]):
                         # If file doesn't exist locally, download it
                         if not os.path.exists(local_fp):
                             print(f' - Downloading {filename} to {local_fp}')
-                            with open(local_fp, 'wb') as f:
+                            with file_utils.ChecksumWriter(local_fp) as f:
                                 ftp.retrbinary(
                                     'RETR '+url, f.write, blocksize=262144)
 
@@ -205,7 +205,7 @@ def harvester(config, output_path, grids_to_use=[]):
                         elif datetime.fromtimestamp(os.path.getmtime(local_fp)) <= mod_date_time:
                             print(
                                 f' - Updating {filename} and downloading to {local_fp}')
-                            with open(local_fp, 'wb') as f:
+                            with file_utils.ChecksumWriter(local_fp) as f:
                                 ftp.retrbinary(
                                     'RETR '+url, f.write, blocksize=262144)
                         else:
@@ -335,7 +335,7 @@ def harvester(config, output_path, grids_to_use=[]):
 
         # Query for Solr field documents
         fq = ['type_s:field', f'dataset_s:{dataset_name}']
-        field_query = solr_utils.solr_query(fq)
+        field_query = solr_utils.solr_query(fq, 'id,name_s')
 
         body = []
         for field in config['fields']:
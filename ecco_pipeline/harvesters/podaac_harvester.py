@@ -2,7 +2,7 @@ import logging
 import logging.config
 import os
 from datetime import datetime
-from urllib.request import urlcleanup, urlopen, urlretrieve
+from urllib.request import urlopen
 from xml.etree.ElementTree import parse
 
 import numpy as np
@@ -95,7 +95,7 @@ def harvester(config, output_path, grids_to_use=[]):
 
     # Query for existing harvested docs
     fq = ['type_s:granule', f'dataset_s:{dataset_name}']
-    harvested_docs = solr_utils.solr_query(fq)
+    harvested_docs = solr_utils.solr_query(fq, 'id,filename_s,harvest_success_b,download_time_dt')
 
     # Dictionary of existing harvested docs
     # harvested doc filename (without NRT if applicable) : solr entry for that doc
@@ -105,7 +105,7 @@ def harvester(config, output_path, grids_to_use=[]):
 
     # Query for existing descendants docs
     fq = ['type_s:descendants', f'dataset_s:{dataset_name}']
-    existing_descendants_docs = solr_utils.solr_query(fq)
+    existing_descendants_docs = solr_utils.solr_query(fq, 'id,date_s,hemisphere_s')
 
     # Dictionary of existing descendants docs
     # descendant doc date : solr entry for that doc
@@ -247,8 +247,7 @@ def harvester(config, output_path, grids_to_use=[]):
                         print(
                             f'    - {newfile} is aggregated. Downloading may be slow.')
 
-                    urlcleanup()
-                    urlretrieve(link, local_fp)
+                    file_utils.download(urlopen(link), local_fp)
 
                     # BZ2 compression results in differet MD5 values
                     if 'bz2' not in local_fp:
@@ -277,8 +276,7 @@ def harvester(config, output_path, grids_to_use=[]):
                         print(
                             f'    - {newfile} is aggregated. Downloading may be slow.')
 
-                    urlcleanup()
-                    urlretrieve(link, local_fp)
+                    file_utils.download(urlopen(link), local_fp)
 
                     # BZ2 compression results in differet MD5 values
                     if 'bz2' not in local_fp:
@@ -524,7 +522,7 @@ def harvester(config, output_path, grids_to_use=[]):
 
         # Query for Solr field documents
         fq = ['type_s:field', f'dataset_s:{dataset_name}']
-        field_query = solr_utils.solr_query(fq)
+        field_query = solr_utils.solr_query(fq, 'id,name_s')
 
         body = []
         for field in config['fields']:
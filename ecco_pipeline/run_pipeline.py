@@ -64,11 +64,11 @@ def create_parser():
                         help='updates Solr with grids in grids_config')
 
     parser.add_argument('--single_processing', default=False, action='store_true',
-                        help='turns off the use of multiprocessing during transformation')
+                        help='turns off the use of multiprocessing during transformation and aggregation')
 
     parser.add_argument('--multiprocesses', type=int, choices=range(1, cpu_count()+1),
                         default=int(cpu_count()/2), metavar=f'[1, {cpu_count()}]',
-                        help=f'sets the number of multiprocesses used during transformation with a \
+                        help=f'sets the number of multiprocesses used during transformation and aggregation with a \
                             system max of {cpu_count()} with default set to half of system max')
 
     parser.add_argument('--harvested_entry_validation', default=False, action='store_true',
@@ -176,7 +176,7 @@ def run_transformation(datasets, output_dir, multiprocessing, user_cpus, wipe, g
         print('=========================================================')
 
 
-def run_aggregation(datasets, output_dir, grids_to_use):
+def run_aggregation(datasets, output_dir, multiprocessing, user_cpus, grids_to_use):
     print('\n=========================================================')
     print(
         '================ \033[36mRunning aggregations\033[0m ===================')
@@ -189,7 +189,8 @@ def run_aggregation(datasets, output_dir, grids_to_use):
             with open(Path(f'conf/ds_configs/{ds}.yaml'), 'r') as stream:
                 config = yaml.load(stream, yaml.Loader)
 
-            status = aggregation(output_dir, config, grids_to_use)
+            status = aggregation(output_dir, config, grids_to_use,
+                                 multiprocessing, user_cpus)
             ds_status[ds].append(status)
 
             log.info(f'{ds} aggregation complete. {status}')
@@ -246,9 +247,9 @@ if __name__ == '__main__':
     user_cpus = args.multiprocesses
 
     if multiprocessing:
-        print(f'Using {user_cpus} processes for multiprocess transformations')
+        print(f'Using {user_cpus} processes for multiprocess transformations and aggregations')
     else:
-        print('Using single process transformations')
+        print('Using single process transformations and aggregations')
 
     # ------------------- Run pipeline -------------------
     while True:
@@ -278,7 +279,8 @@ if __name__ == '__main__':
             run_harvester([ds], OUTPUT_DIR, grids_to_use)
             run_transformation([ds], OUTPUT_DIR, multiprocessing,
                                user_cpus, wipe, grids_to_use)
-            run_aggregation([ds], OUTPUT_DIR, grids_to_use)
+            run_aggregation([ds], OUTPUT_DIR, multiprocessing,
+                            user_cpus, grids_to_use)
 
     # Run harvester
     elif chosen_option == '2':
@@ -332,11 +334,13 @@ if __name__ == '__main__':
             run_transformation([wanted_ds], OUTPUT_DIR,
                                multiprocessing, user_cpus, wipe, grids_to_use)
         if 'aggregate' in wanted_steps:
-            run_aggregation([wanted_ds], OUTPUT_DIR, grids_to_use)
+            run_aggregation([wanted_ds], OUTPUT_DIR, multiprocessing,
+                            user_cpus, grids_to_use)
         if wanted_steps == 'all':
             run_harvester([wanted_ds], OUTPUT_DIR, grids_to_use)
             run_transformation([wanted_ds], OUTPUT_DIR,
                                multiprocessing, user_cpus, wipe, grids_to_use)
-            run_aggregation([wanted_ds], OUTPUT_DIR, grids_to_use)
+            run_aggregation([wanted_ds], OUTPUT_DIR, multiprocessing,
+                            user_cpus, grids_to_use)
 
     print_statuses()
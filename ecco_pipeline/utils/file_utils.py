@@ -1,17 +1,204 @@
 import hashlib
+import os
 import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from conf.global_settings import ROOT_DIR
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Files are hashed in large reads to limit system call overhead
+CHECKSUM_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Persistent cache of file checksums, keyed on path, size, mtime and inode
+CHECKSUM_CACHE_PATH = os.path.join(ROOT_DIR, 'logs', 'checksum_cache.db')
+
+
+def new_hash(algorithm='md5'):
+    """
+    Returns a new hash object for algorithm. xxhash algorithms (xxh64,
+    xxh3_64, xxh3_128) need the optional xxhash package, any other algorithm
+    is taken from hashlib.
+    """
+    if algorithm.startswith('xxh'):
+        if xxhash is None:
+            raise ValueError(
+                f'{algorithm} checksums require the xxhash package')
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+def format_checksum(hash_obj, algorithm='md5'):
+    """
+    Returns the digest of hash_obj. Digests from algorithms other than md5 are
+    prefixed with the algorithm name (e.g. 'blake2b:...'), so a checksum
+    records how it was made. md5 digests are left as is: checksums stored in
+    Solr (checksum_s, transformation_checksum_s, grid_checksum_s) are md5 and
+    are compared with existing entries and those published by data providers,
+    so they must keep using md5.
+    """
+    if algorithm == 'md5':
+        return hash_obj.hexdigest()
+    return f'{algorithm}:{hash_obj.hexdigest()}'
+
+
+# One cache connection per thread of each process, as connections should not
+# be shared across threads or forks
+_checksum_cache = threading.local()
+
+
+def _get_checksum_cache():
+    if getattr(_checksum_cache, 'pid', None) != os.getpid():
+        os.makedirs(os.path.dirname(CHECKSUM_CACHE_PATH), exist_ok=True)
+        connection = sqlite3.connect(CHECKSUM_CACHE_PATH, timeout=60,
+                                     isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS checksums ('
+                           'path TEXT, algorithm TEXT, size INTEGER, mtime_ns INTEGER, '
+                           'inode INTEGER, checksum TEXT, PRIMARY KEY (path, algorithm))')
+        _checksum_cache.connection = connection
+        _checksum_cache.pid = os.getpid()
+
+    return _checksum_cache.connection
+
+
+def _stat_key(fname):
+    stat = os.stat(fname)
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def get_cached_checksum(fname, algorithm='md5'):
+    """
+    Returns the cached checksum of fname, or None if the file has changed
+    (different size, mtime or inode) since it was cached
+    """
+    fname = os.path.abspath(fname)
+    try:
+        row = _get_checksum_cache().execute(
+            'SELECT size, mtime_ns, inode, checksum FROM checksums WHERE path = ? AND algorithm = ?',
+            (fname, algorithm)).fetchone()
+    except sqlite3.Error as e:
+        print(f'Unable to read checksum cache: {e}')
+        return None
+
+    if row and tuple(row[:3]) == _stat_key(fname):
+        return row[3]
+    return None
+
+
+def cache_checksum(fname, checksum, algorithm='md5'):
+    """
+    Records the checksum of fname, as the file currently is, in the cache
+    """
+    fname = os.path.abspath(fname)
+    try:
+        _get_checksum_cache().execute(
+            'INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)',
+            (fname, algorithm, *_stat_key(fname), checksum))
+    except sqlite3.Error as e:
+        print(f'Unable to update checksum cache: {e}')
+
+
+def checksum(fname, algorithm='md5', use_cache=True):
+    """
+    Creates checksum from file, using the checksum cache so unchanged files
+    are never re-read
+    """
+    if use_cache:
+        cached = get_cached_checksum(fname, algorithm)
+        if cached:
+            return cached
+
+    hash_obj = new_hash(algorithm)
+    buffer = bytearray(CHECKSUM_BUFFER_SIZE)
+    view = memoryview(buffer)
+
+    with open(fname, 'rb', buffering=0) as f:
+        for n in iter(lambda: f.readinto(buffer), 0):
+            hash_obj.update(view[:n])
+
+    file_checksum = format_checksum(hash_obj, algorithm)
+
+    if use_cache:
+        cache_checksum(fname, file_checksum, algorithm)
+
+    return file_checksum
+
+
+def checksums(fnames, algorithm='md5', use_cache=True, max_workers=8):
+    """
+    Creates checksums for a batch of files in parallel. Returns a dictionary
+    where the keys are file names and the values are checksums.
+    """
+    fnames = list(fnames)
+
+    # hashlib releases the GIL while hashing large buffers, so threads hash
+    # several files at once
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        file_checksums = executor.map(
+            lambda fname: checksum(fname, algorithm, use_cache), fnames)
+
+        return dict(zip(fnames, file_checksums))
+
+
+class ChecksumWriter():
+    """
+    Binary file writer that hashes data as it is written, so the checksum of a
+    new file is known without reading it back. When the writer is closed the
+    checksum is stored in checksum and recorded in the checksum cache.
+
+        with file_utils.ChecksumWriter(local_fp) as f:
+            ftp.retrbinary('RETR ' + url, f.write)
+        item['checksum_s'] = f.checksum
+    """
+
+    def __init__(self, fname, algorithm='md5'):
+        self.fname = fname
+        self.algorithm = algorithm
+        self.hash_obj = new_hash(algorithm)
+        self.file = open(fname, 'wb')
+        self.checksum = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+
+        # Partially written files are left out of the cache
+        if exc_type is None:
+            self.checksum = format_checksum(self.hash_obj, self.algorithm)
+            cache_checksum(self.fname, self.checksum, self.algorithm)
+
+        return False
+
+    def write(self, data):
+        self.hash_obj.update(data)
+        return self.file.write(data)
+
+
+def download(response, fname, algorithm='md5'):
+    """
+    Streams an open HTTP response (e.g. from urlopen) to fname, hashing the
+    data as it is written. Returns the checksum of the file.
+    """
+    with response, ChecksumWriter(fname, algorithm) as f:
+        for chunk in iter(lambda: response.read(CHECKSUM_BUFFER_SIZE), b''):
+            f.write(chunk)
+
+    return f.checksum
 
 
 def md5(fname):
     """
     Creates md5 checksum from file
     """
-    hash_md5 = hashlib.md5()
-
-    with open(fname, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+    return checksum(fname, 'md5')
 
 
 def get_date(regex, fname):
@@ -7,35 +7,289 @@ import requests
 
 from conf.global_settings import SOLR_COLLECTION, SOLR_HOST
 
+# Default time (ms) within which Solr commits buffered updates
+COMMIT_WITHIN = 10000
 
-def solr_query(fq, fl=''):
-    getVars = {'q': '*:*',
-               'fq': fq,
-               'fl': fl,
-               'rows': 300000}
+# Field lists (fl) of queries. Queries return only ids unless given an fl,
+# ALL_FL returns whole documents
+DEFAULT_FL = 'id'
+ALL_FL = '*'
 
-    url = f'{SOLR_HOST}{SOLR_COLLECTION}/select?'
-    try:
-        response = requests.get(url, params=getVars, headers={
-                                'Connection': 'close'})
-    except:
-        time.sleep(5)
-        response = requests.get(url, params=getVars, headers={
-                                'Connection': 'close'})
+FIELD_FL = 'id,name_s,standard_name_s,long_name_s,units_s'
 
-    return response.json()['response']['docs']
+GRID_FL = 'id,grid_name_s,grid_type_s,grid_path_s,grid_checksum_s'
+
+# Fields written to granule docs by the harvesters
+GRANULE_FL = ('id,type_s,date_s,dataset_s,filename_s,source_s,modified_time_dt,'
+              'download_time_dt,harvest_success_b,pre_transformation_file_path_s,'
+              'file_size_l,checksum_s,hemisphere_s')
+
+# Fields written to transformation docs by grid transformation
+TRANSFORMATION_FL = ('id,type_s,date_s,dataset_s,pre_transformation_file_path_s,'
+                     'hemisphere_s,origin_checksum_s,grid_name_s,field_s,'
+                     'transformation_in_progress_b,success_b,filename_s,'
+                     'transformation_file_path_s,transformation_completed_dt,'
+                     'transformation_checksum_s,transformation_version_f')
+
+# Fields written to aggregation docs by aggregation
+AGGREGATION_FL = ('id,type_s,dataset_s,year_s,grid_name_s,field_s,aggregation_time_dt,'
+                  'aggregation_success_b,aggregation_version_s,transformation_count_l,'
+                  'notes_s,aggregated_*_path_s,aggregated_*_checksum_s,*_aggregated_uuid_s')
+
+
+class SolrClient():
+    """
+    Solr client built around a requests Session, so connections are kept
+    alive and reused across queries and updates. Failed requests (connection
+    errors, timeouts and 5xx responses) are retried with exponential backoff,
+    and large result sets are streamed page by page using cursorMark.
+
+    Only idempotent requests are retried: a failed request may still have been
+    applied by Solr, and resending a new document without an id would add it
+    twice.
+    """
+
+    def __init__(self, host=SOLR_HOST, collection=SOLR_COLLECTION, retries=3,
+                 backoff=1, timeout=60, page_size=10000, pool_size=10):
+        self.url = f'{host}{collection}'
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.page_size = page_size
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, retry=True, **kwargs):
+        """
+        Sends a request to the Solr collection, retrying on failure unless
+        retry is False. Returns the final response, or raises the final
+        exception.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+
+        retries = self.retries if retry else 0
+
+        for attempt in range(retries + 1):
+            try:
+                response = self.session.request(
+                    method, f'{self.url}/{path}', **kwargs)
+                if response.status_code < 500 or attempt == retries:
+                    return response
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+
+            time.sleep(self.backoff * 2**attempt)
+
+    def iter_docs(self, fq, fl=DEFAULT_FL, sort='id asc'):
+        """
+        Generator yielding all documents matching the filter queries fq,
+        fetched in pages of page_size documents. fl lists the returned
+        fields, only ids by default (ALL_FL for whole documents).
+        """
+        params = {'q': '*:*',
+                  'fq': fq,
+                  'fl': fl,
+                  'sort': sort,
+                  'rows': self.page_size,
+                  'cursorMark': '*'}
+
+        while True:
+            response = self.request('get', 'select', params=params)
+            response.raise_for_status()
+            response = response.json()
+
+            yield from response['response']['docs']
+
+            # Last page reached when the cursor stops moving
+            if response['nextCursorMark'] == params['cursorMark']:
+                break
+            params['cursorMark'] = response['nextCursorMark']
+
+    def query(self, fq, fl=DEFAULT_FL):
+        """
+        Returns a list of all documents matching the filter queries fq.
+        """
+        return list(self.iter_docs(fq, fl))
+
+    def update(self, update_body, commit=True, commit_within=None):
+        """
+        Posts update_body to the Solr update handler and returns the response.
+        If commit is False and commit_within (ms) is given, Solr commits the
+        update on its own within that time. Updates adding documents without
+        an id are not retried, as they are not idempotent.
+        """
+        if commit:
+            params = {'commit': 'true'}
+        elif commit_within is not None:
+            params = {'commitWithin': int(commit_within)}
+        else:
+            params = {}
+        return self.request('post', 'update', retry=is_idempotent(update_body),
+                            params=params, json=update_body)
+
+
+def is_idempotent(update_body):
+    """
+    Returns whether update_body can safely be sent more than once: it does
+    not add any document without an id (Solr would give each copy a new id).
+    Commands such as commits and deletes are idempotent.
+    """
+    if isinstance(update_body, list):
+        return all(isinstance(doc, dict) and 'id' in doc for doc in update_body)
+    return True
+
+
+class SolrWriter():
+    """
+    Context manager that buffers Solr add/update documents and deletes, and
+    posts them in batches. A batch is sent once batch_size entries are
+    buffered or flush_interval seconds have passed since the last one.
+    Updates are made visible with commitWithin (ms) if commit_within is
+    given, otherwise with a single commit when the context exits.
+
+    Buffered documents are sent before buffered deletes, so a document should
+    not be both updated and deleted within one batch. Failed batches are kept in
+    failures as (batch, error) tuples and reported on exit.
+
+        with solr_utils.SolrWriter() as writer:
+            writer.add({'id': doc_id, 'success_b': {'set': True}})
+    """
+
+    def __init__(self, batch_size=1000, flush_interval=30, commit_within=None, verbose=True):
+        self.client = get_client()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.commit_within = commit_within
+        self.verbose = verbose
+
+        self.docs = []
+        self.deletes = []
+        self.delete_queries = []
+        self.failures = []
+        self.last_flush = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+        if self.commit_within is None:
+            self.commit()
+
+        if self.failures and self.verbose:
+            print(f'Failed to update Solr for {len(self.failures)} batch(es):')
+            for batch, error in self.failures:
+                print(f' - {len(batch)} entries: {error}')
+
+        return False
+
+    def add(self, doc):
+        """
+        Buffers a new document or an atomic update of an existing document.
+        """
+        self.docs.append(doc)
+        self._maybe_flush()
+
+    def delete(self, doc_id):
+        """
+        Buffers the deletion of a document by id.
+        """
+        self.deletes.append(doc_id)
+        self._maybe_flush()
+
+    def delete_query(self, query):
+        """
+        Buffers the deletion of all documents matching query.
+        """
+        self.delete_queries.append(query)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self.docs) + len(self.deletes) + len(self.delete_queries) >= self.batch_size or \
+                time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def _post(self, batch, update_body):
+        try:
+            r = self.client.update(update_body, commit=False,
+                                   commit_within=self.commit_within)
+            if r.status_code != 200:
+                self.failures.append((batch, f'{r.status_code} {r.text}'))
+        except Exception as e:
+            self.failures.append((batch, e))
+
+    def flush(self):
+        """
+        Posts all buffered documents and deletes.
+        """
+        if self.docs:
+            self._post(self.docs, self.docs)
+        if self.deletes:
+            self._post(self.deletes, {'delete': self.deletes})
+        for query in self.delete_queries:
+            self._post([query], {'delete': {'query': query}})
+
+        self.docs = []
+        self.deletes = []
+        self.delete_queries = []
+        self.last_flush = time.time()
+
+    def commit(self):
+        """
+        Commits all updates sent so far.
+        """
+        try:
+            r = solr_commit()
+            if r.status_code != 200:
+                self.failures.append(([], f'commit {r.status_code} {r.text}'))
+        except Exception as e:
+            self.failures.append(([], e))
+
+
+# One client per process, as sessions should not be shared across forks
+_client = None
+_client_pid = None
+
+
+def get_client():
+    """
+    Returns the Solr client for the current process.
+    """
+    global _client, _client_pid
+
+    if _client is None or _client_pid != os.getpid():
+        _client = SolrClient()
+        _client_pid = os.getpid()
+
+    return _client
+
+
+def solr_query(fq, fl=DEFAULT_FL):
+    return get_client().query(fq, fl)
+
+
+def solr_query_iter(fq, fl=DEFAULT_FL):
+    return get_client().iter_docs(fq, fl)
 
 
 def solr_update(update_body, r=False):
-    url = f'{SOLR_HOST}{SOLR_COLLECTION}/update?commit=true'
-    response = requests.post(url, json=update_body)
+    response = get_client().update(update_body)
     if r:
         return response
 
 
+def solr_commit():
+    return get_client().update({'commit': {}}, commit=False)
+
+
 def ping_solr():
-    url = f'{SOLR_HOST}{SOLR_COLLECTION}/admin/ping'
-    requests.get(url)
+    get_client().request('get', 'admin/ping')
     return
 
 
@@ -54,7 +308,7 @@ def check_grids():
 
 
 def validate_granules():
-    granules = solr_query(['type_s=granule'])
+    granules = solr_query(['type_s=granule'], 'id,pre_transformation_file_path_s')
     docs_to_remove = []
 
     for granule in granules:
@@ -86,7 +340,7 @@ def clean_solr(config, grids_to_use):
     # Query for grids
     if not grids_to_use:
         fq = ['type_s:grid']
-        docs = solr_query(fq)
+        docs = solr_query(fq, 'grid_name_s')
         grids = [doc['grid_name_s'] for doc in docs]
     else:
         grids = grids_to_use
@@ -108,10 +362,8 @@ def clean_solr(config, grids_to_use):
 
     # Remove entries earlier than config start date
     fq = f'dataset_s:{dataset_name} AND date_s:[* TO {config_start}}}'
-    url = f'{SOLR_HOST}{SOLR_COLLECTION}/update?commit=true'
-    requests.post(url, json={'delete': {'query': fq}})
+    solr_update({'delete': {'query': fq}})
 
     # Remove entries later than config end date
     fq = f'dataset_s:{dataset_name} AND date_s:{{{config_end} TO *]'
-    url = f'{SOLR_HOST}{SOLR_COLLECTION}/update?commit=true'
-    requests.post(url, json={'delete': {'query': fq}})
+    solr_update({'delete': {'query': fq}})
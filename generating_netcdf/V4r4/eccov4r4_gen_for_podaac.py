@@ -473,48 +473,72 @@ def generate_netcdfs(output_freq_code, job_id:int, num_jobs:int, \
 
         ##% CALCULATE GRID-TO-GRID MAPPING FACTORS
         print('\nGrid Mappings')
+        # mapping factors are saved as memory-mappable mapping operators,
+        # one for all points of the ECCO grid and one for each level.
+        grid_mapping_dir = mapping_factors_dir / "ecco_latlon_mapping_operators"
+
+        # mapping factors pickled by earlier versions of this script
         grid_mapping_fname = mapping_factors_dir / "ecco_latlon_grid_mappings.p"
 
         if debug_mode:
             print('...DEBUG MODE -- SKIPPING GRID MAPPINGS')
-            grid_mappings_all = []
-            grid_mappings_k = []
+            mapping_operator_all = []
+            mapping_operators_k = []
         else:
 
-            if 'grid_mappings_k' not in globals():
+            if 'mapping_operators_k' not in globals():
 
                 # first check to see if you have already calculated the grid mapping factors
-                if grid_mapping_fname.is_file():
+                if ea.is_mapping_operator_dir(grid_mapping_dir / 'all'):
                     # if so, load
-                    print('... loading latlon_grid_mappings.p')
+                    print('... loading latlon mapping operators')
+
+                    mapping_operator_all = \
+                        ea.load_mapping_operator(grid_mapping_dir / 'all')
 
-                    [grid_mappings_all, grid_mappings_k] = \
-                        pickle.load(open(grid_mapping_fname, 'rb'))
+                    grid_mapping_operators_k = \
+                        [ea.load_mapping_operator(grid_mapping_dir / f'k_{k:02d}') \
+                         for k in range(nk)]
 
                 else:
-                    # if not, make new grid mapping factors
-                    print('... no mapping factors found, recalculating')
-
-    			    # find the mapping between all points of the ECCO grid and the target grid.
-                    grid_mappings_all = \
-                        ea.find_mappings_from_source_to_target(source_grid_all,\
-                                                               target_grid,\
-                                                               target_grid_radius, \
-                                                               source_grid_min_L, \
-                                                               source_grid_max_L)
-
-                    # then find the mapping factors between all wet points of the ECCO grid
-                    # at each vertical level and the target grid
-                    grid_mappings_k = dict()
-
-                    for k in range(nk):
-                        print(k)
-                        grid_mappings_k[k] = \
-                            ea.find_mappings_from_source_to_target(source_grid_k[k],\
-                                                                   target_grid,\
-                                                                   target_grid_radius, \
-                                                                   source_grid_min_L, \
-                                                                   source_grid_max_L)
+                    if grid_mapping_fname.is_file():
+                        # convert the pickled mapping factors
+                        print('... converting latlon_grid_mappings.p')
+
+                        [grid_mappings_all, grid_mappings_k] = \
+                            pickle.load(open(grid_mapping_fname, 'rb'))
+
+                        mapping_operator_all = \
+                            ea.compile_mapping_operator(*grid_mappings_all)
+
+                        grid_mapping_operators_k = \
+                            [ea.compile_mapping_operator(*grid_mappings_k[k]) \
+                             for k in range(nk)]
+
+                    else:
+                        # if not, make new grid mapping factors
+                        print('... no mapping factors found, recalculating')
+
+                        # find the mapping between all points of the ECCO grid and the target grid.
+                        mapping_operator_all = \
+                            ea.find_mapping_operator_from_source_to_target(source_grid_all,\
+                                                                           target_grid,\
+                                                                           target_grid_radius, \
+                                                                           source_grid_min_L, \
+                                                                           source_grid_max_L)
+
+                        # then find the mapping factors between all wet points of the ECCO grid
+                        # at each vertical level and the target grid
+                        grid_mapping_operators_k = []
+
+                        for k in range(nk):
+                            print(k)
+                            grid_mapping_operators_k.append(\
+                                ea.find_mapping_operator_from_source_to_target(source_grid_k[k],\
+                                                                               target_grid,\
+                                                                               target_grid_radius, \
+                                                                               source_grid_min_L, \
+                                                                               source_grid_max_L))
                     if not mapping_factors_dir.exists():
                         try:
                             mapping_factors_dir.mkdir()
@@ -522,12 +546,26 @@ def generate_netcdfs(output_freq_code, job_id:int, num_jobs:int, \
                             print ('cannot make %s ' % mapping_factors_dir)
 
                     try:
-                        pickle.dump([grid_mappings_all, grid_mappings_k], \
-                                    open(grid_mapping_fname, 'wb'))
+                        ea.save_mapping_operator(mapping_operator_all, grid_mapping_dir / 'all')
+                        for k in range(nk):
+                            ea.save_mapping_operator(grid_mapping_operators_k[k], \
+                                                     grid_mapping_dir / f'k_{k:02d}')
                     except:
-                        print('cannot make %s ' % mapping_factors_dir)
+                        print('cannot make %s ' % grid_mapping_dir)
+
+                # point the mapping operator of each level into the full
+                # native (tile, j, i) field.  all levels of a 3D field can
+                # then be mapped to the lat-lon grid in one call
+                print('... preparing mapping operators for levels 1..nk')
+                native_shape = ecco_grid.hFacC.shape[1:]
+                mapping_operators_k = []
+                for k in range(nk):
+                    wet_pts_k_flat = np.ravel_multi_index(wet_pts_k[k], native_shape)
+                    mapping_operators_k.append(\
+                        ea.remap_mapping_operator_source(grid_mapping_operators_k[k],
+                                                         wet_pts_k_flat))
             else:
-                print('... grid mappings k already in memory')
+                print('... mapping operators already in memory')
 
 
         # make a land mask in lat-lon using hfacC
@@ -549,23 +587,13 @@ def generate_netcdfs(output_freq_code, job_id:int, num_jobs:int, \
                 else:
                     # if not, recalculate.
                     print('.... making new land_mask_ll')
-                    land_mask_ll = np.zeros((nk, target_grid_shape[0], target_grid_shape[1]))
-
-                    source_indices_within_target_radius_i, \
-                    num_source_indices_within_target_radius_i,\
-                    nearest_source_index_to_target_index_i = grid_mappings_all
-
-                    for k in range(nk):
-                        print(k)
+                    # all levels in one gather
+                    source_stack = ecco_land_mask_c_nan.values.reshape(nk, -1)
 
-                        source_field = ecco_land_mask_c_nan.values[k,:].ravel()
-
-                        land_mask_ll[k,:] =  \
-                            ea.transform_to_target_grid(source_indices_within_target_radius_i,
-                                                        num_source_indices_within_target_radius_i,
-                                                        nearest_source_index_to_target_index_i,
-                                                        source_field, target_grid_shape,\
-                                                        operation='nearest', allow_nearest_neighbor=True)
+                    land_mask_ll =  \
+                        ea.transform_stack_to_target_grid(mapping_operator_all,
+                                                          source_stack, target_grid_shape,\
+                                                          operation='nearest', allow_nearest_neighbor=True)
                     if not mapping_factors_dir.exists():
                         try:
                             mapping_factors_dir.mkdir()
@@ -578,6 +606,13 @@ def generate_netcdfs(output_freq_code, job_id:int, num_jobs:int, \
             else:
                 print('... land mask already in memory')
 
+            # restrict the mapping operator of each level to its wet lat-lon
+            # points, so only ocean cells are regridded
+            print('... compressing mapping operators to wet points')
+            mapping_operators_k = \
+                [ea.compress_mapping_operator(mapping_operators_k[k], land_mask_ll[k]) \
+                 for k in range(nk)]
+
 
         ## MAKE LAT AND LON BOUNDS FOR NEW DATA ARRAYS
         lat_bounds = np.zeros((dims[1],2))
@@ -823,22 +858,13 @@ def generate_netcdfs(output_freq_code, job_id:int, num_jobs:int, \
                                                less_output = True,
                                                use_xmitgcm=False)
 
-                        F_wet_native = F[wet_pts_k[0]]
-
-                        # get mapping factors for the the surface level
-                        source_indices_within_target_radius_i, \
-                        num_source_indices_within_target_radius_i,\
-                        nearest_source_index_to_target_index_i = grid_mappings_k[0]
-
-                        # transform to new grid
+                        # transform to new grid using the mapping operator
+                        # of the surface level
                         F_ll =  \
-                            ea.transform_to_target_grid(source_indices_within_target_radius_i,
-                                                 num_source_indices_within_target_radius_i,
-                                                 nearest_source_index_to_target_index_i,
-                                                 F_wet_native,\
-                                                 target_grid_shape,\
-                                                 operation='mean', \
-                                                 allow_nearest_neighbor=True)
+                            ea.apply_mapping_operator(mapping_operators_k[0],
+                                                      F, target_grid_shape,\
+                                                      operation='mean', \
+                                                      allow_nearest_neighbor=True)
 
                         F_ll_masked = np.expand_dims(F_ll * land_mask_ll[0,:],0)
 
@@ -859,21 +885,11 @@ def generate_netcdfs(output_freq_code, job_id:int, num_jobs:int, \
 
                         F_ll = np.zeros((nk,360,720))
 
-                        for k in range(max_k):
-                            #print(var,k)
-                            F_k = F[k]
-                            F_wet_native = F_k[wet_pts_k[k]]
-
-                            source_indices_within_target_radius_i, \
-                            num_source_indices_within_target_radius_i,\
-                            nearest_source_index_to_target_index_i = grid_mappings_k[k]
-
-                            F_ll[k,:] =  \
-                                ea.transform_to_target_grid(source_indices_within_target_radius_i,
-                                     num_source_indices_within_target_radius_i,
-                                     nearest_source_index_to_target_index_i,
-                                     F_wet_native, target_grid_shape,\
-                                     operation='mean', allow_nearest_neighbor=True)
+                        # transform levels 1..max_k to new grid in one call
+                        F_ll[:max_k,:] =  \
+                            ea.transform_stack_to_target_grid(mapping_operators_k[:max_k],
+                                 F[:max_k].reshape(max_k, -1), target_grid_shape,\
+                                 operation='mean', allow_nearest_neighbor=True)
 
 
                         # multiple by land mask